@@ -48,14 +48,26 @@ def usage(error=''):
         print(u'Error: %s' % error)
         print(u'')
 
-    print(u'Usage: remotedev -E|--execenv -D|--devenv <-c|--conf "config filepath"> <-p|--prof "profile name"> <-d|--debug> <-h|--help>')
+    print(u'Usage: remotedev -E|--execenv -D|--devenv <-c|--conf "config filepath"> <-p|--prof "profile name"> <-d|--debug> <--stats> <--profile "output dir"> <--profile-stacks> <--capture "capture filepath"> <-h|--help>')
     print(u' -E|--execenv: launch remotedev with execution env behavior, send updated files from mapped directories to development env and send log messages.')
     print(u' -D|--devenv: launch remotedev with development env behavior, send files from your cloned repo to remote.')
     print(u' -c|--conf: configuration filepath. If not specify use user home dir one')
     print(u' -p|--prof: profile name to launch (doesn\'t launch wizard)')
     print(u' -d|--debug: enable debug.')
+    print(u' --stats: display metrics of running remotedev instance (execenv or devenv) and exit.')
+    print(u' --profile: profile all remotedev threads and write stats by thread role in specified directory on exit (and on SIGUSR1).')
+    print(u' --profile-stacks: with --profile, also sample threads stacks and write collapsed stacks for flamegraphs.')
+    print(u' --capture: record all sent and received requests in specified file (gzipped if it ends with .gz). Replay it with scripts/replay.py.')
     print(u' -v|--version: display version.')
     print(u' -h|--help: display this help.')
+    print(u'')
+    print(u'Usage: remotedev logs <-c|--conf "config filepath"> <-p|--prof "profile name"> <--db "store filepath"> <-l|--level LEVEL> <-n|--logger NAME> <--since TIME> <--until TIME> <-t|--text TEXT> <--fts> <--limit COUNT>')
+    print(u' Search logs stored by devenv (profile option "log_store" must be enabled).')
+    print(u' TEXT is searched as a phrase (words in this order, punctuation ignored). With --fts, TEXT is a sqlite full text search query (AND, OR, NOT, prefix*...)')
+    print(u' TIME can be a date ("2019-01-31 12:00:00", "12:00") or a duration before now ("30s", "10m", "2h", "1d")')
+    print(u'')
+    print(u'Usage: remotedev pull <-c|--conf "config filepath"> <-p|--prof "profile name"> <--timeout SECONDS> PATH [PATH...]')
+    print(u' Pull content of lazy files (files bigger than execenv profile option "lazy_pull_threshold") through running devenv.')
 
 def version():
     """
@@ -75,6 +87,9 @@ def application_parameters():
                 debug (bool): True if debug enabled
                 conf (string): Path of config file to open
                 prof (string): profile name to launch (drop startup select wizard)
+                profile_dir (string): directory where profiling stats are written (None to disable profiling)
+                profile_stacks (bool): True to sample threads stacks while profiling
+                capture (string): file where requests are recorded (None to disable capture)
             }
     """
     params = {
@@ -84,11 +99,15 @@ def application_parameters():
         u'prof': None,
         u'first_prof': False,
         u'log_level': logging.INFO,
-        u'log_file': None
+        u'log_file': None,
+        u'stats': False,
+        u'profile_dir': None,
+        u'profile_stacks': False,
+        u'capture': None
     }
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], u'EDhdc:vp:S', [u'execenv', u'devenv', u'help', u'debug', u'conf=', u'version', u'prof=', u'service'])
+        opts, args = getopt.getopt(sys.argv[1:], u'EDhdc:vp:S', [u'execenv', u'devenv', u'help', u'debug', u'conf=', u'version', u'prof=', u'service', u'stats', u'profile=', u'profile-stacks', u'capture='])
 
         for opt, arg in opts:
             if opt in (u'-E', u'--execenv'):
@@ -114,6 +133,14 @@ def application_parameters():
             elif opt in (u'-p', u'--prof'):
                 params[u'prof'] = arg
                 #profile existence will be checked later
+            elif opt == u'--stats':
+                params[u'stats'] = True
+            elif opt == u'--profile':
+                params[u'profile_dir'] = arg
+            elif opt == u'--profile-stacks':
+                params[u'profile_stacks'] = True
+            elif opt == u'--capture':
+                params[u'capture'] = os.path.abspath(arg)
             elif opt in (u'-S', u'--service'):
                 #daemon mode, use config from /etc/default/remotedev.conf
                 params[u'log_file'] = u'/var/log/remotedev.log'
@@ -130,6 +157,8 @@ def application_parameters():
                     params[u'first_prof'] = True
 
         #check some parameters
+        if params[u'profile_stacks'] and not params[u'profile_dir']:
+            raise Exception(u'--profile-stacks needs --profile option')
         if not params[u'execenv'] and not params[u'devenv']:
             #select devenv by default
             params[u'devenv'] = True
@@ -187,23 +216,293 @@ def load_profile(params):
     logger.debug(u'Selected profile: %s' % profile)
     return profile
 
+def parse_time(value):
+    """
+    Parse time from command line
+
+    Args:
+        value (string): date or duration before now (with s, m, h or d unit)
+
+    Return:
+        float: timestamp
+    """
+    units = {u's': 1, u'm': 60, u'h': 3600, u'd': 86400}
+    if value[-1:] in units:
+        try:
+            return time.time() - float(value[:-1]) * units[value[-1]]
+        except ValueError:
+            pass
+
+    for fmt in (u'%Y-%m-%d %H:%M:%S', u'%Y-%m-%d %H:%M', u'%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    for fmt in (u'%H:%M:%S', u'%H:%M'):
+        try:
+            parsed = time.strptime(value, fmt)
+            now = time.localtime()
+            return time.mktime((now.tm_year, now.tm_mon, now.tm_mday, parsed.tm_hour, parsed.tm_min, parsed.tm_sec, 0, 0, -1))
+        except ValueError:
+            pass
+
+    raise Exception(u'Invalid time "%s"' % value)
+
+def search_logs(argv):
+    """
+    Search logs in devenv log store ("logs" command)
+
+    Args:
+        argv (list): command arguments
+
+    Return:
+        int: exit code
+    """
+    from pyremotedev.logstore import LogStore
+    from pyremotedev.logs import get_log_store_path
+
+    options = {
+        u'conf': os.path.join(user_data_dir(APP_NAME, APP_AUTHOR), u'devenv.conf'),
+        u'prof': None,
+        u'db': None,
+        u'level': None,
+        u'logger': None,
+        u'since': None,
+        u'until': None,
+        u'text': None,
+        u'fts': False,
+        u'limit': 100
+    }
+    try:
+        opts, _ = getopt.getopt(argv, u'c:p:l:n:t:h', [u'conf=', u'prof=', u'db=', u'level=', u'logger=', u'since=', u'until=', u'text=', u'fts', u'limit=', u'help'])
+        for opt, arg in opts:
+            if opt in (u'-h', u'--help'):
+                usage()
+                return 2
+            elif opt in (u'-c', u'--conf'):
+                options[u'conf'] = arg
+            elif opt in (u'-p', u'--prof'):
+                options[u'prof'] = arg
+            elif opt == u'--db':
+                options[u'db'] = arg
+            elif opt in (u'-l', u'--level'):
+                options[u'level'] = logging.getLevelName(arg.upper())
+                if not isinstance(options[u'level'], int):
+                    raise Exception(u'Invalid level "%s"' % arg)
+            elif opt in (u'-n', u'--logger'):
+                options[u'logger'] = arg
+            elif opt == u'--since':
+                options[u'since'] = parse_time(arg)
+            elif opt == u'--until':
+                options[u'until'] = parse_time(arg)
+            elif opt in (u'-t', u'--text'):
+                options[u'text'] = arg
+            elif opt == u'--fts':
+                options[u'fts'] = True
+            elif opt == u'--limit':
+                options[u'limit'] = int(arg)
+    except Exception as e:
+        usage(str(e))
+        return 1
+
+    #find store from devenv profile
+    path = options[u'db']
+    if path is None:
+        profile = load_profile({
+            u'execenv': False,
+            u'conf': options[u'conf'],
+            u'prof': options[u'prof'],
+            u'first_prof': False
+        })
+        remotes = profile.get(u'remote_hosts') or [{u'name': profile[u'remote_host']}]
+        path = get_log_store_path(profile[u'local_dir'], remotes[0][u'name'])
+    store = LogStore(path)
+    if not store.exists():
+        print(u'Log store "%s" does not exist' % path)
+        return 1
+
+    try:
+        for log in store.query(options[u'level'], options[u'logger'], options[u'since'], options[u'until'], options[u'text'], options[u'limit'], options[u'fts']):
+            timestamp = u'%s.%03d' % (time.strftime(u'%Y-%m-%d %H:%M:%S', time.localtime(log[u'ts'])), int(log[u'ts'] * 1000) % 1000)
+            if log[u'logger']:
+                print(u'%s %s [%s:%s]: %s' % (timestamp, log[u'level'], log[u'logger'], log[u'line'], log[u'msg']))
+            else:
+                print(u'%s %s' % (timestamp, log[u'msg']))
+    except Exception as e:
+        print(u'Error searching logs: %s' % e)
+        return 1
+    finally:
+        store.close()
+
+    return 0
+
+def pull_files(argv):
+    """
+    Pull lazy files content through running devenv ("pull" command)
+
+    Args:
+        argv (list): command arguments
+
+    Return:
+        int: exit code
+    """
+    from pyremotedev.metrics import query_endpoint, get_default_metrics_endpoint
+    try:
+        from urllib.parse import quote
+    except ImportError:
+        from urllib import quote
+
+    options = {
+        u'conf': os.path.join(user_data_dir(APP_NAME, APP_AUTHOR), u'devenv.conf'),
+        u'prof': None,
+        u'timeout': 60.0
+    }
+    try:
+        opts, paths = getopt.getopt(argv, u'c:p:h', [u'conf=', u'prof=', u'timeout=', u'help'])
+        for opt, arg in opts:
+            if opt in (u'-h', u'--help'):
+                usage()
+                return 2
+            elif opt in (u'-c', u'--conf'):
+                options[u'conf'] = arg
+            elif opt in (u'-p', u'--prof'):
+                options[u'prof'] = arg
+            elif opt == u'--timeout':
+                options[u'timeout'] = float(arg)
+        if len(paths) == 0:
+            raise Exception(u'No file to pull')
+    except Exception as e:
+        usage(str(e))
+        return 1
+
+    #find devenv endpoint
+    endpoint = None
+    if options[u'prof']:
+        endpoint = load_profile({
+            u'execenv': False,
+            u'conf': options[u'conf'],
+            u'prof': options[u'prof'],
+            u'first_prof': False
+        }).get(u'metrics_endpoint')
+        if endpoint == u'':
+            print(u'Metrics endpoint (used by pull) is disabled in profile "%s"' % options[u'prof'])
+            return 1
+    if endpoint is None:
+        endpoint = get_default_metrics_endpoint(u'devenv')
+
+    code = 0
+    for path in paths:
+        path = os.path.abspath(path)
+        try:
+            (status, result) = query_endpoint(endpoint, u'/pull?path=%s&timeout=%s' % (quote(path.encode(u'utf-8')), options[u'timeout']), options[u'timeout'] + 5.0)
+        except Exception as e:
+            print(u'Unable to pull "%s" (is remotedev devenv running?): %s' % (path, e))
+            return 1
+        if status == 200:
+            print(u'Pulled "%s" (%d bytes)' % (path, result[u'size']))
+        else:
+            print(u'Unable to pull "%s": %s' % (path, result.get(u'error')))
+            code = 1
+
+    return code
+
+def start_profiler(params):
+    """
+    Start profiling remotedev threads. Stats are also dumped on SIGUSR1
+
+    Args:
+        params (dict): application parameters
+
+    Return:
+        ThreadProfiler: started profiler
+    """
+    import signal
+    from pyremotedev.profiler import ThreadProfiler
+
+    profiler = ThreadProfiler(params[u'profile_dir'], stacks=params[u'profile_stacks'])
+    profiler.start()
+    if hasattr(signal, u'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.dump())
+
+    return profiler
+
+def show_stats(params):
+    """
+    Display metrics of running remotedev instance
+
+    Args:
+        params (dict): application parameters
+
+    Return:
+        int: exit code
+    """
+    from pyremotedev.metrics import fetch_metrics, get_default_metrics_endpoint
+
+    mode = u'execenv' if params[u'execenv'] else u'devenv'
+    endpoint = None
+    if params[u'prof']:
+        endpoint = load_profile(params).get(u'metrics_endpoint')
+        if endpoint == u'':
+            print(u'Metrics are disabled in profile "%s"' % params[u'prof'])
+            return 1
+    if endpoint is None:
+        endpoint = get_default_metrics_endpoint(mode)
+
+    try:
+        metrics = fetch_metrics(endpoint)
+    except Exception as e:
+        print(u'Unable to get metrics from %s (is remotedev %s running?): %s' % (endpoint, mode, e))
+        return 1
+
+    for name in sorted(metrics.keys()):
+        value = metrics[name]
+        if isinstance(value, dict):
+            quantiles = [u'%s=%s' % (key, u'-' if value[key] is None else u'%.2fms' % (value[key] * 1000.0)) for key in (u'p50', u'p95', u'p99')]
+            print(u'%-50s count=%d %s' % (name, value[u'count'], u' '.join(quantiles)))
+        else:
+            print(u'%-50s %s' % (name, value))
+
+    return 0
+
+#logs command
+if len(sys.argv) > 1 and sys.argv[1] == u'logs':
+    reset_logging(logging.WARNING)
+    sys.exit(search_logs(sys.argv[2:]))
+
+#pull command
+if len(sys.argv) > 1 and sys.argv[1] == u'pull':
+    reset_logging(logging.WARNING)
+    sys.exit(pull_files(sys.argv[2:]))
+
 #get application parameters
 params = application_parameters()
 
 #reset logging
 reset_logging(params[u'log_level'], params[u'log_file'])
 
+#stats command
+if params[u'stats']:
+    sys.exit(show_stats(params))
+
 #load application profile
 profile = load_profile(params)
+if params[u'capture']:
+    profile[u'capture_path'] = params[u'capture']
 logger.debug('Using profile %s' % profile)
 
+#start profiler before any thread
+profiler = None
+if params[u'profile_dir']:
+    profiler = start_profiler(params)
+
 if params[u'execenv']:
     logger.info(u'Starting remotedev in ExecEnv mode')
     try:
         execenv = pyremotedev.PyRemoteExec(profile)
         execenv.start()
-        while execenv.isAlive():
-            execenv.join(1.0)
+        #don't wait with join: interrupted join marks thread as stopped and final join wouldn't wait for cleanup
+        while execenv.is_alive():
+            time.sleep(1.0)
 
     except KeyboardInterrupt:
         pass
@@ -236,3 +535,6 @@ else:
         devenv.stop()
 
     devenv.join()
+
+if profiler:
+    profiler.stop()
@@ -6,7 +6,11 @@ import logging
 import time
 import platform
 import sys
-from .consts import DEFAULT_SSH_PORT, DEFAULT_SSH_USERNAME, DEFAULT_SSH_PASSWORD, SEPARATOR
+from .consts import DEFAULT_SSH_PORT, DEFAULT_SSH_USERNAME, DEFAULT_SSH_PASSWORD, SEPARATOR, DEFAULT_EXEC_PORT
+from .consts import WATCHER_WATCHDOG, DEFAULT_SCAN_INTERVAL, DEFAULT_SCAN_CPU_BUDGET, DEFAULT_SCAN_WORKERS
+from .consts import DEFAULT_LOG_QUEUE_SIZE, DEFAULT_LOG_OVERFLOW_POLICY, DEFAULT_LOG_DEBUG_SAMPLING
+from .consts import DEFAULT_LOG_MAX_BYTES, DEFAULT_LOG_BACKUP_COUNT, DEFAULT_LOG_STORE_MAX_BYTES
+from .consts import DEFAULT_HOOK_QUIET_PERIOD, DEFAULT_FANOUT_QUEUE_SIZE
 import getpass
 try:
     input = raw_input
@@ -392,7 +396,23 @@ class DevEnvConfigFile(ConfigFile):
                         remote_port,
                         ssh_username,
                         ssh_password,
-                        local_dir
+                        local_dir,
+                        watcher,
+                        scan_interval,
+                        scan_cpu_budget,
+                        scan_workers,
+                        log_max_bytes,
+                        log_backup_count,
+                        log_json,
+                        log_store,
+                        log_store_max_bytes,
+                        log_queue_size,
+                        metrics_endpoint,
+                        exec_port,
+                        ssh_tunnel,
+                        bandwidth_limits,
+                        remote_hosts,
+                        fanout_queue_size
                     },
                     ...
                 }
@@ -402,9 +422,55 @@ class DevEnvConfigFile(ConfigFile):
             u'remote_port': int(profile[u'remote_port']),
             u'ssh_username': profile[u'ssh_username'],
             u'ssh_password': profile[u'ssh_password'].replace(u'%%', '%'),
-            u'local_dir': profile[u'local_dir']
+            u'local_dir': profile[u'local_dir'],
+            u'watcher': profile.get(u'watcher', WATCHER_WATCHDOG),
+            u'scan_interval': float(profile.get(u'scan_interval', DEFAULT_SCAN_INTERVAL)),
+            u'scan_cpu_budget': float(profile.get(u'scan_cpu_budget', DEFAULT_SCAN_CPU_BUDGET)),
+            u'scan_workers': int(profile.get(u'scan_workers', DEFAULT_SCAN_WORKERS)),
+            u'log_max_bytes': int(profile.get(u'log_max_bytes', DEFAULT_LOG_MAX_BYTES)),
+            u'log_backup_count': int(profile.get(u'log_backup_count', DEFAULT_LOG_BACKUP_COUNT)),
+            u'log_json': bool(profile.get(u'log_json', False)),
+            u'log_store': bool(profile.get(u'log_store', False)),
+            u'log_store_max_bytes': int(profile.get(u'log_store_max_bytes', DEFAULT_LOG_STORE_MAX_BYTES)),
+            u'log_queue_size': int(profile.get(u'log_queue_size', DEFAULT_LOG_QUEUE_SIZE)),
+            u'metrics_endpoint': profile.get(u'metrics_endpoint'),
+            u'exec_port': int(profile.get(u'exec_port', DEFAULT_EXEC_PORT)),
+            u'ssh_tunnel': bool(profile.get(u'ssh_tunnel', True)),
+            u'bandwidth_limits': dict(profile.get(u'bandwidth_limits') or {}),
+            u'remote_hosts': self.__get_remote_hosts(profile),
+            u'fanout_queue_size': int(profile.get(u'fanout_queue_size', DEFAULT_FANOUT_QUEUE_SIZE))
         }
 
+    def __get_remote_hosts(self, profile):
+        """
+        Return remotes synchronized by fan-out profile. Remote can be a host or a dict overriding profile connection
+        values (remote_host, remote_port, ssh_username, ssh_password, exec_port and name)
+
+        Return:
+            list: list of remotes (dict with name, remote_host, remote_port, ssh_username, ssh_password and exec_port),
+                  empty list if profile has a single remote
+        """
+        remotes = []
+        for entry in profile.get(u'remote_hosts') or []:
+            if not isinstance(entry, dict):
+                entry = {u'remote_host': entry}
+            remotes.append({
+                u'name': entry.get(u'name'),
+                u'remote_host': entry[u'remote_host'],
+                u'remote_port': int(entry.get(u'remote_port', profile[u'remote_port'])),
+                u'ssh_username': entry.get(u'ssh_username', profile[u'ssh_username']),
+                u'ssh_password': entry.get(u'ssh_password', profile[u'ssh_password']).replace(u'%%', '%'),
+                u'exec_port': int(entry.get(u'exec_port', profile.get(u'exec_port', DEFAULT_EXEC_PORT)))
+            })
+
+        #name is used in remote log files names, it must be unique
+        hosts = [remote[u'remote_host'] for remote in remotes]
+        for remote in remotes:
+            if not remote[u'name']:
+                remote[u'name'] = remote[u'remote_host'] if hosts.count(remote[u'remote_host']) == 1 else u'%s_%d' % (remote[u'remote_host'], remote[u'exec_port'])
+
+        return remotes
+
     def _get_new_profile_values(self):
         """
         Return new profile values
@@ -491,6 +557,20 @@ class ExecEnvConfigFile(ConfigFile):
     """
 
     KEY_LOG_FILE = u'log_file_path'
+    KEY_WATCHER = u'watcher'
+    KEY_SCAN_INTERVAL = u'scan_interval'
+    KEY_SCAN_CPU_BUDGET = u'scan_cpu_budget'
+    KEY_SCAN_WORKERS = u'scan_workers'
+    KEY_LOG_QUEUE_SIZE = u'log_queue_size'
+    KEY_LOG_OVERFLOW_POLICY = u'log_overflow_policy'
+    KEY_LOG_LEVELS = u'log_levels'
+    KEY_LOG_RATE_LIMITS = u'log_rate_limits'
+    KEY_LOG_DEBUG_SAMPLING = u'log_debug_sampling'
+    KEY_METRICS_ENDPOINT = u'metrics_endpoint'
+    KEY_EXEC_PORT = u'exec_port'
+    KEY_LAZY_PULL_THRESHOLD = u'lazy_pull_threshold'
+    KEY_BANDWIDTH_LIMITS = u'bandwidth_limits'
+    KEY_PRECOMPILE = u'precompile'
 
     def __init__(self, config_file):
         """
@@ -509,10 +589,27 @@ class ExecEnvConfigFile(ConfigFile):
             dict: dictionnary of execenv profile::
                 {
                     'log_file_path': 'path to log file',
+                    'watcher': 'watchdog' or 'polling',
+                    'scan_interval': polling scan interval (seconds),
+                    'scan_cpu_budget': polling scan cpu budget (fraction of one cpu),
+                    'scan_workers': polling scan threads,
+                    'log_queue_size': maximum number of logs waiting to be sent,
+                    'log_overflow_policy': 'drop_oldest', 'drop_debug' or 'block',
+                    'log_levels': {logger name: minimum level},
+                    'log_rate_limits': {logger name: maximum logs per second},
+                    'log_debug_sampling': fraction of debug logs sent,
+                    'metrics_endpoint': 'unix:<path>' or '<host>:<port>' (empty to disable),
+                    'exec_port': listening port,
+                    'lazy_pull_threshold': size (bytes) above which files are sent without content (None to disable),
+                    'bandwidth_limits': {traffic class (file, log or total): maximum bytes per second sent to devenv},
+                    'precompile': compile synchronized python sources (true or application python interpreter),
                     'mappings': {
                         'src1': {
                             'dest: 'dest1',
-                            'link': 'link'
+                            'link': 'link',
+                            'hook': shell command run after a burst of changes (optional),
+                            'hook_callable': 'module:function' called after a burst of changes (optional),
+                            'hook_quiet_period': time without change before hook is run (seconds)
                         },
                         'src2': {
                             'dest': 'dest2',
@@ -523,6 +620,20 @@ class ExecEnvConfigFile(ConfigFile):
         """
         conf = {
             self.KEY_LOG_FILE: None,
+            self.KEY_WATCHER: WATCHER_WATCHDOG,
+            self.KEY_SCAN_INTERVAL: DEFAULT_SCAN_INTERVAL,
+            self.KEY_SCAN_CPU_BUDGET: DEFAULT_SCAN_CPU_BUDGET,
+            self.KEY_SCAN_WORKERS: DEFAULT_SCAN_WORKERS,
+            self.KEY_LOG_QUEUE_SIZE: DEFAULT_LOG_QUEUE_SIZE,
+            self.KEY_LOG_OVERFLOW_POLICY: DEFAULT_LOG_OVERFLOW_POLICY,
+            self.KEY_LOG_LEVELS: {},
+            self.KEY_LOG_RATE_LIMITS: {},
+            self.KEY_LOG_DEBUG_SAMPLING: DEFAULT_LOG_DEBUG_SAMPLING,
+            self.KEY_METRICS_ENDPOINT: None,
+            self.KEY_EXEC_PORT: DEFAULT_EXEC_PORT,
+            self.KEY_LAZY_PULL_THRESHOLD: None,
+            self.KEY_BANDWIDTH_LIMITS: {},
+            self.KEY_PRECOMPILE: None,
             u'mappings': collections.OrderedDict()
         }
         for src in profile:
@@ -530,13 +641,56 @@ class ExecEnvConfigFile(ConfigFile):
                 #handle log file path
                 conf[self.KEY_LOG_FILE] = profile[src]
 
-            else:
-                #handle dir mapping
-                dest = profile[src]
+            elif src == self.KEY_WATCHER:
+                conf[self.KEY_WATCHER] = profile[src]
 
-                conf[u'mappings'][src] = {
-                    u'dest': dest
-                }
+            elif src in (self.KEY_SCAN_INTERVAL, self.KEY_SCAN_CPU_BUDGET):
+                conf[src] = float(profile[src])
+
+            elif src in (self.KEY_SCAN_WORKERS, self.KEY_LOG_QUEUE_SIZE, self.KEY_EXEC_PORT):
+                conf[src] = int(profile[src])
+
+            elif src == self.KEY_LAZY_PULL_THRESHOLD:
+                #None disables lazy pull
+                conf[src] = int(profile[src]) if profile[src] is not None else None
+
+            elif src == self.KEY_LOG_OVERFLOW_POLICY:
+                conf[src] = profile[src]
+
+            elif src == self.KEY_LOG_LEVELS:
+                conf[src] = dict(profile[src])
+
+            elif src == self.KEY_LOG_RATE_LIMITS:
+                conf[src] = dict([(name, float(rate)) for (name, rate) in profile[src].items()])
+
+            elif src == self.KEY_BANDWIDTH_LIMITS:
+                conf[src] = dict([(name, float(rate)) for (name, rate) in (profile[src] or {}).items() if rate])
+
+            elif src == self.KEY_LOG_DEBUG_SAMPLING:
+                conf[src] = float(profile[src])
+
+            elif src == self.KEY_METRICS_ENDPOINT:
+                conf[src] = profile[src]
+
+            elif src == self.KEY_PRECOMPILE:
+                conf[src] = profile[src] or None
+
+            else:
+                #handle dir mapping (destination or dict with dest and post sync hook)
+                mapping = profile[src]
+                if isinstance(mapping, dict):
+                    #0 is a valid quiet period (hook triggered as soon as queue is drained)
+                    quiet_period = mapping.get(u'hook_quiet_period')
+                    conf[u'mappings'][src] = {
+                        u'dest': mapping[u'dest'],
+                        u'hook': mapping.get(u'hook'),
+                        u'hook_callable': mapping.get(u'hook_callable'),
+                        u'hook_quiet_period': float(quiet_period) if quiet_period is not None else DEFAULT_HOOK_QUIET_PERIOD
+                    }
+                else:
+                    conf[u'mappings'][src] = {
+                        u'dest': mapping
+                    }
 
         return conf
 
@@ -9,4 +9,28 @@ VERSION = __version__
 
 DEFAULT_SSH_PORT = u'22'
 DEFAULT_SSH_USERNAME = u'root'
-DEFAULT_SSH_PASSWORD = u'CleepR00t'
\ No newline at end of file
+DEFAULT_SSH_PASSWORD = u'CleepR00t'
+DEFAULT_EXEC_PORT = 52666
+DEFAULT_FANOUT_QUEUE_SIZE = 10000
+
+WATCHER_WATCHDOG = u'watchdog'
+WATCHER_POLLING = u'polling'
+DEFAULT_SCAN_INTERVAL = 1.0
+DEFAULT_SCAN_CPU_BUDGET = 0.25
+DEFAULT_SCAN_WORKERS = 2
+
+LOG_OVERFLOW_DROP_OLDEST = u'drop_oldest'
+LOG_OVERFLOW_DROP_DEBUG = u'drop_debug'
+LOG_OVERFLOW_BLOCK = u'block'
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_OVERFLOW_POLICY = LOG_OVERFLOW_DROP_OLDEST
+DEFAULT_LOG_DEBUG_SAMPLING = 1.0
+DEFAULT_LOG_MAX_BYTES = 2048000
+DEFAULT_LOG_BACKUP_COUNT = 2
+DEFAULT_LOG_STORE_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_HOOK_QUIET_PERIOD = 1.0
+
+TRAFFIC_TOTAL = u'total'
+TRAFFIC_CONTROL = u'control'
+TRAFFIC_FILE = u'file'
+TRAFFIC_LOG = u'log'
@@ -1,26 +1,66 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from threading import Thread
+from threading import Thread, Condition, Event, Lock
 import logging
-from collections import deque
+from collections import deque, OrderedDict
 from .consts import SEPARATOR
 import os
-from .request import RequestFile
+from .request import RequestFile, RequestPull
 import shutil
 import io
 import time
 import re
 import copy
+import json
 from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
-from .request import RequestFile
+from .filter import PathFilter
+from .hooks import PostSyncHooks, SyncHook, BytecodeCompiler
+from .metrics import REGISTRY
 from hashlib import md5
 try:
     _unicode = unicode
 except NameError:
     _unicode = str
 
+#suffix of files being received in several parts (filtered temp file)
+PARTIAL_SUFFIX = u'.remotedev.tmp'
+
+FILE_EVENTS = REGISTRY.counter(u'remotedev_file_events_total', u'Filesystem events seen')
+FILE_EVENTS_DROPPED = REGISTRY.counter(u'remotedev_file_events_dropped_total', u'Filesystem events dropped by filter')
+FILE_EXECUTOR_QUEUE_DEPTH = REGISTRY.gauge(u'remotedev_file_executor_queue_depth', u'Number of file requests waiting to be applied')
+FILE_APPLY_SECONDS = REGISTRY.histogram(u'remotedev_file_apply_seconds', u'Time to apply a file request')
+FILE_APPLY_FAILED = REGISTRY.counter(u'remotedev_file_apply_failed_total', u'File requests not applied (unmapped path or error)')
+FILE_LAZY_ANNOUNCED = REGISTRY.counter(u'remotedev_file_lazy_announced_total', u'Files announced without content (lazy pull)')
+FILE_PULLED_BYTES = REGISTRY.counter(u'remotedev_file_pulled_bytes_total', u'Bytes of lazy files pulled')
+
+#first line of lazy files placeholders
+PLACEHOLDER_MAGIC = b'#remotedev placeholder\n'
+
+def build_placeholder(path, request):
+    """
+    Build placeholder content of lazy file
+
+    Args:
+        path (string): local file path
+        request (RequestFile): lazy file request
+
+    Returns:
+        bytes: placeholder content
+    """
+    lines = [
+        u'#file is on execenv, get it with: remotedev pull "%s"' % path,
+        json.dumps({u'md5': request.md5, u'size': request.size}),
+        u''
+    ]
+    return PLACEHOLDER_MAGIC + u'\n'.join(lines).encode(u'utf-8')
+
+def is_placeholder(content):
+    """
+    Return True if specified file content is a lazy file placeholder
+    """
+    return content[:len(PLACEHOLDER_MAGIC)] == PLACEHOLDER_MAGIC
+
 
 
 class RequestFileExecutor(Thread):
@@ -29,32 +69,57 @@ class RequestFileExecutor(Thread):
     It is in charge to perform file synchronisation between both filesystem using received requests
     """
 
-    def __init__(self, mappings, debug=False):
+    def __init__(self, mappings, debug=False, ack_callback=None, precompile=None):
         """
         Constructor
 
         Args:
             mappings (dict|string): directory mappings if dict, sources dir if string
             debug (bool): enable debug
+            ack_callback (function): function called with trace of applied traced requests (received, started, applied)
+            precompile (bool|string): compile applied python sources to bytecode in background (with specified
+                                      interpreter if string, remotedev interpreter if True). Mappings only
         """
         Thread.__init__(self)
         Thread.daemon = True
 
         #members
         self.logger = logging.getLogger(self.__class__.__name__)
-        #if debug:
-        self.logger.setLevel(logging.DEBUG)
+        if debug:
+            self.logger.setLevel(logging.DEBUG)
         self.running = True
-        self.__queue = deque(maxlen=200)
+        #not bounded: dropping a request would desynchronize filesystems (bursts such as vcs checkout)
+        self.__queue = deque()
+        self.__event = Event()
+        self.ack_callback = ack_callback
+        self.__body_id = 0
+        self.__last_applied = time.time()
 
         #filepath converter
         self.file_path_converter = FilepathConverter(mappings)
 
+        #post sync hooks (execenv mappings only)
+        self.hooks = None
+        self.compiler = None
+        if isinstance(mappings, dict):
+            global_hooks = []
+            if precompile:
+                self.compiler = BytecodeCompiler(precompile if isinstance(precompile, (_unicode, str)) else None)
+                global_hooks.append(SyncHook(u'precompile', function=self.compiler.add_paths, extensions=(u'.py',)))
+            hooks = PostSyncHooks(mappings, global_hooks)
+            if len(hooks.hooks) > 0:
+                self.hooks = hooks
+
     def stop(self):
         """
         Stop process
         """
         self.running = False
+        self.__event.set()
+        if self.hooks:
+            self.hooks.stop()
+        if self.compiler:
+            self.compiler.stop()
 
     def add_request(self, request):
         """
@@ -65,6 +130,98 @@ class RequestFileExecutor(Thread):
         """
         self.logger.debug(u'Request added %s' % request)
         self.__queue.appendleft(request)
+        FILE_EXECUTOR_QUEUE_DEPTH.set(len(self.__queue))
+        if not self.__event.is_set():
+            self.__event.set()
+
+    def open_body(self, path):
+        """
+        Open temp file (not synchronized) receiving content of big file request while it is received. It is created
+        next to request destination and moved in place when request is applied
+
+        Args:
+            path (string): received request path
+
+        Returns:
+            file: temp file opened for writing, None if path is not mapped
+        """
+        mapping = self.file_path_converter.transform_received_path(path)
+        if mapping is None:
+            return None
+        parent = os.path.dirname(mapping[u'path'])
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        self.__body_id += 1
+
+        return io.open(u'%s.%d%s' % (mapping[u'path'], self.__body_id, PARTIAL_SUFFIX), u'wb')
+
+    def __write_content(self, src, request):
+        """
+        Write request content in file: received temp file is moved in place, otherwise content is written
+
+        Args:
+            src (string): file path
+            request (RequestFile): create or update request
+        """
+        if request.body_path:
+            os.rename(request.body_path, src)
+            return
+        with io.open(src, u'wb') as fd:
+            fd.write(build_placeholder(src, request) if request.lazy else request.content)
+
+    def __add_hook_paths(self, request):
+        """
+        Add paths changed by request to their mapping hook, before request is applied
+        """
+        if request.type == RequestFile.TYPE_ARCHIVE:
+            paths = [entry[u'path'] for entry in request.entries]
+        else:
+            paths = [path for path in (request.src, request.dest) if path]
+        for path in paths:
+            mapping = self.file_path_converter.transform_received_path(path)
+            if mapping is not None:
+                self.hooks.add_path(mapping[u'mapping'], mapping[u'path'].rstrip(os.path.sep))
+
+    def __process_archive(self, request):
+        """
+        Unpack archive request entries under their mapped destination
+
+        Args:
+            request (Request): archive request
+
+        Return:
+            bool: True if all entries were unpacked
+        """
+        self.logger.debug(u'Process request CREATE ARCHIVE for src=%s (%d entries)' % (request.src, len(request.entries)))
+        #directories known to exist (avoid stat on each entry)
+        dirs = set()
+        unpacked = True
+        for entry in request.entries:
+            mapping = self.file_path_converter.transform_received_path(entry[u'path'])
+            if mapping is None:
+                self.logger.debug(u'Unmapped archive entry %s. Entry dropped' % entry[u'path'])
+                unpacked = False
+                continue
+            path = mapping[u'path']
+
+            if entry[u'type'] == RequestFile.TYPE_DIR:
+                path = path.rstrip(os.path.sep)
+                if path not in dirs and not os.path.isdir(path):
+                    os.makedirs(path)
+                dirs.add(path)
+            else:
+                parent = os.path.dirname(path)
+                if parent not in dirs and not os.path.isdir(parent):
+                    os.makedirs(parent)
+                dirs.add(parent)
+                #file content bigger than a request is written in a temp file (not synchronized) until last part
+                target = path + PARTIAL_SUFFIX if entry.get(u'partial') or entry.get(u'append') else path
+                with io.open(target, u'ab' if entry.get(u'append') else u'wb') as fd:
+                    fd.write(entry.get(u'content', b''))
+                if target != path and not entry.get(u'partial'):
+                    os.rename(target, path)
+
+        return unpacked
 
     def __process_request(self, request):
         """
@@ -77,6 +234,9 @@ class RequestFileExecutor(Thread):
             bool: True if request processed succesfully
         """
         try:
+            if request.type == RequestFile.TYPE_ARCHIVE:
+                return self.__process_archive(request)
+
             #set is_dir
             is_dir = False
             if request.type == RequestFile.TYPE_DIR:
@@ -113,9 +273,7 @@ class RequestFileExecutor(Thread):
                         os.makedirs(os.path.dirname(src))
 
                     #create new file
-                    fd = io.open(src, u'wb')
-                    fd.write(request.content)
-                    fd.close()
+                    self.__write_content(src, request)
 
             elif request.action == RequestFile.ACTION_DELETE:
                 self.logger.debug('Process request DELETE for src=%s' % (src))
@@ -142,9 +300,7 @@ class RequestFileExecutor(Thread):
                     self.logger.debug(u'Update request dropped for directories (useless command)')
                 else:
                     #update file content
-                    fd = io.open(src, u'wb')
-                    fd.write(request.content)
-                    fd.close()
+                    self.__write_content(src, request)
 
             else:
                 #unhandled case
@@ -155,23 +311,500 @@ class RequestFileExecutor(Thread):
 
         except:
             self.logger.exception(u'Exception occured processing request %s:' % request)
+            if getattr(request, u'body_path', None) and os.path.exists(request.body_path):
+                os.remove(request.body_path)
             return False
 
     def run(self):
         """
         Main process: unqueue request and process it
         """
+        if self.compiler:
+            self.compiler.start()
+        if self.hooks:
+            self.hooks.start()
+
         while self.running:
             try:
                 request = self.__queue.pop()
+                FILE_EXECUTOR_QUEUE_DEPTH.set(len(self.__queue))
+                start = time.time()
+                if self.hooks:
+                    self.hooks.set_idle(None)
+                    self.__add_hook_paths(request)
                 if not self.__process_request(request):
                     #failed to process request
-                    #TODO what to do ?
-                    pass
+                    FILE_APPLY_FAILED.inc()
+                end = time.time()
+                self.__last_applied = end
+                FILE_APPLY_SECONDS.observe(end - start)
+                if request.trace and self.ack_callback:
+                    self.ack_callback({
+                        u'id': request.trace.get(u'id'),
+                        u'received': request.trace.get(u'received', start),
+                        u'started': start,
+                        u'applied': end
+                    })
 
             except IndexError:
-                #no request available
-                time.sleep(0.25)
+                #no request available, hooks of settled bursts are triggered by hooks thread
+                if self.hooks:
+                    self.hooks.set_idle(self.__last_applied)
+                self.__event.wait(0.25)
+                self.__event.clear()
+
+
+
+
+
+class FileEventCoalescer(Thread):
+    """
+    Coalesce filesystem events per path.
+    Events are held during a short quiet period and merged into the minimal net operation (create+modify+modify
+    becomes a single create, delete+create becomes a single create, create+delete is cancelled...) before being
+    processed by specified callback.
+    A created directory is held while its content is being created (cp -r, unpacked archive): if enough creations
+    are pending under it, they are processed as a single tree event (event with tree key)
+    """
+
+    #minimum number of pending creations under a created directory to process it as a tree
+    TREE_MIN_EVENTS = 16
+
+    def __init__(self, process_callback, quiet_period=0.1, max_delay=1.0):
+        """
+        Constructor
+
+        Args:
+            process_callback (function): function called with each coalesced event (dict)
+            quiet_period (float): time (seconds) without new event on a path before processing it
+            max_delay (float): maximum time (seconds) an event can be held (continuously modified file)
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.process_callback = process_callback
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        #pending events ordered by last update: seq => event
+        self.__pending = OrderedDict()
+        #pending events index: path => seq
+        self.__paths = {}
+        self.__seq = 0
+        self.__condition = Condition()
+
+    def stop(self):
+        """
+        Stop process
+        """
+        self.running = False
+        with self.__condition:
+            self.__condition.notify()
+
+    def add_event(self, action, type_, path, dest=None):
+        """
+        Add new filesystem event
+
+        Args:
+            action (int): RequestFile action (ACTION_CREATE, ACTION_UPDATE, ACTION_DELETE, ACTION_MOVE)
+            type_ (int): RequestFile type (TYPE_FILE or TYPE_DIR)
+            path (string): event path (source path for move)
+            dest (string): destination path (only for move)
+        """
+        now = time.time()
+        with self.__condition:
+            #pending events are always ready before new one: wake up processing only if there is no pending event
+            notify = len(self.__pending) == 0
+            if type_ == RequestFile.TYPE_DIR:
+                self.__add_dir_event(action, path, dest, now)
+            else:
+                self.__add_file_event(action, path, dest, now)
+            if action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE):
+                self.__touch_created_parents(path, now)
+            if notify:
+                self.__condition.notify()
+
+    def __get(self, path):
+        """
+        Return pending event on specified path
+
+        Returns:
+            dict: pending event or None
+        """
+        seq = self.__paths.get(path)
+        if seq is None:
+            return None
+        return self.__pending[seq]
+
+    def __pop(self, path):
+        """
+        Remove and return pending event on specified path
+
+        Returns:
+            dict: pending event or None
+        """
+        seq = self.__paths.pop(path, None)
+        if seq is None:
+            return None
+        return self.__pending.pop(seq)
+
+    def __retire(self, path):
+        """
+        Keep pending event on specified path in queue but do not merge it with next events anymore
+        """
+        self.__paths.pop(path, None)
+
+    def __remove(self, seq):
+        """
+        Remove specified pending event (indexed or retired)
+        """
+        event = self.__pending.pop(seq)
+        if self.__paths.get(event[u'path']) == seq:
+            del self.__paths[event[u'path']]
+
+    def __put(self, path, action, type_, now, src=None, dirty=False):
+        """
+        Put (or replace) pending event at the end of queue
+        """
+        old = self.__pop(path)
+        self.__seq += 1
+        self.__pending[self.__seq] = {
+            u'action': action,
+            u'type': type_,
+            u'path': path,
+            u'src': src,
+            u'dirty': dirty,
+            u'first': old[u'first'] if old else now,
+            u'last': now
+        }
+        self.__paths[path] = self.__seq
+
+    def __is_created_dir(self, event):
+        """
+        Return True if pending event is a directory creation
+        """
+        return event is not None and event[u'type'] == RequestFile.TYPE_DIR and event[u'action'] == RequestFile.ACTION_CREATE
+
+    def __touch_created_parents(self, path, now):
+        """
+        Hold pending creations of specified path parents while their content is being created
+        """
+        parent = os.path.dirname(path)
+        while parent != path:
+            event = self.__get(parent)
+            if not self.__is_created_dir(event):
+                break
+            event[u'last'] = now
+            path = parent
+            parent = os.path.dirname(path)
+
+    def __has_held_parent(self, path, held):
+        """
+        Return True if one of path parents is a held directory creation
+        """
+        parent = os.path.dirname(path)
+        while parent != path:
+            if parent in held:
+                return True
+            path = parent
+            parent = os.path.dirname(path)
+
+        return False
+
+    def __is_tree_content(self, event, prefix):
+        """
+        Return True if event is a creation (or update) under specified directory prefix
+        """
+        if not event[u'path'].startswith(prefix):
+            return False
+        if event[u'type'] == RequestFile.TYPE_DIR:
+            return event[u'action'] == RequestFile.ACTION_CREATE
+        return event[u'action'] in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE)
+
+    def __group_trees(self, events):
+        """
+        Replace created directories and creations under them by tree events when there are enough of them
+
+        Args:
+            events (list): ready events in order
+
+        Returns:
+            list: list of events
+        """
+        out = []
+        absorbed = set()
+        for (index, event) in enumerate(events):
+            if index in absorbed:
+                continue
+            if self.__is_created_dir(event):
+                prefix = os.path.join(event[u'path'], u'')
+                content = [other for other in range(index + 1, len(events)) if other not in absorbed and self.__is_tree_content(events[other], prefix)]
+                if len(content) >= self.TREE_MIN_EVENTS:
+                    absorbed.update(content)
+                    event = dict(event)
+                    event[u'tree'] = True
+            out.append(event)
+
+        return out
+
+    def __add_file_event(self, action, path, dest, now):
+        """
+        Merge file event with pending one
+        """
+        if action == RequestFile.ACTION_DELETE:
+            self.__delete_file(path, now)
+            return
+        if action == RequestFile.ACTION_MOVE:
+            self.__move_file(path, dest, now)
+            return
+
+        #create or modify
+        event = self.__get(path)
+        if event and event[u'type'] != RequestFile.TYPE_FILE:
+            self.__retire(path)
+            event = None
+
+        if event is None:
+            self.__put(path, action, RequestFile.TYPE_FILE, now)
+        elif event[u'action'] == RequestFile.ACTION_DELETE:
+            #file replaced (atomic save): sent as creation so an empty content is not dropped like raw modify
+            self.__put(path, RequestFile.ACTION_CREATE, RequestFile.TYPE_FILE, now)
+        elif event[u'action'] == RequestFile.ACTION_MOVE:
+            #moved file content changed
+            self.__put(path, RequestFile.ACTION_MOVE, RequestFile.TYPE_FILE, now, src=event[u'src'], dirty=True)
+        else:
+            #already pending create or update, content will be read once
+            self.__put(path, event[u'action'], RequestFile.TYPE_FILE, now)
+
+    def __delete_file(self, path, now):
+        """
+        Merge file deletion with pending event
+        """
+        event = self.__get(path)
+        if event and event[u'type'] != RequestFile.TYPE_FILE:
+            self.__retire(path)
+            event = None
+        self.__pop(path)
+
+        if event is None or event[u'action'] in (RequestFile.ACTION_UPDATE, RequestFile.ACTION_DELETE):
+            self.__put(path, RequestFile.ACTION_DELETE, RequestFile.TYPE_FILE, now)
+        elif event[u'action'] == RequestFile.ACTION_MOVE:
+            #remote still holds file at its original path. Delete it unless new content is pending on this path
+            if self.__get(event[u'src']) is None:
+                self.__put(event[u'src'], RequestFile.ACTION_DELETE, RequestFile.TYPE_FILE, now)
+        #else: file created and deleted, nothing to do
+
+    def __move_file(self, src, dest, now):
+        """
+        Merge file move with pending events
+        """
+        #destination is overwritten by move: pending event on it is irrelevant
+        dest_event = self.__get(dest)
+        if dest_event and dest_event[u'type'] != RequestFile.TYPE_FILE:
+            self.__retire(dest)
+        elif dest_event and dest_event[u'action'] == RequestFile.ACTION_MOVE:
+            self.__delete_file(dest, now)
+        self.__pop(dest)
+
+        event = self.__get(src)
+        if event and event[u'type'] != RequestFile.TYPE_FILE:
+            self.__retire(src)
+            event = None
+        self.__pop(src)
+
+        if event and event[u'action'] == RequestFile.ACTION_CREATE:
+            #file created then moved: create it at its final place
+            self.__put(dest, RequestFile.ACTION_CREATE, RequestFile.TYPE_FILE, now)
+        elif event and event[u'action'] == RequestFile.ACTION_MOVE:
+            if event[u'src'] == dest:
+                #file moved back to its original place
+                if event[u'dirty']:
+                    self.__put(dest, RequestFile.ACTION_UPDATE, RequestFile.TYPE_FILE, now)
+            elif self.__get(event[u'src']) is not None:
+                #original path is reused by a pending event (files swapped through a temp name...): remote file at
+                #original path is overwritten before this move would be applied, send content instead
+                self.__put(dest, RequestFile.ACTION_CREATE, RequestFile.TYPE_FILE, now)
+            else:
+                self.__put(dest, RequestFile.ACTION_MOVE, RequestFile.TYPE_FILE, now, src=event[u'src'], dirty=event[u'dirty'])
+        else:
+            dirty = event is not None and event[u'action'] == RequestFile.ACTION_UPDATE
+            self.__put(dest, RequestFile.ACTION_MOVE, RequestFile.TYPE_FILE, now, src=src, dirty=dirty)
+
+    def __add_dir_event(self, action, path, dest, now):
+        """
+        Merge directory event with pending ones
+        """
+        if action == RequestFile.ACTION_DELETE:
+            self.__delete_dir(path, now)
+            return
+        if action == RequestFile.ACTION_MOVE:
+            self.__move_dir(path, dest, now)
+            return
+        if action != RequestFile.ACTION_CREATE:
+            #update on directory is useless
+            return
+
+        event = self.__get(path)
+        if event and (event[u'type'] != RequestFile.TYPE_DIR or event[u'action'] == RequestFile.ACTION_DELETE):
+            #directory content must be cleared before creating it again
+            self.__retire(path)
+            event = None
+
+        if event is None:
+            self.__put(path, RequestFile.ACTION_CREATE, RequestFile.TYPE_DIR, now)
+        else:
+            self.__put(path, event[u'action'], RequestFile.TYPE_DIR, now, src=event[u'src'])
+
+    def __delete_dir(self, path, now):
+        """
+        Merge directory deletion with pending events. Pending events on directory content are cancelled
+        """
+        prefix = os.path.join(path, u'')
+        for seq, event in list(self.__pending.items()):
+            if not event[u'path'].startswith(prefix):
+                continue
+            if event[u'action'] == RequestFile.ACTION_MOVE and not event[u'src'].startswith(prefix):
+                #content moved from outside deleted directory: remote must delete original
+                if self.__get(event[u'src']) is None:
+                    self.__put(event[u'src'], RequestFile.ACTION_DELETE, event[u'type'], now)
+            if seq in self.__pending:
+                self.__remove(seq)
+
+        event = self.__pop(path)
+        if event and event[u'type'] == RequestFile.TYPE_DIR and event[u'action'] == RequestFile.ACTION_CREATE:
+            #directory created and deleted, nothing to do
+            return
+        if event and event[u'type'] == RequestFile.TYPE_DIR and event[u'action'] == RequestFile.ACTION_MOVE:
+            self.__put(event[u'src'], RequestFile.ACTION_DELETE, RequestFile.TYPE_DIR, now)
+        else:
+            self.__put(path, RequestFile.ACTION_DELETE, RequestFile.TYPE_DIR, now)
+
+    def __move_dir(self, src, dest, now):
+        """
+        Merge directory move with pending events. Pending events on directory content are rebased on destination
+        """
+        prefix = os.path.join(src, u'')
+        rebased = []
+        for seq, event in list(self.__pending.items()):
+            if not event[u'path'].startswith(prefix):
+                continue
+            new_path = os.path.join(dest, event[u'path'][len(prefix):])
+            if event[u'action'] in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE):
+                #content must be read at its new place, after directory move
+                self.__remove(seq)
+                rebased.append((new_path, event[u'action'], event[u'type']))
+            elif event[u'action'] == RequestFile.ACTION_MOVE and event[u'dirty']:
+                event[u'dirty'] = False
+                self.__retire(event[u'path'])
+                rebased.append((new_path, RequestFile.ACTION_UPDATE, event[u'type']))
+            else:
+                #applied on remote before directory move
+                self.__retire(event[u'path'])
+
+        self.__retire(dest)
+        event = self.__get(src)
+        if event and (event[u'type'] != RequestFile.TYPE_DIR or event[u'action'] not in (RequestFile.ACTION_CREATE, RequestFile.ACTION_MOVE)):
+            self.__retire(src)
+            event = None
+        self.__pop(src)
+        if event and event[u'action'] == RequestFile.ACTION_CREATE:
+            self.__put(dest, RequestFile.ACTION_CREATE, RequestFile.TYPE_DIR, now)
+        elif event:
+            if event[u'src'] != dest:
+                self.__put(dest, RequestFile.ACTION_MOVE, RequestFile.TYPE_DIR, now, src=event[u'src'])
+        else:
+            self.__put(dest, RequestFile.ACTION_MOVE, RequestFile.TYPE_DIR, now, src=src)
+
+        for (new_path, action, type_) in rebased:
+            self.__put(new_path, action, type_, now)
+
+    def __get_timeout(self, now):
+        """
+        Return time to wait before next pending event is ready
+
+        Returns:
+            float: timeout in seconds
+        """
+        timeout = 0.25
+        held = set()
+        for event in self.__pending.values():
+            deadline = self.__get_deadline(event)
+            if held and self.__has_held_parent(event[u'path'], held):
+                #ready with its held parent
+                continue
+            if deadline > now and self.__is_created_dir(event):
+                held.add(event[u'path'])
+            timeout = min(timeout, deadline - now)
+        return max(timeout, 0.0)
+
+    def __get_deadline(self, event):
+        """
+        Return time when pending event is ready
+
+        Returns:
+            float: timestamp
+        """
+        return min(event[u'last'] + self.quiet_period, event[u'first'] + self.max_delay)
+
+    def __pop_ready_events(self, force=False):
+        """
+        Wait for and return ready events. Events are returned in order, so earlier pending events are returned
+        with latest ready one
+
+        Args:
+            force (bool): return all pending events without waiting
+
+        Returns:
+            list: list of events
+        """
+        with self.__condition:
+            if not force:
+                timeout = self.__get_timeout(time.time())
+                if timeout > 0.0:
+                    self.__condition.wait(timeout)
+
+            now = time.time()
+            ready = 0
+            #directories creations held by their content creation
+            held = set()
+            for index, event in enumerate(self.__pending.values()):
+                if held and self.__has_held_parent(event[u'path'], held):
+                    continue
+                if force or self.__get_deadline(event) <= now:
+                    ready = index + 1
+                elif self.__is_created_dir(event):
+                    held.add(event[u'path'])
+
+            events = []
+            for _ in range(ready):
+                seq, event = self.__pending.popitem(last=False)
+                if self.__paths.get(event[u'path']) == seq:
+                    del self.__paths[event[u'path']]
+                events.append(event)
+
+            return self.__group_trees(events)
+
+    def __process_events(self, events):
+        """
+        Process specified events
+        """
+        for event in events:
+            try:
+                self.process_callback(event)
+            except Exception:
+                self.logger.exception(u'Exception processing event %s:' % event)
+
+    def run(self):
+        """
+        Main process: process events when they are ready
+        """
+        while self.running:
+            self.__process_events(self.__pop_ready_events())
+
+        #process remaining events
+        self.__process_events(self.__pop_ready_events(force=True))
 
 
 
@@ -181,6 +814,7 @@ class RequestFileCreator(FileSystemEventHandler):
     """
     Filesystem changes handler.
     It watches for filesystem changes, filter event if necessary, prepare and post request
+    Events are coalesced per path so a file is read and sent once per save
     """
 
     REJECTED_FILENAMES = [
@@ -197,7 +831,8 @@ class RequestFileCreator(FileSystemEventHandler):
         u'.log' #log file
     ]
     REJECTED_PREFIXES = [
-        u'.',
+        u'.#', #emacs lock file
+        u'.~lock.', #libreoffice lock file
         u'~'
     ]
     REJECTED_SUFFIXES = [
@@ -205,11 +840,23 @@ class RequestFileCreator(FileSystemEventHandler):
     ]
     REJECTED_DIRS = [
         u'.git',
+        u'.hg',
+        u'.svn',
         u'.vscode',
-        u'.editor'
+        u'.idea',
+        u'.editor',
+        u'__pycache__',
+        u'node_modules',
+        u'.tox',
+        u'.venv'
     ]
 
-    def __init__(self, send_request_callback, path, mappings=None, drop_files=[]):
+    #maximum size of file content sent in an archive request
+    ARCHIVE_REQUEST_SIZE = 4194304
+    #files from this size are sent straight from file by transport (FileBody) instead of being read in memory
+    BODY_MIN_SIZE = 1048576
+
+    def __init__(self, send_request_callback, path, mappings=None, drop_files=[], drop_prefixes=[], quiet_period=0.1, lazy_threshold=None):
         """
         Constructor
 
@@ -217,18 +864,46 @@ class RequestFileCreator(FileSystemEventHandler):
             synchronizer (Synchronizer): synchronizer instance
             path (string): path to watch for
             drop_files (list): list of file (fullpath) to not observe
+            drop_prefixes (list): list of fullpath prefixes whose dotted variants (prefix.log, prefix.log.1...) are not
+                                  observed
+            quiet_period (float): time (seconds) without event on a path before sending its request
+            lazy_threshold (int): files bigger than this size (bytes) are sent without content (lazy pull). None
+                                  to always send content
         """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.setLevel(logging.DEBUG)
         self.path = path
+        self.lazy_threshold = lazy_threshold
         self.drop_files = drop_files
         self.send_request_callback = send_request_callback
+        self.__coalescer = FileEventCoalescer(self.__process_event, quiet_period)
+        self.path_filter = PathFilter(
+            path,
+            drop_files=drop_files,
+            drop_prefixes=drop_prefixes,
+            rejected_filenames=self.REJECTED_FILENAMES,
+            rejected_extensions=self.REJECTED_EXTENSIONS,
+            rejected_prefixes=self.REJECTED_PREFIXES,
+            rejected_suffixes=self.REJECTED_SUFFIXES,
+            rejected_dirs=self.REJECTED_DIRS
+        )
 
         if mappings:
             self.file_path_converter = FilepathConverter(mappings)
         else:
             self.file_path_converter = FilepathConverter(path)
 
+    def start(self):
+        """
+        Start events processing
+        """
+        self.__coalescer.start()
+
+    def stop(self):
+        """
+        Stop events processing. Pending events are sent before stopping
+        """
+        self.__coalescer.stop()
+
     def __get_event_type(self, event):
         """
         Return event type
@@ -252,49 +927,306 @@ class RequestFileCreator(FileSystemEventHandler):
         if not event:
             return True
 
-        #filter event on current script
-        if event.src_path == u'.%s' % __file__:
+        if self.__is_path_dropped(event.src_path, event.is_directory):
+            FILE_EVENTS_DROPPED.inc()
             return True
 
+        return False
+
+    def __is_path_dropped(self, path, is_dir):
+        """
+        Analyse path and return True if event on it must be dropped
+
+        Return:
+            bool: True if event must be dropped
+        """
         #filter root event
-        if event.src_path == u'.':
+        if path == u'.' or path == self.path:
             return True
 
-        #dropped files
-        if event.src_path in self.drop_files:
+        return self.path_filter.is_dropped(path, is_dir)
+
+    def __transform_path(self, path, type_):
+        """
+        Transform local path to path to send
+
+        Returns:
+            string: path to send or None if path is not mapped
+        """
+        new_path = self.file_path_converter.transform_path_to_send(path)
+        if new_path is None:
+            return None
+        if type_ == RequestFile.TYPE_DIR and not new_path[u'path'].endswith(os.path.sep):
+            return new_path[u'path'] + os.path.sep
+        return new_path[u'path']
+
+    def __read_content(self, req, path):
+        """
+        Read file content into request
+
+        Return:
+            bool: True if content read successfully
+        """
+        try:
+            with io.open(path, u'rb') as src:
+                req.content = src.read()
+                req.md5 = md5(req.content).hexdigest()
             return True
+        except Exception:
+            self.logger.exception(u'Unable to read src file "%s"' % path)
+            return False
+
+    def __get_size(self, path):
+        """
+        Return file size
+
+        Returns:
+            int: file size or 0 if file doesn't exist anymore
+        """
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
 
-        #filter invalid extension
-        src_ext = os.path.splitext(event.src_path)[1]
-        if src_ext in self.REJECTED_EXTENSIONS:
+    def __is_lazy(self, size):
+        """
+        Return True if content of file of specified size must not be sent (lazy pull)
+        """
+        return bool(self.lazy_threshold) and size > self.lazy_threshold
+
+    def __read_body(self, req, path, lazy):
+        """
+        Read big file metadata (size and md5) into request, content is not kept: it is sent from file by transport
+        or pulled on demand if file is lazy
+
+        Return:
+            bool: True if metadata read successfully
+        """
+        try:
+            body = FileBody(path)
+            body.read_metadata()
+            req.size = body.size
+            req.md5 = body.md5
+            if lazy:
+                req.lazy = True
+            else:
+                req.body = body
             return True
+        except Exception:
+            self.logger.exception(u'Unable to read src file "%s"' % path)
+            return False
 
-        #filter by prefix
-        for prefix in self.REJECTED_PREFIXES:
-            if event.src_path.startswith(prefix):
-                return True
-            if getattr(event, u'dest_path', None) and event.dest_path.startswith(prefix):
-                return True
+    def __new_archive_request(self, src, event):
+        """
+        Return new archive request
 
-        #filter by suffix
-        for suffix in self.REJECTED_SUFFIXES:
-            if event.src_path.endswith(suffix):
-                return True
-            if getattr(event, u'dest_path', None) and event.dest_path.endswith(prefix):
-                return True
+        Returns:
+            RequestFile: archive request
+        """
+        req = RequestFile()
+        req.action = RequestFile.ACTION_CREATE
+        req.type = RequestFile.TYPE_ARCHIVE
+        req.src = src
+        req.trace = {
+            u'event': event.get(u'first', time.time()),
+            u'process': time.time()
+        }
 
-        #filter by filename
-        for filename in self.REJECTED_FILENAMES:
-            if event.src_path.endswith(filename):
-                return True
+        return req
 
-        #filter by dir
-        parts = event.src_path.split(os.path.sep)
-        for dir in self.REJECTED_DIRS:
-            if dir in parts:
-                return True
+    def __process_tree_event(self, event, send_request_callback):
+        """
+        Walk created directory tree and send it as archive requests (one request per ARCHIVE_REQUEST_SIZE bytes
+        of content)
 
-        return False
+        Args:
+            event (dict): coalesced tree event
+            send_request_callback (function): function called with each request
+        """
+        src = self.__transform_path(event[u'path'], RequestFile.TYPE_DIR)
+        if src is None:
+            self.logger.debug(u' -> Event dropped (src path not mapped)')
+            return
+
+        req = self.__new_archive_request(src, event)
+        size = 0
+        big_paths = []
+        for (root, dirs, files) in os.walk(event[u'path']):
+            #do not walk into filtered directories
+            dirs[:] = [name for name in dirs if not self.__is_path_dropped(os.path.join(root, name), True)]
+            entries = [(root, RequestFile.TYPE_DIR)]
+            entries += [(os.path.join(root, name), RequestFile.TYPE_FILE) for name in files if not self.__is_path_dropped(os.path.join(root, name), False)]
+
+            for (path, type_) in entries:
+                entry_path = self.__transform_path(path, type_)
+                if entry_path is None:
+                    continue
+                if type_ == RequestFile.TYPE_DIR:
+                    req.entries.append({u'path': entry_path, u'type': type_})
+                    continue
+                file_size = self.__get_size(path)
+                if file_size >= self.BODY_MIN_SIZE or self.__is_lazy(file_size):
+                    big_paths.append(path)
+                    continue
+
+                try:
+                    with io.open(path, u'rb') as fd:
+                        content = fd.read()
+                except Exception:
+                    #file removed meanwhile, its deletion is handled by its own event
+                    self.logger.debug(u'Unable to read archive entry "%s"' % path, exc_info=True)
+                    continue
+                if is_placeholder(content):
+                    continue
+                checksum = md5(content).hexdigest()
+
+                #split content over several requests if necessary
+                offset = 0
+                while True:
+                    if size > 0 and size + len(content) - offset > self.ARCHIVE_REQUEST_SIZE:
+                        req.trace[u'read'] = time.time()
+                        send_request_callback(req)
+                        req = self.__new_archive_request(src, event)
+                        size = 0
+                    chunk = content[offset:offset + self.ARCHIVE_REQUEST_SIZE]
+                    entry = {u'path': entry_path, u'type': type_, u'content': chunk, u'md5': checksum}
+                    if offset > 0:
+                        entry[u'append'] = True
+                    if offset + len(chunk) < len(content):
+                        entry[u'partial'] = True
+                    req.entries.append(entry)
+                    size += len(chunk)
+                    offset += len(chunk)
+                    if offset >= len(content):
+                        break
+
+        if len(req.entries) > 0:
+            req.trace[u'read'] = time.time()
+            send_request_callback(req)
+
+        #big files are sent (or announced) after archive
+        for path in big_paths:
+            self.__process_event({
+                u'action': RequestFile.ACTION_CREATE,
+                u'type': RequestFile.TYPE_FILE,
+                u'path': path
+            }, send_request_callback)
+
+    def __process_event(self, event, send_request_callback=None):
+        """
+        Build request from coalesced event and send it
+
+        Args:
+            event (dict): coalesced event as returned by FileEventCoalescer
+            send_request_callback (function): function called with each request (default is creator callback)
+        """
+        self.logger.debug(u'Process event: %s' % event)
+        if send_request_callback is None:
+            send_request_callback = self.send_request_callback
+        if event.get(u'tree'):
+            self.__process_tree_event(event, send_request_callback)
+            return
+
+        now = time.time()
+        req = RequestFile()
+        req.action = event[u'action']
+        req.type = event[u'type']
+        req.trace = {
+            u'event': event.get(u'first', now),
+            u'process': now
+        }
+
+        if req.action == RequestFile.ACTION_MOVE:
+            req.src = self.__transform_path(event[u'src'], req.type)
+            if req.src is None:
+                self.logger.debug(u' -> Event dropped (src path not mapped)')
+                return
+            req.dest = self.__transform_path(event[u'path'], req.type)
+            if req.dest is None:
+                self.logger.debug(u' -> Event dropped (dest path not mapped)')
+                return
+            send_request_callback(req)
+
+            if event[u'dirty'] and req.type == RequestFile.TYPE_FILE:
+                #file content changed after move
+                self.__process_event({
+                    u'action': RequestFile.ACTION_UPDATE,
+                    u'type': req.type,
+                    u'path': event[u'path']
+                }, send_request_callback)
+            return
+
+        req.src = self.__transform_path(event[u'path'], req.type)
+        if req.src is None:
+            self.logger.debug(u' -> Event dropped (src path not mapped)')
+            return
+
+        size = self.__get_size(event[u'path']) if req.type == RequestFile.TYPE_FILE else 0
+        if req.type == RequestFile.TYPE_FILE and req.action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE) and self.__is_lazy(size):
+            #announce file without its content
+            if not self.__read_body(req, event[u'path'], True):
+                return
+            req.trace[u'read'] = time.time()
+            FILE_LAZY_ANNOUNCED.inc()
+
+        elif req.type == RequestFile.TYPE_FILE and req.action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE) and size >= self.BODY_MIN_SIZE:
+            #big file content is sent from file by transport
+            if not self.__read_body(req, event[u'path'], False):
+                return
+            req.trace[u'read'] = time.time()
+
+        elif req.type == RequestFile.TYPE_FILE and req.action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE):
+            #send file content
+            if not self.__read_content(req, event[u'path']):
+                return
+            req.trace[u'read'] = time.time()
+            if req.action == RequestFile.ACTION_UPDATE and len(req.content) == 0:
+                self.logger.debug(' -> Event dropped (empty file)')
+                return
+            if is_placeholder(req.content):
+                #lazy file not pulled yet
+                self.logger.debug(' -> Event dropped (placeholder)')
+                return
+
+        #send request
+        send_request_callback(req)
+
+    def resync(self, paths, send_request_callback):
+        """
+        Send current state of specified paths to resynchronize a remote that missed their requests: existing files
+        and directories (with their content) are created, missing paths are deleted
+
+        Args:
+            paths (list): list of (sent path, RequestFile type)
+            send_request_callback (function): function called with each request
+        """
+        tree_prefix = None
+        for (src, type_) in sorted(set(paths)):
+            mapping = self.file_path_converter.transform_received_path(src)
+            if mapping is None:
+                continue
+            path = mapping[u'path'].rstrip(os.path.sep)
+            if tree_prefix and path.startswith(tree_prefix):
+                #already sent with its parent tree
+                continue
+            if os.path.isdir(path):
+                tree_prefix = os.path.join(path, u'')
+                event = {u'action': RequestFile.ACTION_CREATE, u'type': RequestFile.TYPE_DIR, u'path': path, u'tree': True}
+            elif os.path.exists(path):
+                event = {u'action': RequestFile.ACTION_CREATE, u'type': RequestFile.TYPE_FILE, u'path': path}
+            else:
+                event = {u'action': RequestFile.ACTION_DELETE, u'type': type_, u'path': path}
+            try:
+                self.__process_event(event, send_request_callback)
+            except Exception:
+                self.logger.exception(u'Unable to resync "%s":' % path)
+
+    def dispatch(self, event):
+        """
+        Dispatch filesystem event to on_xxx methods
+        """
+        FILE_EVENTS.inc()
+        FileSystemEventHandler.dispatch(self, event)
 
     def on_modified(self, event):
         """
@@ -310,31 +1242,8 @@ class RequestFileCreator(FileSystemEventHandler):
         if event_type == RequestFile.TYPE_DIR:
             self.logger.debug(u' -> Event dropped (update on directory)')
             return
-        new_src = self.file_path_converter.transform_path_to_send(event.src_path)
-        if new_src is None:
-            self.logger.debug(u' -> Event dropped (src path not mapped)')
-            return
 
-        #build request file
-        req = RequestFile()
-        req.action = RequestFile.ACTION_UPDATE
-        req.type = event_type
-        if req.type == RequestFile.TYPE_DIR and not new_src[u'path'].endswith(os.path.sep):
-            new_src[u'path'] = new_src[u'path'] + os.path.sep
-        req.src = new_src[u'path']
-        try:
-            with io.open(event.src_path, u'rb') as src:
-                req.content = src.read()
-                req.md5 = md5(req.content).hexdigest()
-            if len(req.content) == 0:
-                self.logger.debug(' -> Event dropped (empty file)')
-                return
-        except Exception:
-            self.logger.exception(u'Unable to read src file "%s"' % event.src_path)
-            return
-        
-        #send request
-        self.send_request_callback(req)
+        self.__coalescer.add_event(RequestFile.ACTION_UPDATE, event_type, event.src_path)
 
     def on_moved(self, event):
         """
@@ -343,32 +1252,26 @@ class RequestFileCreator(FileSystemEventHandler):
         self.logger.debug(u'on_moved: %s' % event)
 
         #drop event
-        if self.__is_event_dropped(event):
-            self.logger.debug(u' -> Event dropped (filter)')
-            return
-        new_src = self.file_path_converter.transform_path_to_send(event.src_path)
-        if new_src is None:
-            self.logger.debug(u' -> Event dropped (src path not mapped)')
+        if not event:
             return
-        new_dest = self.file_path_converter.transform_path_to_send(event.dest_path)
-        if new_dest is None:
-            self.logger.debug(u' -> Event dropped (dest path not mapped)')
+        if getattr(event, u'is_synthetic', False):
+            #directory content move, already handled by directory move
+            self.logger.debug(u' -> Event dropped (synthetic)')
             return
-
-        #build request file
-        req = RequestFile()
-        req.action = RequestFile.ACTION_MOVE
-        req.type = self.__get_event_type(event)
-        if req.type == RequestFile.TYPE_DIR:
-            if not new_src[u'path'].endswith(os.path.sep):
-                new_src[u'path'] = new_src[u'path'] + os.path.sep
-            if not new_dest[u'path'].endswith(os.path.sep):
-                new_dest[u'path'] = new_dest[u'path'] + os.path.sep
-        req.src = new_src[u'path']
-        req.dest = new_dest[u'path']
-
-        #send request
-        self.send_request_callback(req)
+        event_type = self.__get_event_type(event)
+        src_dropped = self.__is_path_dropped(event.src_path, event.is_directory)
+        dest_dropped = self.__is_path_dropped(event.dest_path, event.is_directory)
+        if src_dropped and dest_dropped:
+            self.logger.debug(u' -> Event dropped (filter)')
+            FILE_EVENTS_DROPPED.inc()
+        elif src_dropped:
+            #filtered file (ie temp file) renamed to watched one: atomic save
+            self.__coalescer.add_event(RequestFile.ACTION_CREATE, event_type, event.dest_path)
+        elif dest_dropped:
+            #watched file renamed to filtered one (ie backup file)
+            self.__coalescer.add_event(RequestFile.ACTION_DELETE, event_type, event.src_path)
+        else:
+            self.__coalescer.add_event(RequestFile.ACTION_MOVE, event_type, event.src_path, event.dest_path)
 
     def on_created(self, event):
         """
@@ -380,30 +1283,8 @@ class RequestFileCreator(FileSystemEventHandler):
         if self.__is_event_dropped(event):
             self.logger.debug(u' -> Event dropped (filter)')
             return
-        new_src = self.file_path_converter.transform_path_to_send(event.src_path)
-        if new_src is None:
-            self.logger.debug(u' -> Event dropped (src path not mapped)')
-            return
-
-        #build request file
-        req = RequestFile()
-        req.action = RequestFile.ACTION_CREATE
-        req.type = self.__get_event_type(event)
-        if req.type == RequestFile.TYPE_DIR and not new_src[u'path'].endswith(os.path.sep):
-            new_src[u'path'] = new_src[u'path'] + os.path.sep
-        req.src = new_src[u'path']
-        if req.type == RequestFile.TYPE_FILE:
-            #send file content
-            try:
-                with io.open(event.src_path, u'rb') as src:
-                    req.content = src.read()
-                    req.md5 = md5(req.content).hexdigest()
-            except Exception:
-                self.logger.exception(u'Unable to read src file "%s"' % event.src_path)
-                return
 
-        #send request
-        self.send_request_callback(req)
+        self.__coalescer.add_event(RequestFile.ACTION_CREATE, self.__get_event_type(event), event.src_path)
 
     def on_deleted(self, event):
         """
@@ -415,21 +1296,428 @@ class RequestFileCreator(FileSystemEventHandler):
         if self.__is_event_dropped(event):
             self.logger.debug(u' -> Event dropped (filter)')
             return
-        new_src = self.file_path_converter.transform_path_to_send(event.src_path)
-        if new_src is None:
-            self.logger.debug(u' -> Event dropped (src path not mapped)')
-            return
 
-        #build request file
-        req = RequestFile()
-        req.action = RequestFile.ACTION_DELETE
-        req.type = self.__get_event_type(event)
-        if req.type == RequestFile.TYPE_DIR and not new_src[u'path'].endswith(os.path.sep):
-            new_src[u'path'] = new_src[u'path'] + os.path.sep
-        req.src = new_src[u'path']
+        self.__coalescer.add_event(RequestFile.ACTION_DELETE, self.__get_event_type(event), event.src_path)
 
-        #send request
-        self.send_request_callback(req)
+
+
+
+
+class PulledFile():
+    """
+    Lazy file being pulled from remote. Content parts are written in a temp file (not synchronized) renamed to file
+    path once content is complete and checked
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+
+        Args:
+            path (string): local file path
+        """
+        self.path = path
+        self.size = 0
+        self.error = None
+        self.__temp_path = path + PARTIAL_SUFFIX
+        self.__fd = None
+        self.__checksum = md5()
+        self.__done = Event()
+
+    def write(self, content):
+        """
+        Append content part
+        """
+        if self.__fd is None:
+            self.__fd = io.open(self.__temp_path, u'wb')
+        self.__fd.write(content)
+        self.__checksum.update(content)
+        self.size += len(content)
+        FILE_PULLED_BYTES.inc(len(content))
+
+    def finish(self, checksum, error=None):
+        """
+        Close pulled file: move it to its path if content is valid
+
+        Args:
+            checksum (string): content md5 computed by remote
+            error (string): error reported by remote
+        """
+        try:
+            if self.__fd is None and error is None:
+                #empty file
+                self.__fd = io.open(self.__temp_path, u'wb')
+            if self.__fd:
+                self.__fd.close()
+            if error is None and checksum != self.__checksum.hexdigest():
+                error = u'Invalid content received (md5 mismatch)'
+            if error is None:
+                os.rename(self.__temp_path, self.path)
+            self.error = error
+
+        except Exception as e:
+            self.error = u'Unable to write "%s": %s' % (self.path, e)
+
+        finally:
+            if self.error and os.path.exists(self.__temp_path):
+                os.remove(self.__temp_path)
+            self.__done.set()
+
+    def wait(self, timeout):
+        """
+        Wait for pulled file completion
+
+        Returns:
+            bool: True if pull is finished (successfully or not)
+        """
+        return self.__done.wait(timeout)
+
+
+
+
+
+class FileBody():
+    """
+    Content of big file sent by transport straight from the file (sendfile, zero copy) after request header instead
+    of being loaded in memory. Body is invalid if file changes between its checksum and the end of sending
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+
+        Args:
+            path (string): local file path
+        """
+        self.path = path
+        self.size = 0
+        self.md5 = None
+        self.truncated = False
+        self.__signature = None
+        self.__fd = None
+
+    def __get_signature(self, fd):
+        """
+        Return signature of opened file (changes when file content changes)
+
+        Returns:
+            tuple: (size, mtime, inode)
+        """
+        stat = os.fstat(fd.fileno())
+        return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+    def read_metadata(self):
+        """
+        Read file size and md5, content is not kept
+
+        Raises:
+            IOError/OSError if file can't be read
+        """
+        checksum = md5()
+        size = 0
+        with io.open(self.path, u'rb') as fd:
+            self.__signature = self.__get_signature(fd)
+            while True:
+                content = fd.read(1048576)
+                if not content:
+                    break
+                checksum.update(content)
+                size += len(content)
+        self.size = size
+        self.md5 = checksum.hexdigest()
+
+    def open(self):
+        """
+        Open file before sending it
+
+        Returns:
+            bool: False if file can't be opened or changed since its checksum
+        """
+        try:
+            self.__fd = io.open(self.path, u'rb')
+            if self.__get_signature(self.__fd) != self.__signature:
+                self.close()
+        except (IOError, OSError):
+            self.__fd = None
+
+        return self.__fd is not None
+
+    def read(self):
+        """
+        Return whole file content (capture only)
+
+        Returns:
+            bytes: file content
+        """
+        with io.open(self.path, u'rb') as fd:
+            return fd.read()
+
+    def send(self, sock, offset, count):
+        """
+        Send file range on socket, with sendfile when socket supports it. If file is truncated meanwhile, range is
+        padded to keep stream framing and body becomes invalid
+
+        Args:
+            sock (socket): connected socket
+            offset (int): file offset
+            count (int): number of bytes to send
+        """
+        sent = 0
+        if hasattr(sock, u'sendfile'):
+            sent = sock.sendfile(self.__fd, offset, count)
+        else:
+            self.__fd.seek(offset)
+            while sent < count:
+                content = self.__fd.read(min(count - sent, 65536))
+                if not content:
+                    break
+                sock.sendall(content)
+                sent += len(content)
+
+        if sent < count:
+            self.truncated = True
+            padding = b'\0' * min(count - sent, 65536)
+            while sent < count:
+                sock.sendall(padding[:count - sent])
+                sent += min(count - sent, len(padding))
+
+    def is_valid(self):
+        """
+        Return True if sent content matches checksum (file unchanged while sent)
+        """
+        return not self.truncated and self.__fd is not None and self.__get_signature(self.__fd) == self.__signature
+
+    def close(self):
+        """
+        Close file
+        """
+        if self.__fd:
+            self.__fd.close()
+            self.__fd = None
+
+
+
+
+
+class FilePullSender(Thread):
+    """
+    Send content of pulled lazy file by parts
+    """
+
+    PART_SIZE = 1048576
+
+    def __init__(self, request, path, send_request_callback):
+        """
+        Constructor
+
+        Args:
+            request (RequestPull): pull request
+            path (string): local file path
+            send_request_callback (function): function called with each RequestPull to send. It returns False if
+                                              request was not sent
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.request = request
+        self.path = path
+        self.send_request_callback = send_request_callback
+
+    def stop(self):
+        """
+        Stop sending
+        """
+        self.running = False
+
+    def __new_request(self):
+        """
+        Return new answer to pull request
+        """
+        req = RequestPull()
+        req.id = self.request.id
+        req.path = self.request.path
+
+        return req
+
+    def run(self):
+        """
+        Main process
+        """
+        checksum = md5()
+        offset = 0
+        try:
+            with io.open(self.path, u'rb') as fd:
+                while self.running:
+                    req = self.__new_request()
+                    req.offset = offset
+                    req.content = fd.read(self.PART_SIZE)
+                    checksum.update(req.content)
+                    offset += len(req.content)
+                    if len(req.content) < self.PART_SIZE:
+                        req.done = True
+                        req.md5 = checksum.hexdigest()
+                        req.size = offset
+                    if not self.send_request_callback(req):
+                        return
+                    if req.done:
+                        self.logger.info(u'Pulled file "%s" sent (%d bytes)' % (self.path, offset))
+                        return
+
+        except Exception as e:
+            self.logger.exception(u'Unable to send pulled file "%s":' % self.path)
+            req = self.__new_request()
+            req.done = True
+            req.error = u'Unable to read file on execenv: %s' % e
+            self.send_request_callback(req)
+
+
+
+
+
+class LruCache():
+    """
+    Thread safe least recently used cache
+    """
+    def __init__(self, size):
+        """
+        Constructor
+
+        Args:
+            size (int): maximum number of cached items
+        """
+        self.size = size
+        self.__items = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Return cached value
+
+        Args:
+            key (any): item key
+            default (any): value returned if key is not cached
+
+        Returns:
+            any: cached value or default
+        """
+        with self.__lock:
+            try:
+                value = self.__items.pop(key)
+            except KeyError:
+                return default
+            self.__items[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Cache value
+
+        Args:
+            key (any): item key
+            value (any): item value
+        """
+        with self.__lock:
+            self.__items.pop(key, None)
+            self.__items[key] = value
+            if len(self.__items) > self.size:
+                self.__items.popitem(last=False)
+
+    def clear(self):
+        """
+        Clear cache
+        """
+        with self.__lock:
+            self.__items.clear()
+
+
+
+
+
+class MappingIndex():
+    """
+    Index of path patterns.
+    Literal patterns are stored in a prefix trie, regexp patterns are merged into a single alternation regexp.
+    Patterns order is kept: first declared matching pattern wins
+    """
+
+    REGEXP_CHARS = set(u'^$*+?{}[]\\|()')
+    TERMINAL = None
+
+    def __init__(self, patterns):
+        """
+        Constructor
+
+        Args:
+            patterns (list): list of patterns (regexp applied at path beginning), ordered by priority
+        """
+        self.__trie = {}
+        alternatives = []
+        for index, pattern in enumerate(patterns):
+            if self.REGEXP_CHARS.isdisjoint(pattern):
+                self.__add_literal(index, pattern)
+            else:
+                alternatives.append(u'(?P<_m%d>%s)' % (index, self.__rename_groups(index, pattern)))
+
+        self.__regexp = None
+        if len(alternatives) > 0:
+            self.__regexp = re.compile(u'^(?:%s)' % u'|'.join(alternatives), re.UNICODE | re.DOTALL)
+
+    def __add_literal(self, index, pattern):
+        """
+        Add literal pattern to trie
+        """
+        node = self.__trie
+        for part in pattern.rstrip(os.path.sep).split(os.path.sep):
+            node = node.setdefault(part, {})
+        if self.TERMINAL not in node:
+            node[self.TERMINAL] = index
+
+    def __rename_groups(self, index, pattern):
+        """
+        Prefix named groups of pattern with pattern index to avoid name clashes in alternation
+        """
+        pattern = re.sub(r'\(\?P<(\w+)>', lambda match: u'(?P<_m%d_%s>' % (index, match.group(1)), pattern)
+        return re.sub(r'\(\?P=(\w+)\)', lambda match: u'(?P=_m%d_%s)' % (index, match.group(1)), pattern)
+
+    def match(self, path):
+        """
+        Search first pattern matching specified path
+
+        Args:
+            path (string): path to match
+
+        Returns:
+            tuple: (pattern index, matched length, substitutions dict) or None if no pattern matches
+        """
+        best = None
+
+        #literal patterns
+        node = self.__trie
+        length = 0
+        parts = path.split(os.path.sep)
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                break
+            length += len(part) + 1
+            index = node.get(self.TERMINAL)
+            if index is not None and (best is None or index < best[0]):
+                best = (index, length, {})
+
+        #regexp patterns
+        if self.__regexp:
+            match = self.__regexp.match(path)
+            if match:
+                index = int(match.lastgroup[2:])
+                if best is None or index < best[0]:
+                    prefix = u'_m%d_' % index
+                    substitutions = dict([(key[len(prefix):], value) for key, value in match.groupdict().items() if key.startswith(prefix)])
+                    best = (index, match.end(), substitutions)
+
+        return best
 
 
 
@@ -438,7 +1726,12 @@ class RequestFileCreator(FileSystemEventHandler):
 class FilepathConverter():
     """
     Lib to convert path from or to different environments
+    Mappings are indexed and resolved paths cached so each conversion costs O(path length)
     """
+
+    CACHE_SIZE = 4096
+    NEGATIVE_CACHE_SIZE = 1024
+
     def __init__(self, path_or_mappings):
         """
         Constructor
@@ -447,7 +1740,6 @@ class FilepathConverter():
             path_or_mappings (string|dict): path or mappings
         """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.setLevel(logging.DEBUG)
         self.mappings = None
         self.path = None
 
@@ -467,12 +1759,21 @@ class FilepathConverter():
                 #save new mappings
                 entry = {
                     u'src': src,
-                    u'dest': dest,
-                    u'compiled_src': re.compile(u'^%s' % src, re.UNICODE | re.DOTALL)
+                    u'dest': dest
                 }
                 entry.update(self.__revert_mappings(src, dest))
                 self.mappings.append(entry)
 
+            #build indexes and caches for both directions
+            self.__from_dev_env_index = MappingIndex([mapping[u'src'] for mapping in self.mappings])
+            self.__to_dev_env_index = MappingIndex([mapping[u'reverted_dest'] for mapping in self.mappings])
+            self.__from_dev_env_templates = [mapping[u'dest'] for mapping in self.mappings]
+            self.__to_dev_env_templates = [mapping[u'reverted_src'] for mapping in self.mappings]
+            self.__from_dev_env_cache = LruCache(self.CACHE_SIZE)
+            self.__to_dev_env_cache = LruCache(self.CACHE_SIZE)
+            self.__unmapped_from_dev_env = LruCache(self.NEGATIVE_CACHE_SIZE)
+            self.__unmapped_to_dev_env = LruCache(self.NEGATIVE_CACHE_SIZE)
+
             self.logger.debug('Old mappings: %s' % path_or_mappings)
             self.logger.debug('New mappings: %s' % self.mappings)
 
@@ -507,88 +1808,83 @@ class FilepathConverter():
 
         return {
             u'reverted_src': reverted_src,
-            u'reverted_dest': reverted_dest,
-            u'compiled_reverted_dest': re.compile(u'^%s' % reverted_dest, re.UNICODE | re.DOTALL)
+            u'reverted_dest': reverted_dest
         }
 
-    def __full_path_split(self, path):
+    def __resolve(self, path, index, templates, cache, negative_cache):
         """
-        Explode path into dir/dir/.../filename
-
-        Source:
-            https://stackoverflow.com/a/27065945
+        Resolve path using specified index
 
         Args:
-            path (string): path to split
-
-        Return:
-            list: list of path parts
-        """
-        if path is None:
-            path = u''
-        parts = []
-        (path, tail) = os.path.split(path)
-        while path and tail:
-            parts.append(tail)
-            (path, tail) = os.path.split(path)
-        parts.append(os.path.join(path, tail))
-
-        out = list(map(os.path.normpath, parts))[::-1]
-        if len(out) > 0 and out[0] == u'.':
-            #remove starting .
-            return out[1:]
-            
-        return out
+            path (string): path to convert
+            index (MappingIndex): index of patterns
+            templates (list): list of replacement templates (one per pattern)
+            cache (LruCache): resolved paths cache
+            negative_cache (LruCache): unmapped paths cache
+
+        Returns:
+            tuple: (converted path, mapping index) or None if path is not mapped
+        """
+        resolved = cache.get(path)
+        if resolved is not None:
+            return resolved
+        if negative_cache.get(path):
+            return None
+
+        found = index.match(path)
+        if found is None:
+            negative_cache.set(path, True)
+            return None
+
+        (pattern_index, length, substitutions) = found
+        template = templates[pattern_index]
+        if len(substitutions) > 0:
+            template = template % substitutions
+        resolved = (os.path.join(template, path[length:]), pattern_index)
+        cache.set(path, resolved)
+
+        return resolved
 
     def __from_dev_env(self, path):
-        self.logger.debug(' => from_dev_env')
-        for mapping in self.mappings:
-            found = False
-            matches = re.finditer(mapping[u'compiled_src'], path)
-            for _, match in enumerate(matches):
-                self.logger.debug(u'  => found with %s' % mapping[u'src'])
-                found = True
-                fullmatch = match.group()
-                substitutions = match.groupdict()
-                remaining = path.replace(fullmatch, u'')
-                new_path = os.path.join(mapping[u'dest'] % substitutions, remaining)
-
-            if found:
-                return {
-                    u'path': new_path
-                }
+        resolved = self.__resolve(
+            path,
+            self.__from_dev_env_index,
+            self.__from_dev_env_templates,
+            self.__from_dev_env_cache,
+            self.__unmapped_from_dev_env
+        )
+        if resolved is None:
+            return None
 
-        return None
+        return {
+            u'path': resolved[0],
+            u'mapping': resolved[1]
+        }
 
     def __to_dev_env(self, path):
-        self.logger.debug(' => to_dev_env')
-        for mapping in self.mappings:
-            found = False
-            matches = re.finditer(mapping[u'compiled_reverted_dest'], path)
-            for _, match in enumerate(matches):
-                self.logger.debug(u'  => found with %s' % mapping[u'reverted_dest'])
-                found = True
-                fullmatch = match.group()
-                substitutions = match.groupdict()
-                remaining = path.replace(fullmatch, u'')
-                new_path = os.path.join(mapping[u'reverted_src'] % substitutions, remaining)
-
-            if found:
-                if new_path.startswith('/'):
-                    new_path = new_path[1:]
-
-                return {
-                    u'path': new_path
-                }
+        resolved = self.__resolve(
+            path,
+            self.__to_dev_env_index,
+            self.__to_dev_env_templates,
+            self.__to_dev_env_cache,
+            self.__unmapped_to_dev_env
+        )
+        if resolved is None:
+            return None
+
+        new_path = resolved[0]
+        if new_path.startswith('/'):
+            new_path = new_path[1:]
 
-        return None
+        return {
+            u'path': new_path
+        }
 
     def __to_exec_env(self, path):
         """
         Returns path before sending it to execution environment
         Remove base path from specified full path
         """
-        self.logger.debug(' => to_exec_env')
         new_path = path.replace(self.path, u'')
         if new_path.startswith('/'):
             new_path = new_path[1:]
@@ -602,7 +1898,6 @@ class FilepathConverter():
         Return path when receiving it from execution environment
         Append base path to specified absolute path
         """
-        self.logger.debug(' => from_exec_env')
         new_path = os.path.join(self.path, path)
 
         return {
@@ -613,22 +1908,20 @@ class FilepathConverter():
         """
         Get path that need to be sent
         """
-        self.logger.debug('Path before transformation: %s' % path)
         if self.mappings is not None:
             res = self.__to_dev_env(path)
         else:
             res = self.__to_exec_env(path)
-        self.logger.debug('Path after transformation: %s' % res)
+        self.logger.debug(u'Path to send transformation: %s => %s', path, res)
         return res
 
     def transform_received_path(self, path):
         """
         Get path that was received
         """
-        self.logger.debug('Path before transformation: %s' % path)
         if self.mappings is not None:
             res = self.__from_dev_env(path)
         else:
             res = self.__from_exec_env(path)
-        self.logger.debug('Path after transformation: %s' % res)
+        self.logger.debug(u'Received path transformation: %s => %s', path, res)
         return res
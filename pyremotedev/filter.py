@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import io
+import re
+
+class PathFilter():
+    """
+    Compiled path filter.
+    Rejected names, extensions and directories are resolved with set lookups, rejected prefixes and suffixes with a
+    single regexp. It also handles .gitignore/.remotedevignore files found under root directory.
+    Decisions on directories are cached so events on already seen directories cost a dict lookup.
+    """
+
+    IGNORE_FILENAMES = [
+        u'.gitignore',
+        u'.remotedevignore'
+    ]
+    VIRTUALENV_MARKER = u'pyvenv.cfg'
+
+    def __init__(self, root, drop_files=[], drop_prefixes=[], rejected_filenames=[], rejected_extensions=[], rejected_prefixes=[], rejected_suffixes=[], rejected_dirs=[]):
+        """
+        Constructor
+
+        Args:
+            root (string): root directory (where ignore files are searched from)
+            drop_files (list): list of files (fullpath) to reject
+            drop_prefixes (list): list of fullpath prefixes whose dotted variants are rejected (prefix.log, prefix.log.1...)
+            rejected_filenames (list): list of rejected filenames
+            rejected_extensions (list): list of rejected extensions (with dot)
+            rejected_prefixes (list): list of rejected filename prefixes
+            rejected_suffixes (list): list of rejected filename suffixes
+            rejected_dirs (list): list of rejected directory names (everything below is rejected)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.root = os.path.join(root, u'')
+        self.drop_files = set(drop_files)
+        self.drop_prefixes = tuple([u'%s.' % prefix for prefix in drop_prefixes])
+        self.rejected_filenames = set(rejected_filenames)
+        self.rejected_extensions = set(rejected_extensions)
+        self.rejected_dirs = set(rejected_dirs)
+        affixes = [u'^%s' % re.escape(prefix) for prefix in rejected_prefixes]
+        affixes += [u'%s$' % re.escape(suffix) for suffix in rejected_suffixes]
+        self.__affixes = re.compile(u'|'.join(affixes), re.UNICODE) if affixes else None
+        self.__reset_filenames = set(self.IGNORE_FILENAMES) | set([self.VIRTUALENV_MARKER])
+
+        #caches: relative dir => decision, relative dir => ignore rules
+        self.__dirs = {}
+        self.__rules = {}
+
+    def reset(self):
+        """
+        Clear cached decisions. Must be called when an ignore file changes
+        """
+        self.logger.debug(u'Reset filter cache')
+        self.__dirs = {}
+        self.__rules = {}
+
+    def is_dropped(self, path, is_dir=False):
+        """
+        Return True if specified path must be dropped
+
+        Args:
+            path (string): full path
+            is_dir (bool): True if path is a directory
+
+        Returns:
+            bool: True if path is rejected
+        """
+        if path in self.drop_files:
+            return True
+        if self.drop_prefixes and path.startswith(self.drop_prefixes):
+            return True
+
+        (dirname, name) = os.path.split(path)
+        if name in self.__reset_filenames:
+            #ignore rules may have changed
+            self.reset()
+
+        #name checks
+        if name in self.rejected_filenames:
+            return True
+        if os.path.splitext(name)[1] in self.rejected_extensions:
+            return True
+        if self.__affixes and self.__affixes.search(name):
+            return True
+
+        #directory checks
+        rel_dir = self.__get_relative_path(dirname)
+        if rel_dir is None:
+            #outside root, no ignore rules
+            return name in self.rejected_dirs or any(part in self.rejected_dirs for part in dirname.split(os.path.sep))
+        if self.__is_dir_dropped(rel_dir):
+            return True
+        if is_dir:
+            return self.__is_dir_dropped(os.path.join(rel_dir, name))
+
+        return self.__is_ignored(rel_dir, os.path.join(rel_dir, name), False)
+
+    def is_dir_dropped(self, path):
+        """
+        Return True if everything below specified directory is rejected
+
+        Args:
+            path (string): directory full path
+
+        Returns:
+            bool: True if directory content is rejected
+        """
+        rel_dir = self.__get_relative_path(path)
+        if rel_dir is None:
+            return False
+        return self.__is_dir_dropped(rel_dir)
+
+    def __get_relative_path(self, path):
+        """
+        Return path relative to root
+
+        Returns:
+            string: relative path ('' for root) or None if path is outside root
+        """
+        path = os.path.join(path, u'')
+        if not path.startswith(self.root):
+            return None
+        return path[len(self.root):].rstrip(os.path.sep)
+
+    def __is_dir_dropped(self, rel_dir):
+        """
+        Return True if specified directory (and everything below) is rejected. Decision is cached
+
+        Args:
+            rel_dir (string): directory path relative to root
+
+        Returns:
+            bool: True if directory is rejected
+        """
+        dropped = self.__dirs.get(rel_dir)
+        if dropped is None:
+            if len(rel_dir) == 0:
+                dropped = False
+            else:
+                (parent, name) = os.path.split(rel_dir)
+                dropped = self.__is_dir_dropped(parent) or \
+                    name in self.rejected_dirs or \
+                    self.__is_ignored(parent, rel_dir, True) or \
+                    os.path.isfile(os.path.join(self.root, rel_dir, self.VIRTUALENV_MARKER))
+            self.__dirs[rel_dir] = dropped
+
+        return dropped
+
+    def __is_ignored(self, rel_dir, rel_path, is_dir):
+        """
+        Apply ignore rules in effect in specified directory. Last matching rule wins
+
+        Args:
+            rel_dir (string): directory containing path (relative to root)
+            rel_path (string): path to check (relative to root)
+            is_dir (bool): True if path is a directory
+
+        Returns:
+            bool: True if path is ignored
+        """
+        rules = self.__get_rules(rel_dir)
+        if len(rules) == 0:
+            return False
+
+        rel_path = rel_path.replace(os.path.sep, u'/')
+        for (base, pattern, negate, dir_only) in reversed(rules):
+            if dir_only and not is_dir:
+                continue
+            if not rel_path.startswith(base):
+                continue
+            if pattern.match(rel_path[len(base):]):
+                return not negate
+
+        return False
+
+    def __get_rules(self, rel_dir):
+        """
+        Return ignore rules in effect in specified directory (parent rules first)
+
+        Args:
+            rel_dir (string): directory path relative to root
+
+        Returns:
+            list: list of rules
+        """
+        rules = self.__rules.get(rel_dir)
+        if rules is None:
+            rules = [] if len(rel_dir) == 0 else self.__get_rules(os.path.dirname(rel_dir))
+            own_rules = self.__load_rules(rel_dir)
+            if len(own_rules) > 0:
+                rules = rules + own_rules
+            self.__rules[rel_dir] = rules
+
+        return rules
+
+    def __load_rules(self, rel_dir):
+        """
+        Load rules from ignore files of specified directory
+
+        Args:
+            rel_dir (string): directory path relative to root
+
+        Returns:
+            list: list of rules
+        """
+        rules = []
+        base = rel_dir.replace(os.path.sep, u'/')
+        if len(base) > 0:
+            base += u'/'
+        for filename in self.IGNORE_FILENAMES:
+            path = os.path.join(self.root, rel_dir, filename)
+            if not os.path.isfile(path):
+                continue
+            try:
+                with io.open(path, u'r', encoding=u'utf-8', errors=u'replace') as fd:
+                    for line in fd:
+                        rule = self.__compile_rule(line)
+                        if rule:
+                            rules.append((base,) + rule)
+                self.logger.debug(u'Ignore file "%s" loaded' % path)
+            except Exception:
+                self.logger.exception(u'Unable to read ignore file "%s"' % path)
+
+        return rules
+
+    def __compile_rule(self, line):
+        """
+        Compile gitignore rule
+
+        Args:
+            line (string): ignore file line
+
+        Returns:
+            tuple: (compiled pattern, negate, dir_only) or None if line is not a rule
+        """
+        line = line.rstrip(u'\r\n').rstrip(u' ')
+        if len(line) == 0 or line.startswith(u'#'):
+            return None
+        negate = line.startswith(u'!')
+        if negate:
+            line = line[1:]
+        if line.startswith(u'\\'):
+            line = line[1:]
+        dir_only = line.endswith(u'/')
+        line = line.rstrip(u'/')
+        anchored = u'/' in line
+        line = line.lstrip(u'/')
+        if len(line) == 0:
+            return None
+
+        regex = u''
+        index = 0
+        while index < len(line):
+            if line.startswith(u'**/', index):
+                regex += u'(?:.*/)?'
+                index += 3
+            elif line.startswith(u'/**', index) and index + 3 == len(line):
+                regex += u'/.*'
+                index += 3
+            elif line.startswith(u'**', index):
+                regex += u'.*'
+                index += 2
+            elif line[index] == u'*':
+                regex += u'[^/]*'
+                index += 1
+            elif line[index] == u'?':
+                regex += u'[^/]'
+                index += 1
+            elif line[index] == u'[' and line.find(u']', index + 1) > index + 1:
+                end = line.find(u']', index + 1)
+                chars = line[index+1:end].replace(u'\\', u'\\\\')
+                if chars.startswith(u'!'):
+                    chars = u'^' + chars[1:]
+                regex += u'[%s]' % chars
+                index = end + 1
+            else:
+                regex += re.escape(line[index])
+                index += 1
+
+        if not anchored:
+            regex = u'(?:.*/)?' + regex
+
+        return (re.compile(u'^%s$' % regex, re.UNICODE | re.DOTALL), negate, dir_only)
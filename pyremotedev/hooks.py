@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Thread, Event, Lock
+from collections import OrderedDict, deque
+import importlib
+import logging
+import os
+import stat
+import sys
+import time
+from .consts import DEFAULT_HOOK_QUIET_PERIOD
+from .metrics import REGISTRY
+
+HOOK_RUNS = REGISTRY.counter(u'remotedev_hook_runs_total', u'Post sync hooks triggered')
+HOOK_SKIPPED = REGISTRY.counter(u'remotedev_hook_skipped_total', u'Post sync hooks skipped because paths are unchanged')
+HOOK_FAILED = REGISTRY.counter(u'remotedev_hook_failed_total', u'Post sync hooks failed')
+HOOK_SECONDS = REGISTRY.histogram(u'remotedev_hook_seconds', u'Post sync hooks duration')
+BYTECODE_COMPILED = REGISTRY.counter(u'remotedev_bytecode_compiled_total', u'Python sources compiled to bytecode after sync')
+BYTECODE_SECONDS = REGISTRY.histogram(u'remotedev_bytecode_seconds', u'Time to compile a batch of python sources')
+
+#signature of directories (content is not compared)
+SIGNATURE_DIR = u'dir'
+
+def get_signature(path):
+    """
+    Return cheap signature of path (file content is not read)
+
+    Args:
+        path (string): local path
+
+    Returns:
+        tuple: file (size, mtime, inode), SIGNATURE_DIR for directory or None if path doesn't exist
+    """
+    try:
+        stats = os.stat(path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(stats.st_mode):
+        return SIGNATURE_DIR
+
+    return (stats.st_size, stats.st_mtime, stats.st_ino)
+
+def load_callable(name):
+    """
+    Load python callable
+
+    Args:
+        name (string): callable name (module:function)
+
+    Returns:
+        function: callable
+    """
+    (module_name, _, function_name) = name.partition(u':')
+    if not function_name:
+        raise Exception(u'Invalid hook callable "%s" (module:function expected)' % name)
+
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+
+
+
+class SyncHook():
+    """
+    Post sync hook of a mapping: shell command or python callable triggered once per burst of applied requests.
+    Paths signature (size, mtime, inode) is taken before their first change in the burst, hook is skipped if all
+    paths have the same signature once burst is settled
+    """
+
+    def __init__(self, name, command=None, function=None, quiet_period=DEFAULT_HOOK_QUIET_PERIOD, extensions=None):
+        """
+        Constructor
+
+        Args:
+            name (string): hook name (mapping source)
+            command (string): shell command, changed paths are written on its stdin (one per line)
+            function (function|string): callable (or module:function) called with list of changed paths
+            quiet_period (float): time without applied request before hook is triggered (seconds)
+            extensions (tuple): only paths with these extensions are handled (all paths if None)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self.command = command
+        self.function = load_callable(function) if isinstance(function, (type(u''), str)) else function
+        self.quiet_period = quiet_period
+        self.extensions = extensions
+        #changed path => signature before burst (paths are added by executor, burst is run by hooks thread)
+        self.__pending = OrderedDict()
+        self.__lock = Lock()
+
+    def add_path(self, path):
+        """
+        Add path about to be changed by applied request
+        """
+        if self.extensions is not None and not path.endswith(self.extensions):
+            return
+        with self.__lock:
+            if path not in self.__pending:
+                self.__pending[path] = get_signature(path)
+
+    def has_pending(self):
+        """
+        Return True if burst is pending
+        """
+        return len(self.__pending) > 0
+
+    def get_changed_paths(self):
+        """
+        Return paths changed during burst and start new burst
+
+        Returns:
+            list: changed paths
+        """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = OrderedDict()
+
+        return [path for (path, signature) in pending.items() if get_signature(path) != signature]
+
+    def __execute(self, paths):
+        """
+        Execute hook
+        """
+        if self.function:
+            self.function(paths)
+        if self.command:
+            import subprocess
+            env = dict(os.environ)
+            env[u'REMOTEDEV_MAPPING'] = self.name
+            env[u'REMOTEDEV_CHANGED_COUNT'] = u'%d' % len(paths)
+            process = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE, env=env)
+            process.communicate(u''.join([u'%s\n' % path for path in paths]).encode(u'utf-8'))
+            if process.returncode != 0:
+                raise Exception(u'Command "%s" failed with code %d' % (self.command, process.returncode))
+
+    def run(self):
+        """
+        Trigger hook with paths changed during burst
+        """
+        paths = self.get_changed_paths()
+        if len(paths) == 0:
+            self.logger.debug(u'Hook "%s" skipped: paths are unchanged' % self.name)
+            HOOK_SKIPPED.inc()
+            return
+
+        self.logger.info(u'Run hook "%s" (%d changed paths)' % (self.name, len(paths)))
+        HOOK_RUNS.inc()
+        start = time.time()
+        try:
+            self.__execute(paths)
+        except Exception:
+            HOOK_FAILED.inc()
+            self.logger.exception(u'Hook "%s" failed:' % self.name)
+        HOOK_SECONDS.observe(time.time() - start)
+
+
+
+
+
+class BytecodeCompiler(Thread):
+    """
+    Compile synchronized python sources to bytecode in background with low priority, so application cold start after
+    a sync doesn't compile them. Batches are compiled by a compileall process of specified interpreter (application
+    may not run with remotedev interpreter). Compiled files (.pyc, __pycache__) are never synchronized back
+    """
+
+    NICENESS = 10
+
+    def __init__(self, interpreter=None):
+        """
+        Constructor
+
+        Args:
+            interpreter (string): python interpreter of application (remotedev interpreter if None)
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.interpreter = interpreter or sys.executable
+        self.__batches = deque()
+        self.__event = Event()
+
+    def stop(self):
+        """
+        Stop compiler
+        """
+        self.running = False
+        self.__event.set()
+
+    def add_paths(self, paths):
+        """
+        Queue batch of changed python sources
+        """
+        self.__batches.appendleft(paths)
+        self.__event.set()
+
+    def __get_paths(self):
+        """
+        Return paths of all queued batches
+        """
+        paths = OrderedDict()
+        while True:
+            try:
+                for path in self.__batches.pop():
+                    paths[path] = True
+            except IndexError:
+                return list(paths.keys())
+
+    def compile(self, paths):
+        """
+        Compile specified python sources
+
+        Args:
+            paths (list): list of changed sources (removed sources have their legacy bytecode removed)
+        """
+        import subprocess
+
+        sources = []
+        for path in paths:
+            if os.path.isfile(path):
+                sources.append(path)
+            elif os.path.exists(path + u'c'):
+                #python 2 imports legacy bytecode of removed source
+                os.remove(path + u'c')
+        if len(sources) == 0:
+            return
+
+        start = time.time()
+        command = [self.interpreter, u'-m', u'compileall', u'-q', u'-i', u'-']
+        if os.name == u'posix':
+            command = [u'nice', u'-n', u'%d' % self.NICENESS] + command
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        (output, _) = process.communicate(u'\n'.join(sources).encode(u'utf-8'))
+        if process.returncode != 0:
+            self.logger.warning(u'Bytecode compilation failed for some files: %s' % output.decode(u'utf-8', u'replace'))
+        BYTECODE_COMPILED.inc(len(sources))
+        BYTECODE_SECONDS.observe(time.time() - start)
+        self.logger.debug(u'%d python sources compiled in %.3f seconds' % (len(sources), time.time() - start))
+
+    def run(self):
+        """
+        Main process: compile queued batches
+        """
+        while self.running:
+            paths = self.__get_paths()
+            if len(paths) == 0:
+                self.__event.wait(0.25)
+                self.__event.clear()
+                continue
+            try:
+                self.compile(paths)
+            except Exception:
+                self.logger.exception(u'Unable to compile python sources:')
+
+
+
+
+
+class PostSyncHooks(Thread):
+    """
+    Post sync hooks of mappings, triggered once RequestFileExecutor queue is drained and quiet period is elapsed, so
+    a burst of requests (checkout, tree copy) triggers a single run. Hooks run in this thread, so a slow hook doesn't
+    delay applied requests
+    """
+
+    def __init__(self, mappings, global_hooks=[]):
+        """
+        Constructor
+
+        Args:
+            mappings (dict): directory mappings (same order as FilepathConverter mappings), hook is configured with
+                             hook (shell command), hook_callable (callable or module:function) and hook_quiet_period
+                             mapping keys
+            global_hooks (list): hooks (SyncHook) of all mappings
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        #timestamp of last applied request once executor queue is drained, None while requests are applied
+        self.__last_applied = None
+        self.__event = Event()
+        #mapping index => list of SyncHook
+        self.hooks = {}
+        self.global_hooks = list(global_hooks)
+        for (index, src) in enumerate(mappings.keys()):
+            mapping = mappings[src]
+            hooks = list(self.global_hooks)
+            if mapping.get(u'hook') or mapping.get(u'hook_callable'):
+                quiet_period = mapping.get(u'hook_quiet_period')
+                hooks.append(SyncHook(
+                    src,
+                    command=mapping.get(u'hook'),
+                    function=mapping.get(u'hook_callable'),
+                    quiet_period=float(quiet_period) if quiet_period is not None else DEFAULT_HOOK_QUIET_PERIOD
+                ))
+            if len(hooks) > 0:
+                self.hooks[index] = hooks
+
+    def stop(self):
+        """
+        Stop hooks thread
+        """
+        self.running = False
+        self.__event.set()
+
+    def set_idle(self, last_applied):
+        """
+        Tell executor state
+
+        Args:
+            last_applied (float): timestamp of last applied request if executor queue is drained, None while
+                                  requests are applied
+        """
+        self.__last_applied = last_applied
+
+    def add_path(self, index, path):
+        """
+        Add path about to be changed
+
+        Args:
+            index (int): mapping index
+            path (string): local path
+        """
+        for hook in self.hooks.get(index, []):
+            hook.add_path(path)
+
+    def run_settled(self, last_applied):
+        """
+        Trigger hooks whose quiet period is elapsed
+
+        Args:
+            last_applied (float): timestamp of last applied request
+        """
+        elapsed = time.time() - last_applied
+        hooks = OrderedDict()
+        for mapping_hooks in self.hooks.values():
+            for hook in mapping_hooks:
+                hooks[id(hook)] = hook
+        for hook in hooks.values():
+            if hook.has_pending() and elapsed >= hook.quiet_period:
+                hook.run()
+
+    def run(self):
+        """
+        Main process: trigger hooks of settled bursts
+        """
+        while self.running:
+            last_applied = self.__last_applied
+            if last_applied is not None:
+                try:
+                    self.run_settled(last_applied)
+                except Exception:
+                    self.logger.exception(u'Unable to run post sync hooks:')
+            self.__event.wait(0.25)
+            self.__event.clear()
@@ -1,23 +1,48 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from threading import Thread
-from pygtail import Pygtail
+from threading import Thread, Event, Condition, Lock
+from collections import deque
 import logging
 import time
+import random
+import numbers
 from .request import RequestLog
+from .ratelimit import TokenBucket
+from .metrics import REGISTRY
+from .consts import LOG_OVERFLOW_DROP_OLDEST, LOG_OVERFLOW_DROP_DEBUG, LOG_OVERFLOW_BLOCK, DEFAULT_LOG_QUEUE_SIZE, DEFAULT_LOG_OVERFLOW_POLICY
+from .consts import DEFAULT_LOG_DEBUG_SAMPLING, DEFAULT_LOG_MAX_BYTES, DEFAULT_LOG_BACKUP_COUNT, DEFAULT_LOG_STORE_MAX_BYTES
 import os
+import io
 import traceback
-from logging.handlers import RotatingFileHandler
+import json
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+LOG_RECORDS_SENT = REGISTRY.counter(u'remotedev_log_records_sent_total', u'Log records and messages shipped to devenv')
+LOG_RECORDS_DROPPED = REGISTRY.counter(u'remotedev_log_records_dropped_total', u'Log records dropped because log queue was full')
+LOG_RECORDS_SUPPRESSED = REGISTRY.counter(u'remotedev_log_records_suppressed_total', u'Log records suppressed by rate limit or sampling')
+LOG_QUEUE_DEPTH = REGISTRY.gauge(u'remotedev_log_queue_depth', u'Number of log records waiting to be shipped')
+LOG_RECORDS_RECEIVED = REGISTRY.counter(u'remotedev_log_records_received_total', u'Log records and messages received from execenv')
+
 
 class LogFileWatcher(Thread):
     """
     Log file watcher (kind of tailf on specified file)
-
-    See:
-        Code from http://www.dabeaz.com/generators/follow.py
+    File handle and offset are kept in memory, thread is woken up by inotify events (through watchdog) and polls
+    file as fallback. Rotation and truncation are detected using inode and size.
+    Offset is saved (pygtail format) on shutdown and at low interval to resume after restart
     """
 
+    POLL_INTERVAL = 1.0
+    POLL_INTERVAL_NO_NOTIFY = 0.5
+    OFFSET_SAVE_INTERVAL = 30.0
+    #maximum amount of lines written while watcher was stopped that are sent at startup
+    MAX_BACKLOG = 65536
+    READ_SIZE = 65536
+
     def __init__(self, log_file_path, send_log_callback):
         """
         Constructor
@@ -32,54 +57,451 @@ class LogFileWatcher(Thread):
         #members
         self.running = True
         self.log_file_path = log_file_path
+        self.offset_file_path = u'%s.offset' % log_file_path
         self.send_log_callback = send_log_callback
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.setLevel(logging.DEBUG)
         self.logger.debug('Tail on %s' % self.log_file_path)
+        self.__fd = None
+        self.__inode = None
+        self.__offset = 0
+        self.__saved_offset = None
+        self.__partial = b''
+        self.__wakeup = Event()
 
     def stop(self):
         """
         Stop thread
         """
         self.running = False
+        self.__wakeup.set()
+
+    def __start_notifier(self):
+        """
+        Start inotify observer on log file directory
+
+        Returns:
+            Observer: started observer or None if notifications are not available
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+
+            log_file_path = os.path.abspath(self.log_file_path)
+            wakeup = self.__wakeup
+
+            class LogFileEventHandler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if event.src_path == log_file_path or getattr(event, u'dest_path', None) == log_file_path:
+                        wakeup.set()
+
+            observer = Observer()
+            observer.schedule(LogFileEventHandler(), path=os.path.dirname(log_file_path), recursive=False)
+            observer.start()
+            return observer
+
+        except Exception:
+            self.logger.exception(u'Unable to watch log file changes, polling it:')
+            return None
+
+    def __load_offset(self):
+        """
+        Load saved offset
+
+        Returns:
+            tuple: (inode, offset) or (None, None) if no valid offset saved
+        """
+        try:
+            with io.open(self.offset_file_path, u'r') as fd:
+                inode = int(fd.readline())
+                offset = int(fd.readline())
+            return (inode, offset)
+        except Exception:
+            return (None, None)
+
+    def __save_offset(self):
+        """
+        Save current offset if it changed
+        """
+        if self.__inode is None or self.__saved_offset == (self.__inode, self.__offset):
+            return
+        try:
+            with io.open(self.offset_file_path, u'w') as fd:
+                fd.write(u'%d\n%d\n' % (self.__inode, self.__offset))
+            self.__saved_offset = (self.__inode, self.__offset)
+        except Exception:
+            self.logger.exception(u'Unable to save offset:')
+
+    def __open(self, resume):
+        """
+        Open log file
+
+        Args:
+            resume (bool): resume from saved offset (if valid and backlog is small), otherwise start at end of file
+        """
+        self.__close()
+        try:
+            self.__fd = io.open(self.log_file_path, u'rb')
+        except (IOError, OSError):
+            #file not created yet (rotation)
+            return
+        st = os.fstat(self.__fd.fileno())
+        self.__inode = st.st_ino
+        self.__partial = b''
+
+        if resume is None:
+            #new file (rotation): read it from beginning
+            self.__offset = 0
+        else:
+            self.__offset = st.st_size
+            if resume:
+                (inode, offset) = self.__load_offset()
+                if inode == st.st_ino and offset is not None and 0 <= st.st_size - offset <= self.MAX_BACKLOG:
+                    self.__offset = offset
+        self.__fd.seek(self.__offset)
+
+    def __close(self):
+        """
+        Close log file
+        """
+        if self.__fd:
+            self.__fd.close()
+            self.__fd = None
+
+    def __read_lines(self):
+        """
+        Read new lines from current offset and send them. Incomplete last line is kept until completed
+        """
+        while self.running:
+            data = self.__fd.read(self.READ_SIZE)
+            if not data:
+                break
+            self.__offset += len(data)
+            lines = (self.__partial + data).split(b'\n')
+            self.__partial = lines.pop()
+            for line in lines:
+                log_line = line.decode(u'utf-8', u'replace').strip()
+                self.send_log_callback(log_line)
+
+    def __check_file(self):
+        """
+        Read new lines handling file rotation and truncation
+        """
+        if self.__fd is None:
+            self.__open(None)
+            if self.__fd is None:
+                return
+
+        #read lines appended to current file
+        self.__read_lines()
+
+        try:
+            st = os.stat(self.log_file_path)
+        except OSError:
+            #file rotated, new file not created yet
+            return
+
+        if st.st_ino != self.__inode:
+            #file rotated: lines appended to old file were read above, read new file from beginning
+            self.logger.debug(u'Log file rotated')
+            self.__open(None)
+            if self.__fd:
+                self.__read_lines()
+
+        elif st.st_size < self.__offset:
+            #file truncated
+            self.logger.debug(u'Log file truncated')
+            self.__offset = 0
+            self.__partial = b''
+            self.__fd.seek(0)
+            self.__read_lines()
 
     def run(self):
         """
         Main process
         """
         self.logger.debug('Thread started')
+        observer = None
         try:
-            #purge new lines
-            Pygtail(self.log_file_path).readlines()
+            observer = self.__start_notifier()
+            poll_interval = self.POLL_INTERVAL if observer else self.POLL_INTERVAL_NO_NOTIFY
+
+            self.__open(True)
+            last_save = time.time()
 
             #handle new lines
             while self.running:
                 try:
-                    for log_line in Pygtail(self.log_file_path):
-                        if isinstance(log_line, str):
-                            log_line = log_line.decode('utf-8')
-                        log_line = log_line.strip()
-                        self.logger.debug('New log line: %s' % log_line)
-                        self.send_log_callback(log_line)
-    
-                    #pause 
-                    time.sleep(0.5)
-
-                except:
+                    self.__check_file()
+                except Exception:
                     self.logger.exception(u'Exception on log watcher:')
 
+                if time.time() - last_save >= self.OFFSET_SAVE_INTERVAL:
+                    self.__save_offset()
+                    last_save = time.time()
+
+                #wait for changes
+                self.__wakeup.wait(poll_interval)
+                self.__wakeup.clear()
+
         except:
             self.logger.exception(u'Fatal exception on log watcher:')
 
+        finally:
+            if observer:
+                observer.stop()
+            self.__save_offset()
+            self.__close()
+
         self.logger.debug(u'Thread stopped')
 
 
 
 
 
+class LogLimiter():
+    """
+    Decide if a log must be sent, before it is queued and formatted.
+    It applies per logger level floors, per logger rate limits (token buckets) and debug logs sampling.
+    Logger settings are inherited by child loggers ("a.b" uses "a" settings if "a.b" is not configured, "" is root)
+    Suppressed (rate limited or sampled) logs are counted, logs under level floor are not
+    """
+
+    def __init__(self, levels={}, rate_limits={}, debug_sampling=DEFAULT_LOG_DEBUG_SAMPLING):
+        """
+        Constructor
+
+        Args:
+            levels (dict): minimum level by logger name (level value or name)
+            rate_limits (dict): maximum number of logs per second by logger name
+            debug_sampling (float): fraction of debug logs kept (0..1)
+        """
+        self.levels = dict([(name, self.__get_level(level)) for (name, level) in levels.items()])
+        self.rate_limits = dict([(name, float(rate)) for (name, rate) in rate_limits.items()])
+        self.debug_sampling = min(max(float(debug_sampling), 0.0), 1.0)
+        self.rate_limited = 0
+        self.sampled = 0
+        self.__buckets = dict([(name, TokenBucket(rate)) for (name, rate) in self.rate_limits.items()])
+        #logger name => (level floor, bucket)
+        self.__rules = {}
+        self.__lock = Lock()
+
+    def __get_level(self, level):
+        """
+        Return level value
+
+        Args:
+            level (int|string): level value or name
+
+        Returns:
+            int: level value
+        """
+        if not isinstance(level, int):
+            level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise Exception(u'Invalid log level "%s"' % level)
+        return level
+
+    def __get_rules(self, name):
+        """
+        Return rules applied to specified logger (most specific configured ancestor)
+
+        Args:
+            name (string): logger name
+
+        Returns:
+            tuple: (level floor, TokenBucket or None)
+        """
+        rules = self.__rules.get(name)
+        if rules is None:
+            level = logging.NOTSET
+            bucket = None
+            parts = name.split(u'.') if name else []
+            for index in range(len(parts), -1, -1):
+                ancestor = u'.'.join(parts[:index])
+                if ancestor in self.levels:
+                    level = self.levels[ancestor]
+                    break
+            for index in range(len(parts), -1, -1):
+                ancestor = u'.'.join(parts[:index])
+                if ancestor in self.__buckets:
+                    bucket = self.__buckets[ancestor]
+                    break
+            rules = (level, bucket)
+            self.__rules[name] = rules
+
+        return rules
+
+    def allow(self, name, level):
+        """
+        Return True if log must be sent
+
+        Args:
+            name (string): logger name
+            level (int): log level
+
+        Returns:
+            bool: True if log is allowed
+        """
+        (floor, bucket) = self.__get_rules(name)
+        if level < floor:
+            return False
+
+        if level <= logging.DEBUG and self.debug_sampling < 1.0 and random.random() >= self.debug_sampling:
+            with self.__lock:
+                self.sampled += 1
+            LOG_RECORDS_SUPPRESSED.inc()
+            return False
+
+        if bucket and not bucket.consume():
+            with self.__lock:
+                self.rate_limited += 1
+            LOG_RECORDS_SUPPRESSED.inc()
+            return False
+
+        return True
+
+
+
+
+
+class LogQueue():
+    """
+    Bounded log queue.
+    Producers (application threads) only append to deques (atomic operations), consumer is woken up using an event
+    that is set only when not already set. Overflow policy decides what to drop when queue is full
+    """
+
+    POLICY_DROP_OLDEST = LOG_OVERFLOW_DROP_OLDEST
+    POLICY_DROP_DEBUG = LOG_OVERFLOW_DROP_DEBUG
+    POLICY_BLOCK = LOG_OVERFLOW_BLOCK
+
+    def __init__(self, size=DEFAULT_LOG_QUEUE_SIZE, policy=DEFAULT_LOG_OVERFLOW_POLICY):
+        """
+        Constructor
+
+        Args:
+            size (int): maximum number of queued logs
+            policy (string): overflow policy (POLICY_DROP_OLDEST, POLICY_DROP_DEBUG or POLICY_BLOCK)
+        """
+        if policy not in (self.POLICY_DROP_OLDEST, self.POLICY_DROP_DEBUG, self.POLICY_BLOCK):
+            raise Exception(u'Invalid log queue overflow policy "%s"' % policy)
+
+        #members
+        self.size = size
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        #queued items are tuples (time, log)
+        self.__logs = deque()
+        #debug logs are queued apart with drop debug policy
+        self.__debug_logs = deque()
+        self.__event = Event()
+        self.__not_full = Condition()
+        self.__blocked = 0
+
+    def __len__(self):
+        """
+        Return number of queued logs
+        """
+        return len(self.__logs) + len(self.__debug_logs)
+
+    def close(self):
+        """
+        Close queue: release blocked producers
+        """
+        self.closed = True
+        with self.__not_full:
+            self.__not_full.notify_all()
+
+    def put(self, log, level=logging.INFO):
+        """
+        Queue log applying overflow policy
+
+        Args:
+            log (LogRecord|string): log record or log message
+            level (int): log level
+        """
+        if len(self) >= self.size:
+            if self.policy == self.POLICY_BLOCK:
+                with self.__not_full:
+                    self.__blocked += 1
+                    while len(self) >= self.size and not self.closed:
+                        self.__not_full.wait(0.25)
+                    self.__blocked -= 1
+
+            elif self.policy == self.POLICY_DROP_DEBUG and level <= logging.DEBUG and len(self.__debug_logs) == 0:
+                #no queued debug log to drop, drop this one
+                self.dropped += 1
+                LOG_RECORDS_DROPPED.inc()
+                return
+
+            else:
+                try:
+                    if self.policy == self.POLICY_DROP_DEBUG and len(self.__debug_logs) > 0:
+                        self.__debug_logs.popleft()
+                    else:
+                        self.__logs.popleft()
+                    self.dropped += 1
+                    LOG_RECORDS_DROPPED.inc()
+                except IndexError:
+                    #consumed meanwhile
+                    pass
+
+        if self.policy == self.POLICY_DROP_DEBUG and level <= logging.DEBUG:
+            self.__debug_logs.append((time.time(), log))
+        else:
+            self.__logs.append((time.time(), log))
+        if not self.__event.is_set():
+            self.__event.set()
+
+    def wait(self, timeout):
+        """
+        Wait for logs to be queued
+
+        Args:
+            timeout (float): maximum time to wait
+        """
+        if len(self) == 0:
+            self.__event.wait(timeout)
+
+    def get(self, max_count):
+        """
+        Unqueue logs (in queuing order)
+
+        Args:
+            max_count (int): maximum number of logs to return
+
+        Returns:
+            list: list of logs
+        """
+        self.__event.clear()
+        logs = []
+        try:
+            while len(logs) < max_count:
+                if len(self.__debug_logs) == 0:
+                    logs.append(self.__logs.popleft()[1])
+                elif len(self.__logs) == 0 or self.__debug_logs[0][0] < self.__logs[0][0]:
+                    logs.append(self.__debug_logs.popleft()[1])
+                else:
+                    logs.append(self.__logs.popleft()[1])
+        except IndexError:
+            #queue is empty
+            pass
+
+        if self.__blocked > 0:
+            with self.__not_full:
+                self.__not_full.notify_all()
+
+        return logs
+
+
+
+
+
 class RemoteDevLogHandler(logging.Handler):
     """
     Catch logs and send them to developper console
+    Emit only queues record (see RequestLogCreator) so application logging doesn't wait for the link
     """
     def __init__(self, send_callback):
         """
@@ -90,6 +512,21 @@ class RemoteDevLogHandler(logging.Handler):
         #members
         self.send_callback = send_callback
 
+    def handle(self, record):
+        """
+        Filter and emit record. Handler lock is not acquired: emit is thread safe
+
+        Args:
+            record (LogRecord): log record
+
+        Returns:
+            bool: True if record was emitted
+        """
+        emitted = self.filter(record)
+        if emitted:
+            self.emit(record)
+        return emitted
+
     def emit(self, record):
         """
         Emit log: send log record to developper environment
@@ -107,15 +544,27 @@ class RequestLogCreator(Thread):
     """
     This class is in charge to create RequestLog requests.
 
-    
-    It is in charge to perform file synchronisation between both filesystem using received requests
+    Log records and messages are queued by producers (application threads, log file watcher) and this thread
+    formats and sends them by batch. A batch is sent when it reaches a number of logs or bytes, or when its oldest
+    log waited for a maximum delay. Number of logs dropped because of queue overflow is forwarded as log message
+
+    Records are not formatted on execution env: they are shipped as template id and args, templates being sent
+    once per connection (along with the first batch using them). Consecutive identical logs are collapsed into
+    repeat markers ({'rep': count}). RequestLogExecutor formats messages
     """
 
     MODE_DISABLED = 0
     MODE_INTERNAL = 1
     MODE_EXTERNAL = 2
 
-    def __init__(self, send_request_callback, log_file_path=False, debug=False):
+    MAX_BATCH_COUNT = 200
+    MAX_BATCH_BYTES = 65536
+    MAX_BATCH_DELAY = 0.05
+    SUPPRESSED_SUMMARY_INTERVAL = 10.0
+    MAX_TEMPLATES = 4096
+
+    def __init__(self, send_request_callback, log_file_path=False, debug=False, queue_size=DEFAULT_LOG_QUEUE_SIZE, overflow_policy=DEFAULT_LOG_OVERFLOW_POLICY,
+                 levels={}, rate_limits={}, debug_sampling=DEFAULT_LOG_DEBUG_SAMPLING):
         """
         Constructor
 
@@ -123,6 +572,11 @@ class RequestLogCreator(Thread):
             send_request_callback (function): function to send request to client
             log_file_path (string): If False log handling is disabled, if None application log is handled, if path log file content is watched
             debug (bool): enable debug
+            queue_size (int): maximum number of logs waiting to be sent
+            overflow_policy (string): policy applied when queue is full (see LogQueue)
+            levels (dict): minimum level by logger name (see LogLimiter)
+            rate_limits (dict): maximum number of logs per second by logger name (see LogLimiter)
+            debug_sampling (float): fraction of debug logs kept (see LogLimiter)
         """
         Thread.__init__(self)
         Thread.daemon = True
@@ -137,57 +591,263 @@ class RequestLogCreator(Thread):
         self.__log_handler = None
         self.__log_file_watcher = None
         self.send_request_callback = send_request_callback
+        self.__queue = LogQueue(queue_size, overflow_policy)
+        self.__forwarded_dropped = 0
+        self.__limiter = None
+        if levels or rate_limits or debug_sampling < 1.0:
+            self.__limiter = LogLimiter(levels, rate_limits, debug_sampling)
+        self.__forwarded_suppressed = (0, 0)
+        self.__summary_time = time.time()
+        self.__batch = []
+        self.__batch_bytes = 0
+        self.__batch_time = None
+        #template => template id, templates not sent yet
+        self.__templates = {}
+        self.__new_templates = {}
+        self.__last_key = None
+
+    def __add_to_batch(self, log):
+        """
+        Encode log and add it to current batch. Log identical to previous one is collapsed
 
-    def send_log_record(self, record):
+        Args:
+            log (LogRecord|string): log record or log message
+        """
+        if isinstance(log, logging.LogRecord):
+            (log, key, size) = self.__encode_record(log)
+        else:
+            (key, size) = (log, len(log))
+
+        if key == self.__last_key:
+            #same log than previous one, count it
+            if len(self.__batch) > 0 and isinstance(self.__batch[-1], dict) and u'rep' in self.__batch[-1]:
+                self.__batch[-1][u'rep'] += 1
+                return
+            (log, size) = ({u'rep': 1}, 8)
+        else:
+            self.__last_key = key
+
+        if len(self.__batch) == 0:
+            self.__batch_time = time.time()
+        self.__batch.append(log)
+        self.__batch_bytes += size
+
+    def __add_dropped_log(self):
+        """
+        Add log about dropped logs to current batch if new logs were dropped
+        """
+        dropped = self.__queue.dropped
+        if dropped == self.__forwarded_dropped:
+            return
+
+        self.__add_to_batch(u'[remotedev] %d log(s) dropped (queue full), %d since start' % (dropped - self.__forwarded_dropped, dropped))
+        self.__forwarded_dropped = dropped
+
+    def __add_suppressed_log(self, force=False):
         """
-        Send log record
+        Periodically add log about suppressed logs (rate limited or sampled) to current batch
 
         Args:
-            record (LogRecord): log record to send
+            force (bool): add log even if summary interval is not elapsed
+        """
+        if not self.__limiter:
+            return
+        now = time.time()
+        if not force and now - self.__summary_time < self.SUPPRESSED_SUMMARY_INTERVAL:
+            return
+
+        (rate_limited, sampled) = (self.__limiter.rate_limited, self.__limiter.sampled)
+        (last_rate_limited, last_sampled) = self.__forwarded_suppressed
+        suppressed = (rate_limited - last_rate_limited) + (sampled - last_sampled)
+        if suppressed > 0:
+            self.__add_to_batch(u'[remotedev] %d log(s) suppressed during last %.0f seconds (rate limit: %d, sampling: %d), %d since start' % (
+                suppressed,
+                now - self.__summary_time,
+                rate_limited - last_rate_limited,
+                sampled - last_sampled,
+                rate_limited + sampled
+            ))
+        self.__forwarded_suppressed = (rate_limited, sampled)
+        self.__summary_time = now
+
+    def __is_batch_ready(self):
+        """
+        Return True if current batch must be sent
+
+        Returns:
+            bool: True if batch is ready
+        """
+        if len(self.__batch) == 0:
+            return False
+
+        return len(self.__batch) >= self.MAX_BATCH_COUNT or \
+            self.__batch_bytes >= self.MAX_BATCH_BYTES or \
+            time.time() - self.__batch_time >= self.MAX_BATCH_DELAY
+
+    def __send_batch(self):
+        """
+        Send current batch of logs
         """
-        #prepare request
+        if len(self.__batch) == 0:
+            return
+
         request = RequestLog()
-        if record.__dict__['exc_info']:
-            msg = record.__dict__['msg'] + '\nTraceback (most recent call last):\n' + ''.join(traceback.format_tb(record.__dict__['exc_info'][2])) + type(record.__dict__['exc_info'][1]).__name__ + ': ' + record.__dict__['exc_info'][1].message
+        request.log_batch = self.__batch
+        if self.__new_templates:
+            request.log_templates = dict([(u'%d' % template_id, template) for (template, template_id) in self.__new_templates.items()])
+        self.__batch = []
+        self.__batch_bytes = 0
+        self.__new_templates = {}
+        if self.send_request_callback(request) is False:
+            #request lost, templates will be sent again
+            self.__templates = {}
+            self.__last_key = None
         else:
-            msg = record.__dict__['msg']
-        if len(msg)==0:
-            #drop empty message
-            self.logger.debug('Drop empty message')
-            return
+            LOG_RECORDS_SENT.inc(len(request.log_batch))
+
+    def __process_logs(self, flush=False):
+        """
+        Wait for queued logs, batch them and send batch when ready
+
+        Args:
+            flush (bool): send all queued logs without waiting
+        """
+        if not flush:
+            if len(self.__batch) == 0:
+                self.__queue.wait(0.25)
+            else:
+                timeout = self.__batch_time + self.MAX_BATCH_DELAY - time.time()
+                if timeout > 0.0:
+                    self.__queue.wait(timeout)
+
+        while True:
+            for log in self.__queue.get(self.MAX_BATCH_COUNT - len(self.__batch)):
+                self.__add_to_batch(log)
+            LOG_QUEUE_DEPTH.set(len(self.__queue))
+            self.__add_dropped_log()
+            self.__add_suppressed_log(force=flush)
+
+            if flush and len(self.__queue) > 0:
+                self.__send_batch()
+            elif flush or self.__is_batch_ready():
+                self.__send_batch()
+                break
+            else:
+                break
+
+    def __is_primitive(self, value):
+        """
+        Return True if value can be shipped as is (formatting it on development env gives same result)
+        """
+        return value is None or isinstance(value, (bool, float) + STRING_TYPES) or isinstance(value, numbers.Integral)
+
+    def __get_template_id(self, template):
+        """
+        Return template id, registering template if needed
+
+        Args:
+            template (string): message template
+
+        Returns:
+            int: template id or None if too many templates are registered
+        """
+        template_id = self.__templates.get(template)
+        if template_id is None:
+            if len(self.__templates) >= self.MAX_TEMPLATES:
+                return None
+            template_id = len(self.__templates)
+            self.__templates[template] = template_id
+            self.__new_templates[template] = template_id
+
+        return template_id
+
+    def __encode_record(self, record):
+        """
+        Encode log record without formatting its message
 
-        request.log_record = {
-            'name': record.__dict__['name'],
-            'lvl': record.__dict__['levelno'],
-            'fn': record.__dict__['filename'],
-            'lno': record.__dict__['lineno'],
-            'msg': msg,
-            'args': None,
-            'exc_info': None,
-            'func': record.__dict__['funcName']
+        Args:
+            record (LogRecord): log record
+
+        Returns:
+            tuple: (encoded record (dict), repeat key, approximative size)
+        """
+        template = record.msg if isinstance(record.msg, STRING_TYPES) else u'%s' % record.msg
+        args = record.args
+        if isinstance(args, dict):
+            if not all([self.__is_primitive(value) for value in args.values()]):
+                args = None
+        elif args:
+            args = list(args)
+            if not all([self.__is_primitive(arg) for arg in args]):
+                args = None
+        else:
+            args = []
+        if args is None:
+            #args can't be shipped (objects): message is formatted here
+            template = record.getMessage()
+            args = []
+
+        log = {
+            u'name': record.name,
+            u'lvl': record.levelno,
+            u'fn': record.filename,
+            u'lno': record.lineno,
+            u'func': record.funcName
         }
+        size = 64
+        template_id = self.__get_template_id(template)
+        if template_id is None:
+            log[u'msg'] = template
+            size += len(template)
+        else:
+            log[u'tpl'] = template_id
+        if args:
+            log[u'args'] = args
+            size += sum([len(arg) if isinstance(arg, STRING_TYPES) else 8 for arg in (args.values() if isinstance(args, dict) else args)])
+        exc = None
+        if record.exc_info:
+            exc = u'Traceback (most recent call last):\n' + u''.join(traceback.format_tb(record.exc_info[2])) + type(record.exc_info[1]).__name__ + u': ' + u'%s' % record.exc_info[1]
+            log[u'exc'] = exc
+            size += len(exc)
+
+        return (log, (record.name, record.levelno, template, args, exc), size)
+
+    def send_log_record(self, record):
+        """
+        Send log record (queue it, it is formatted and sent by creator thread)
+
+        Args:
+            record (LogRecord): log record to send
+        """
+        if record.thread == self.ident:
+            #drop records logged while sending logs (avoid feedback loop)
+            return
+        if not record.msg:
+            #drop empty message
+            return
+        if self.__limiter and not self.__limiter.allow(record.name, record.levelno):
+            return
 
-        #send request
-        self.send_request_callback(request)
+        self.__queue.put(record, record.levelno)
 
     def send_log_message(self, message):
         """
-        Send log message
+        Send log message (queue it, it is sent by creator thread)
 
         Args:
             message (string): log message to send
         """
-        #prepare request
-        request = RequestLog()
-        request.log_message = message.strip()
+        message = message.strip()
 
         #drop message if empty
-        if request.is_empty():
-            self.logger.debug(u'Drop empty log request')
+        if len(message) == 0:
+            self.logger.debug(u'Drop empty log message')
+            return
+        #log file lines have no logger nor level: root logger rules apply
+        if self.__limiter and not self.__limiter.allow(u'', logging.INFO):
             return
 
-        #send request
-        self.send_request_callback(request)
+        self.__queue.put(message)
 
     def __get_internal_log_handler(self):
         """
@@ -270,21 +930,129 @@ class RequestLogCreator(Thread):
         self.__install_log()
 
         while self.running:
-            time.sleep(0.25)
+            try:
+                self.__process_logs()
+            except Exception:
+                self.logger.exception(u'Exception sending logs:')
 
         #install log
         self.__uninstall_log()
 
+        #send remaining logs
+        self.__queue.close()
+        self.__process_logs(flush=True)
+
+
+
 
 
+def get_log_store_path(base_dir, remote_host):
+    """
+    Return path of remote logs store
+
+    Args:
+        base_dir (string): directory of source
+        remote_host (string): remote host
+
+    Returns:
+        string: store path
+    """
+    return os.path.join(base_dir, u'remote_%s.db' % remote_host)
 
 
-class RequestLogExecutor():
+class LogFileWriter():
     """
-    This class executes actions when receiving RequestLog
+    Buffered log file writer with size based rotation (same naming than RotatingFileHandler: file.1, file.2...)
+    It is not thread safe: it is used by RequestLogExecutor thread only
     """
 
-    def __init__(self, base_dir, remote_host, debug=False):
+    def __init__(self, path, max_bytes=DEFAULT_LOG_MAX_BYTES, backup_count=DEFAULT_LOG_BACKUP_COUNT):
+        """
+        Constructor
+
+        Args:
+            path (string): log file path
+            max_bytes (int): file size triggering rotation (0 disables rotation)
+            backup_count (int): number of rotated files kept
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.__fd = None
+        self.__size = 0
+
+    def __open(self):
+        """
+        Open log file in append mode
+        """
+        self.__fd = io.open(self.path, u'a', encoding=u'utf-8', errors=u'replace')
+        self.__size = self.__fd.tell()
+
+    def __rotate(self):
+        """
+        Rotate log files
+        """
+        self.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = u'%s.%d' % (self.path, index)
+                if os.path.exists(src):
+                    os.rename(src, u'%s.%d' % (self.path, index + 1))
+            os.rename(self.path, u'%s.1' % self.path)
+        else:
+            os.remove(self.path)
+        self.__open()
+
+    def write(self, lines):
+        """
+        Write lines (buffered, call flush to write them on disk)
+
+        Args:
+            lines (list): list of lines (without line feed)
+        """
+        if self.__fd is None:
+            self.__open()
+        for line in lines:
+            line += u'\n'
+            if self.max_bytes > 0 and self.__size > 0 and self.__size + len(line) > self.max_bytes:
+                self.__rotate()
+            self.__fd.write(line)
+            self.__size += len(line)
+
+    def flush(self):
+        """
+        Flush buffered lines
+        """
+        if self.__fd:
+            self.__fd.flush()
+
+    def close(self):
+        """
+        Close file
+        """
+        if self.__fd:
+            self.__fd.close()
+            self.__fd = None
+
+
+
+
+
+class RequestLogExecutor(Thread):
+    """
+    This class executes actions when receiving RequestLog.
+    Requests are queued by receiving thread and this thread formats and writes them by chunk, so a log flood doesn't
+    slow down reception of file requests. Logs are written to remote_<host>.log file and optionally to
+    remote_<host>.jsonl file (one json object per line) and to remote_<host>.db indexed store (see LogStore)
+    Queue is bounded in number of logs: when writing can't keep up (log flood, slow store), oldest requests are
+    dropped so reception never waits, and number of dropped logs is written to log file
+    """
+
+    FLUSH_INTERVAL = 0.1
+
+    def __init__(self, base_dir, remote_host, debug=False, max_bytes=DEFAULT_LOG_MAX_BYTES, backup_count=DEFAULT_LOG_BACKUP_COUNT, json_output=False,
+                 store=False, store_max_bytes=DEFAULT_LOG_STORE_MAX_BYTES, queue_size=DEFAULT_LOG_QUEUE_SIZE):
         """
         Constructor
 
@@ -292,70 +1060,261 @@ class RequestLogExecutor():
             base_dir (string): directory of source (place used to store log file)
             remote_host (string): remote host
             debug (bool): enable debug
+            max_bytes (int): log file size triggering rotation (0 disables rotation)
+            backup_count (int): number of rotated log files kept
+            json_output (bool): also write logs in json lines file
+            store (bool): also write logs in indexed store
+            store_max_bytes (int): maximum store size
+            queue_size (int): maximum number of logs waiting to be written
         """
+        Thread.__init__(self)
+        Thread.daemon = True
+
         #members
         self.logger = logging.getLogger(self.__class__.__name__)
         if debug:
             self.logger.setLevel(logging.DEBUG)
-        self.remote_logger = None
+        self.running = True
         self.remote_host = remote_host
         self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.json_output = json_output
+        self.store = store
+        self.store_max_bytes = store_max_bytes
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.__text_writer = None
+        self.__json_writer = None
+        self.__store = None
+        #queued items are tuples (time, request, number of logs)
+        self.__requests = deque()
+        self.__queued = 0
+        self.__written_dropped = 0
+        self.__lock = Lock()
+        self.__event = Event()
+        #template id => template (sent once per connection by RequestLogCreator)
+        self.__templates = {}
 
     def stop(self):
         """
         Stop process
         """
         self.logger.debug('Stop requested')
+        self.running = False
+        self.__event.set()
 
-    def start(self):
+    def __init_writers(self):
+        """
+        Init log file writers
         """
-        Configure class
+        path = os.path.join(self.base_dir, u'remote_%s.log' % self.remote_host)
+        self.__text_writer = LogFileWriter(path, self.max_bytes, self.backup_count)
+        if self.json_output:
+            path = os.path.join(self.base_dir, u'remote_%s.jsonl' % self.remote_host)
+            self.__json_writer = LogFileWriter(path, self.max_bytes, self.backup_count)
+        if self.store:
+            from .logstore import LogStore
+            self.__store = LogStore(get_log_store_path(self.base_dir, self.remote_host), self.store_max_bytes)
+            self.__store.open()
+
+    def __format_message(self, log):
         """
-        self.init_remote_logger()
+        Format message of received log record
 
-    def init_remote_logger(self):
+        Args:
+            log (dict): log record
+
+        Returns:
+            string: formatted message
         """
-        Init remote logger (logger on development env)
+        if u'tpl' in log:
+            template = self.__templates.get(log[u'tpl'])
+            if template is None:
+                template = u'<unknown log template %s>' % log[u'tpl']
+        else:
+            template = log[u'msg']
+        args = log.get(u'args')
+        if isinstance(args, list):
+            args = tuple(args)
+
+        msg = template
+        if args:
+            try:
+                msg = template % args
+            except Exception:
+                msg = u'%s %s' % (template, args)
+        if log.get(u'exc'):
+            msg += u'\n' + log[u'exc']
+
+        return msg
+
+    def __make_entry(self, log, received):
         """
-        #create new handler
-        path = os.path.join(self.base_dir, 'remote_%s.log' % self.remote_host)
-        handler = RotatingFileHandler(path, maxBytes=2048000, backupCount=2, encoding='utf-8')
-        formatter = logging.Formatter('%(message)s')
-        handler.setFormatter(formatter)
-        
-        #create new remote logger
-        self.remote_logger = logging.getLogger('RemoteLog')
-        self.remote_logger.handlers = [handler]
-        self.remote_logger.setLevel(logging.INFO)
+        Make log entry from received log
 
-    def add_request(self, request):
+        Args:
+            log (dict|string): log record, repeat marker or log message
+            received (float): reception timestamp
+
+        Returns:
+            dict: log entry (msg, level, logger, file, line, func, ts)
         """
-        Add specified request to queue
+        if isinstance(log, dict) and u'rep' in log:
+            return {u'msg': u'Last message repeated %d times' % log[u'rep'], u'repeat': log[u'rep'], u'ts': received}
+
+        if isinstance(log, dict):
+            return {
+                u'msg': self.__format_message(log),
+                u'level': logging.getLevelName(log[u'lvl']),
+                u'logger': log[u'name'],
+                u'file': log[u'fn'],
+                u'line': log[u'lno'],
+                u'func': log[u'func'],
+                u'ts': received
+            }
+
+        return {u'msg': log, u'ts': received}
+
+    def __get_logs(self, request):
+        """
+        Return logs contained in request
 
         Args:
-            request (Request): request instance
+            request (RequestLog): request
+
+        Returns:
+            list: list of logs (dict or string)
         """
         if request.log_record:
-            #it's an exception record
+            #it's an exception record (old format: msg and args)
             self.logger.debug('Process RequestLog log record')
-            record = self.remote_logger.makeRecord(
-                request.log_record['name'],
-                request.log_record['lvl'],
-                request.log_record['fn'],
-                request.log_record['lno'],
-                request.log_record['msg'],
-                request.log_record['args'],
-                request.log_record['exc_info'],
-                request.log_record['func']
-            )
-            self.remote_logger.handle(record)
+            return [request.log_record]
 
         elif request.log_message:
             #it's a log message
             self.logger.debug('Process RequestLog log message')
-            self.remote_logger.info(request.log_message)
+            return [request.log_message]
 
-        else:
-            #invalid log request
-            self.logger.warning(u'Not supposed receiving empty log request')
+        elif request.log_batch:
+            #it's a batch of log records and messages
+            self.logger.debug('Process RequestLog log batch')
+            self.__keep_templates(request)
+            return request.log_batch
+
+        #invalid log request
+        self.logger.warning(u'Not supposed receiving empty log request')
+        return []
+
+    def __keep_templates(self, request):
+        """
+        Keep templates sent in request (templates are sent once per connection, they must be kept even if request
+        is dropped)
+
+        Args:
+            request (RequestLog): request
+        """
+        if request.log_templates:
+            for (template_id, template) in request.log_templates.items():
+                self.__templates[int(template_id)] = template
 
+    def __get_dropped_log(self):
+        """
+        Return log about dropped logs if new logs were dropped
+
+        Returns:
+            string: log message or None
+        """
+        dropped = self.dropped
+        if dropped == self.__written_dropped:
+            return None
+
+        message = u'[remotedev] %d log(s) dropped (devenv queue full), %d since start' % (dropped - self.__written_dropped, dropped)
+        self.__written_dropped = dropped
+        return message
+
+    def __write_requests(self):
+        """
+        Format and write queued requests
+        """
+        text_lines = []
+        json_lines = []
+        entries = []
+        while True:
+            with self.__lock:
+                try:
+                    (received, request, count) = self.__requests.popleft()
+                except IndexError:
+                    break
+                self.__queued -= count
+            logs = self.__get_logs(request)
+            LOG_RECORDS_RECEIVED.inc(len(logs))
+            dropped_log = self.__get_dropped_log()
+            if dropped_log:
+                logs = [dropped_log] + list(logs)
+            for log in logs:
+                entry = self.__make_entry(log, received)
+                text_lines.append(entry[u'msg'])
+                if self.__json_writer:
+                    json_lines.append(json.dumps(entry, ensure_ascii=False))
+                if self.__store:
+                    entries.append(entry)
+
+        if text_lines:
+            self.__text_writer.write(text_lines)
+        if json_lines:
+            self.__json_writer.write(json_lines)
+        if entries:
+            self.__store.add(entries)
+
+    def add_request(self, request):
+        """
+        Add specified request to queue
+
+        Args:
+            request (Request): request instance
+        """
+        count = len(request.log_batch) if request.log_batch else 1
+        with self.__lock:
+            self.__requests.append((time.time(), request, count))
+            self.__queued += count
+            #drop oldest requests when queue is full (newest one is always kept)
+            while self.__queued > self.queue_size and len(self.__requests) > 1:
+                (_, dropped_request, dropped_count) = self.__requests.popleft()
+                self.__queued -= dropped_count
+                self.__keep_templates(dropped_request)
+                self.dropped += dropped_count
+                LOG_RECORDS_DROPPED.inc(dropped_count)
+        if not self.__event.is_set():
+            self.__event.set()
+
+    def run(self):
+        """
+        Main process: write queued logs, flush files periodically
+        """
+        self.__init_writers()
+
+        last_flush = time.time()
+        try:
+            while self.running:
+                self.__event.wait(self.FLUSH_INTERVAL)
+                self.__event.clear()
+                try:
+                    self.__write_requests()
+                    if time.time() - last_flush >= self.FLUSH_INTERVAL:
+                        self.__text_writer.flush()
+                        if self.__json_writer:
+                            self.__json_writer.flush()
+                        last_flush = time.time()
+                except Exception:
+                    self.logger.exception(u'Exception writing logs:')
+
+            #write remaining logs
+            self.__write_requests()
+
+        finally:
+            self.__text_writer.close()
+            if self.__json_writer:
+                self.__json_writer.close()
+            if self.__store:
+                self.__store.close()
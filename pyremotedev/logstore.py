@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sqlite3
+from .consts import DEFAULT_LOG_STORE_MAX_BYTES
+
+class LogStore():
+    """
+    Local SQLite store of remote logs.
+    Messages are indexed with full text search (fts5, fts4 if not available, plain LIKE otherwise), level, logger
+    and time are indexed too. Retention is size based: oldest logs are purged when database exceeds maximum size
+    """
+
+    PURGE_RATIO = 0.2
+    CHECK_SIZE_INTERVAL = 1000
+
+    def __init__(self, path, max_bytes=DEFAULT_LOG_STORE_MAX_BYTES):
+        """
+        Constructor
+
+        Args:
+            path (string): database file path
+            max_bytes (int): maximum database size (0 to disable retention)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fts = None
+        self.__conn = None
+        self.__inserted = 0
+
+    def open(self):
+        """
+        Open database, creating it if necessary
+        """
+        self.__conn = sqlite3.connect(self.path)
+        self.__conn.execute(u'PRAGMA auto_vacuum=INCREMENTAL')
+        self.__conn.execute(u'PRAGMA journal_mode=WAL')
+        self.__conn.execute(u'PRAGMA synchronous=NORMAL')
+        self.__conn.execute(u'CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY, ts REAL, level INTEGER, logger TEXT, file TEXT, line INTEGER, func TEXT, msg TEXT)')
+        self.__conn.execute(u'CREATE INDEX IF NOT EXISTS logs_ts ON logs (ts)')
+        self.__conn.execute(u'CREATE INDEX IF NOT EXISTS logs_level ON logs (level, ts)')
+        self.__conn.execute(u'CREATE INDEX IF NOT EXISTS logs_logger ON logs (logger, ts)')
+
+        #messages index: external content table pointing to logs table
+        for fts in (u'fts5', u'fts4'):
+            try:
+                if fts == u'fts5':
+                    self.__conn.execute(u'CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(msg, content=logs, content_rowid=id)')
+                else:
+                    self.__conn.execute(u'CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts4(content=logs, msg)')
+                self.fts = fts
+                break
+            except sqlite3.OperationalError:
+                self.logger.debug(u'SQLite %s extension not available' % fts)
+        if self.fts is None:
+            self.logger.warning(u'SQLite full text search is not available, text search will be slow')
+        self.__conn.commit()
+
+    def close(self):
+        """
+        Close database
+        """
+        if self.__conn:
+            self.__conn.close()
+            self.__conn = None
+
+    def add(self, entries):
+        """
+        Store log entries
+
+        Args:
+            entries (list): list of log entries (dict with msg, ts and optionally level, logger, file, line, func)
+        """
+        if self.__conn is None:
+            self.open()
+
+        rows = []
+        for entry in entries:
+            level = logging.getLevelName(entry.get(u'level', u'INFO'))
+            rows.append((
+                entry[u'ts'],
+                level if isinstance(level, int) else logging.INFO,
+                entry.get(u'logger'),
+                entry.get(u'file'),
+                entry.get(u'line'),
+                entry.get(u'func'),
+                entry[u'msg']
+            ))
+
+        with self.__conn:
+            cursor = self.__conn.execute(u'SELECT COALESCE(MAX(id), 0) FROM logs')
+            first_id = cursor.fetchone()[0] + 1
+            self.__conn.executemany(u'INSERT INTO logs (ts, level, logger, file, line, func, msg) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            if self.fts:
+                self.__conn.execute(u'INSERT INTO logs_fts (rowid, msg) SELECT id, msg FROM logs WHERE id >= ?', (first_id,))
+
+        self.__inserted += len(rows)
+        if self.__inserted >= self.CHECK_SIZE_INTERVAL:
+            self.__inserted = 0
+            self.__apply_retention()
+
+    def __get_used_size(self):
+        """
+        Return size used by data in database
+
+        Returns:
+            int: size in bytes
+        """
+        page_size = self.__conn.execute(u'PRAGMA page_size').fetchone()[0]
+        page_count = self.__conn.execute(u'PRAGMA page_count').fetchone()[0]
+        free_count = self.__conn.execute(u'PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_count) * page_size
+
+    def __apply_retention(self):
+        """
+        Purge oldest logs if database exceeds maximum size
+        """
+        if self.max_bytes <= 0 or self.__get_used_size() <= self.max_bytes:
+            return
+
+        (min_id, max_id) = self.__conn.execute(u'SELECT MIN(id), MAX(id) FROM logs').fetchone()
+        if min_id is None:
+            return
+        last_id = min_id + int((max_id - min_id + 1) * self.PURGE_RATIO)
+        self.logger.debug(u'Purge logs until id %d' % last_id)
+        with self.__conn:
+            if self.fts == u'fts5':
+                self.__conn.execute(u'INSERT INTO logs_fts (logs_fts, rowid, msg) SELECT \'delete\', id, msg FROM logs WHERE id <= ?', (last_id,))
+            elif self.fts == u'fts4':
+                self.__conn.execute(u'DELETE FROM logs_fts WHERE docid <= ?', (last_id,))
+            self.__conn.execute(u'DELETE FROM logs WHERE id <= ?', (last_id,))
+        self.__conn.execute(u'PRAGMA incremental_vacuum')
+
+    def query(self, level=None, logger=None, since=None, until=None, text=None, limit=100, raw_text=False):
+        """
+        Search logs
+
+        Args:
+            level (int): minimum level
+            logger (string): logger name (child loggers are returned too)
+            since (float): minimum timestamp
+            until (float): maximum timestamp
+            text (string): text to search in messages (searched as a phrase with full text search if available)
+            limit (int): maximum number of returned logs (most recent ones)
+            raw_text (bool): text is a full text search query (operators, prefixes...) instead of a phrase
+
+        Returns:
+            list: list of logs (dict) in chronological order
+        """
+        if self.__conn is None:
+            self.open()
+
+        conditions = []
+        values = []
+        if level is not None:
+            conditions.append(u'logs.level >= ?')
+            values.append(level)
+        if logger:
+            conditions.append(u'(logs.logger = ? OR logs.logger LIKE ?)')
+            values += [logger, logger + u'.%']
+        if since is not None:
+            conditions.append(u'logs.ts >= ?')
+            values.append(since)
+        if until is not None:
+            conditions.append(u'logs.ts <= ?')
+            values.append(until)
+        if text and self.fts:
+            conditions.append(u'logs.id IN (SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?)')
+            #punctuation (file.py, KeyError:) is fts query syntax: text is quoted as a phrase
+            values.append(text if raw_text else u'"%s"' % text.replace(u'"', u'""'))
+        elif text:
+            conditions.append(u'logs.msg LIKE ?')
+            values.append(u'%' + text + u'%')
+
+        sql = u'SELECT ts, level, logger, file, line, func, msg FROM logs'
+        if conditions:
+            sql += u' WHERE ' + u' AND '.join(conditions)
+        sql += u' ORDER BY logs.id DESC LIMIT ?'
+        values.append(limit)
+
+        logs = []
+        for (ts, level, logger, filename, line, func, msg) in self.__conn.execute(sql, values):
+            logs.append({
+                u'ts': ts,
+                u'level': logging.getLevelName(level),
+                u'logger': logger,
+                u'file': filename,
+                u'line': line,
+                u'func': func,
+                u'msg': msg
+            })
+        logs.reverse()
+
+        return logs
+
+    def exists(self):
+        """
+        Return True if database file exists
+        """
+        return os.path.exists(self.path)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Thread, Lock
+import bisect
+import json
+import logging
+import os
+import socket
+import tempfile
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+class Counter():
+    """
+    Monotonic counter
+    """
+
+    def __init__(self, name, description=u''):
+        """
+        Constructor
+
+        Args:
+            name (string): metric name
+            description (string): metric description
+        """
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.__lock = Lock()
+
+    def inc(self, value=1):
+        """
+        Increment counter
+
+        Args:
+            value (int): increment
+        """
+        with self.__lock:
+            self.value += value
+
+    def collect(self):
+        """
+        Return metric value
+        """
+        return self.value
+
+
+
+
+
+class Gauge():
+    """
+    Value that can go up and down
+    """
+
+    def __init__(self, name, description=u''):
+        """
+        Constructor
+
+        Args:
+            name (string): metric name
+            description (string): metric description
+        """
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value):
+        """
+        Set gauge value
+
+        Args:
+            value (float): new value
+        """
+        self.value = value
+
+    def collect(self):
+        """
+        Return metric value
+        """
+        return self.value
+
+
+
+
+
+class Histogram():
+    """
+    Histogram with fixed buckets (exponential from 100us to ~100s by default).
+    Quantiles are estimated by linear interpolation inside buckets
+    """
+
+    DEFAULT_BUCKETS = [0.0001 * (2 ** index) for index in range(21)]
+
+    def __init__(self, name, description=u'', buckets=None):
+        """
+        Constructor
+
+        Args:
+            name (string): metric name
+            description (string): metric description
+            buckets (list): sorted bucket upper bounds
+        """
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets or self.DEFAULT_BUCKETS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.__lock = Lock()
+
+    def observe(self, value):
+        """
+        Add observation
+
+        Args:
+            value (float): observed value
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, quantile):
+        """
+        Estimate quantile
+
+        Args:
+            quantile (float): quantile (0..1)
+
+        Returns:
+            float: estimated value or None if there is no observation
+        """
+        if self.count == 0:
+            return None
+
+        rank = quantile * self.count
+        cumulative = 0
+        for (index, count) in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return self.buckets[-1]
+
+    def collect(self):
+        """
+        Return metric value
+        """
+        return {
+            u'count': self.count,
+            u'sum': self.sum,
+            u'p50': self.quantile(0.5),
+            u'p95': self.quantile(0.95),
+            u'p99': self.quantile(0.99)
+        }
+
+
+
+
+
+class MetricsRegistry():
+    """
+    Metrics registry. Metrics are created on first access and shared by name
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__metrics = {}
+        self.__lock = Lock()
+
+    def __get(self, metric_class, name, description, *args):
+        """
+        Return metric, creating it if necessary
+        """
+        metric = self.__metrics.get(name)
+        if metric is None:
+            with self.__lock:
+                metric = self.__metrics.get(name)
+                if metric is None:
+                    metric = metric_class(name, description, *args)
+                    self.__metrics[name] = metric
+
+        return metric
+
+    def counter(self, name, description=u''):
+        """
+        Return counter
+
+        Returns:
+            Counter: counter instance
+        """
+        return self.__get(Counter, name, description)
+
+    def gauge(self, name, description=u''):
+        """
+        Return gauge
+
+        Returns:
+            Gauge: gauge instance
+        """
+        return self.__get(Gauge, name, description)
+
+    def histogram(self, name, description=u'', buckets=None):
+        """
+        Return histogram
+
+        Returns:
+            Histogram: histogram instance
+        """
+        return self.__get(Histogram, name, description, buckets)
+
+    def collect(self):
+        """
+        Return all metrics values
+
+        Returns:
+            dict: metric name => value (histograms values are dict)
+        """
+        return dict([(name, metric.collect()) for (name, metric) in list(self.__metrics.items())])
+
+    def to_prometheus(self):
+        """
+        Return metrics in prometheus text format
+
+        Returns:
+            string: metrics
+        """
+        lines = []
+        for (name, metric) in sorted(list(self.__metrics.items())):
+            if metric.description:
+                lines.append(u'# HELP %s %s' % (name, metric.description))
+            if isinstance(metric, Histogram):
+                lines.append(u'# TYPE %s histogram' % name)
+                cumulative = 0
+                for (bound, count) in zip(metric.buckets + [u'+Inf'], metric.counts):
+                    cumulative += count
+                    lines.append(u'%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+                lines.append(u'%s_sum %s' % (name, metric.sum))
+                lines.append(u'%s_count %d' % (name, metric.count))
+            else:
+                lines.append(u'# TYPE %s %s' % (name, u'counter' if isinstance(metric, Counter) else u'gauge'))
+                lines.append(u'%s %s' % (name, metric.value))
+
+        return u'\n'.join(lines) + u'\n'
+
+#process wide registry
+REGISTRY = MetricsRegistry()
+
+
+
+
+
+def get_default_metrics_endpoint(mode):
+    """
+    Return default metrics endpoint
+
+    Args:
+        mode (string): devenv or execenv
+
+    Returns:
+        string: unix socket endpoint ("unix:<path>") or tcp endpoint ("<host>:<port>") if unix sockets are not supported
+    """
+    if hasattr(socket, u'AF_UNIX'):
+        return u'unix:%s' % os.path.join(tempfile.gettempdir(), u'remotedev-%s.sock' % mode)
+    return u'127.0.0.1:%d' % (52667 if mode == u'devenv' else 52668)
+
+def parse_metrics_endpoint(endpoint):
+    """
+    Parse metrics endpoint
+
+    Args:
+        endpoint (string): "unix:<path>" or "<host>:<port>"
+
+    Returns:
+        tuple: (socket family, address)
+    """
+    if endpoint.startswith(u'unix:'):
+        return (socket.AF_UNIX, endpoint[5:])
+    (host, port) = endpoint.rsplit(u':', 1)
+    return (socket.AF_INET, (host, int(port)))
+
+def query_endpoint(endpoint, path, timeout=2.0):
+    """
+    Send http GET request to running remotedev instance endpoint
+
+    Args:
+        endpoint (string): metrics endpoint
+        path (string): request path (with query string)
+        timeout (float): socket timeout
+
+    Returns:
+        tuple: (http status code, json decoded body)
+    """
+    (family, address) = parse_metrics_endpoint(endpoint)
+    client = socket.socket(family, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(address)
+        client.sendall(b'GET ' + path.encode(u'utf-8') + b' HTTP/1.0\r\n\r\n')
+        response = b''
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    finally:
+        client.close()
+
+    (headers, body) = response.split(b'\r\n\r\n', 1)
+    status = int(headers.split(b' ')[1])
+    return (status, json.loads(body.decode(u'utf-8')))
+
+def fetch_metrics(endpoint, timeout=2.0):
+    """
+    Fetch metrics from running remotedev instance
+
+    Args:
+        endpoint (string): metrics endpoint
+        timeout (float): socket timeout
+
+    Returns:
+        dict: metrics values
+    """
+    return query_endpoint(endpoint, u'/stats', timeout)[1]
+
+def send_response(client, body, content_type=b'application/json', status=b'200 OK'):
+    """
+    Send http response
+
+    Args:
+        client (socket): client socket
+        body (bytes): response body
+        content_type (bytes): body content type
+        status (bytes): http status
+    """
+    client.sendall(b'HTTP/1.0 ' + status + b'\r\nContent-Type: ' + content_type + b'\r\nContent-Length: ' + str(len(body)).encode(u'ascii') + b'\r\n\r\n' + body)
+
+
+
+
+
+class HandlerThread(Thread):
+    """
+    Answer request with custom handler (handlers can be slow, ie file pull, and must not block metrics requests)
+    """
+
+    def __init__(self, client, handler, params):
+        """
+        Constructor
+
+        Args:
+            client (socket): client socket
+            handler (function): function called with query parameters (dict), returning json serializable result
+            params (dict): query parameters (name => value)
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.client = client
+        self.handler = handler
+        self.params = params
+
+    def run(self):
+        """
+        Main process
+        """
+        try:
+            try:
+                body = json.dumps(self.handler(self.params))
+                status = b'200 OK'
+            except Exception as e:
+                body = json.dumps({u'error': u'%s' % e})
+                status = b'500 Internal Server Error'
+            send_response(self.client, body.encode(u'utf-8'), status=status)
+        except Exception:
+            self.logger.debug(u'Handler request failed', exc_info=True)
+        finally:
+            self.client.close()
+
+
+
+
+
+class MetricsServer(Thread):
+    """
+    Serve metrics registry over http, on tcp port or unix socket:
+     - /metrics returns prometheus text format
+     - paths of added handlers (ie /pull on devenv) are answered by handlers
+     - any other path returns json
+    """
+
+    def __init__(self, endpoint, registry=REGISTRY):
+        """
+        Constructor
+
+        Args:
+            endpoint (string): "unix:<path>" or "<host>:<port>"
+            registry (MetricsRegistry): registry to serve
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.endpoint = endpoint
+        self.registry = registry
+        self.__server = None
+        self.__unix_path = None
+        self.__handlers = {}
+
+    def stop(self):
+        """
+        Stop server
+        """
+        self.running = False
+
+    def add_handler(self, path, handler):
+        """
+        Answer requests on specified path with handler. Handler is called in its own thread
+
+        Args:
+            path (string): request path (ie /pull)
+            handler (function): function called with query parameters (dict), returning json serializable result.
+                                Exception message is returned as error
+        """
+        self.__handlers[path] = handler
+
+    def __bind(self):
+        """
+        Create server socket
+
+        Returns:
+            bool: True if server is listening
+        """
+        (family, address) = parse_metrics_endpoint(self.endpoint)
+        if family != socket.AF_INET:
+            #remove stale socket file, but don't steal socket of running instance
+            if os.path.exists(address):
+                probe = socket.socket(family, socket.SOCK_STREAM)
+                try:
+                    probe.connect(address)
+                    self.logger.warning(u'Metrics endpoint "%s" is already used by another instance' % self.endpoint)
+                    return False
+                except socket.error:
+                    os.remove(address)
+                finally:
+                    probe.close()
+            self.__unix_path = address
+
+        self.__server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__server.settimeout(0.5)
+        self.__server.bind(address)
+        self.__server.listen(5)
+        self.logger.debug(u'Metrics served on %s' % self.endpoint)
+
+        return True
+
+    def __handle_client(self, client):
+        """
+        Answer client request
+
+        Returns:
+            bool: True if request is answered by handler thread (it closes client)
+        """
+        client.settimeout(1.0)
+        request = b''
+        while b'\r\n\r\n' not in request and b'\n\n' not in request and len(request) < 8192:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            request += chunk
+        parts = request.split(b' ')
+        path = parts[1] if len(parts) > 1 else b'/'
+
+        url = urlparse(path.decode(u'utf-8'))
+        if url.path in self.__handlers:
+            params = dict([(name, values[-1]) for (name, values) in parse_qs(url.query).items()])
+            client.settimeout(None)
+            HandlerThread(client, self.__handlers[url.path], params).start()
+            return True
+
+        if path.startswith(b'/metrics'):
+            send_response(client, self.registry.to_prometheus().encode(u'utf-8'), content_type=b'text/plain; version=0.0.4')
+        else:
+            send_response(client, json.dumps(self.registry.collect(), sort_keys=True).encode(u'utf-8'))
+
+        return False
+
+    def run(self):
+        """
+        Main process
+        """
+        try:
+            if not self.__bind():
+                return
+
+            while self.running:
+                try:
+                    (client, _) = self.__server.accept()
+                except socket.timeout:
+                    continue
+                handled = False
+                try:
+                    handled = self.__handle_client(client)
+                except Exception:
+                    self.logger.debug(u'Metrics request failed', exc_info=True)
+                finally:
+                    if not handled:
+                        client.close()
+
+        except Exception:
+            self.logger.exception(u'Metrics server error:')
+
+        finally:
+            if self.__server:
+                self.__server.close()
+            if self.__unix_path and os.path.exists(self.__unix_path):
+                os.remove(self.__unix_path)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Thread, Lock
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+class StatsSnapshot():
+    """
+    Profile stats snapshot, loadable by pstats.Stats without disabling running profiler
+    """
+
+    def __init__(self, stats):
+        """
+        Constructor
+
+        Args:
+            stats (dict): profile stats
+        """
+        self.stats = stats
+
+    def create_stats(self):
+        """
+        Stats are already created
+        """
+        pass
+
+
+
+
+
+class StackSampler(Thread):
+    """
+    Sample stacks of all threads periodically and count them in collapsed format (flamegraph input).
+    If thread cpu clocks are available, only threads running on cpu are counted, weighted by cpu time (us)
+    """
+
+    def __init__(self, get_role, interval=0.01):
+        """
+        Constructor
+
+        Args:
+            get_role (function): function returning role of specified thread
+            interval (float): sampling interval (seconds)
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.get_role = get_role
+        self.interval = interval
+        self.__stacks = {}
+        self.__lock = Lock()
+        self.__cpu_times = {}
+        self.__cpu_clock = hasattr(time, u'pthread_getcpuclockid')
+
+    def stop(self):
+        """
+        Stop sampling
+        """
+        self.running = False
+
+    def get_stacks(self):
+        """
+        Return collapsed stacks
+
+        Returns:
+            dict: collapsed stack => weight
+        """
+        with self.__lock:
+            return dict(self.__stacks)
+
+    def __get_cpu_time(self, ident):
+        """
+        Return cpu time consumed by specified thread
+
+        Returns:
+            float: cpu time (seconds) or None if not available
+        """
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except Exception:
+            return None
+
+    def __get_weight(self, ident):
+        """
+        Return sample weight of specified thread: cpu time consumed since last sample (us) or 1 if cpu clock is
+        not available
+
+        Returns:
+            int: weight (0 if thread was idle)
+        """
+        if not self.__cpu_clock:
+            return 1
+        cpu_time = self.__get_cpu_time(ident)
+        if cpu_time is None:
+            return 1
+        last = self.__cpu_times.get(ident, cpu_time)
+        self.__cpu_times[ident] = cpu_time
+
+        return int((cpu_time - last) * 1000000)
+
+    def __sample(self):
+        """
+        Sample stacks of all threads
+        """
+        own_ident = threading.current_thread().ident
+        threads = dict([(thread.ident, thread) for thread in threading.enumerate()])
+        for (ident, frame) in list(sys._current_frames().items()):
+            if ident == own_ident or ident not in threads:
+                continue
+            weight = self.__get_weight(ident)
+            if weight <= 0:
+                continue
+
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(u'%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            names.append(self.get_role(threads[ident]))
+            stack = u';'.join(reversed(names))
+            with self.__lock:
+                self.__stacks[stack] = self.__stacks.get(stack, 0) + weight
+
+    def run(self):
+        """
+        Main process
+        """
+        #sampler itself is not profiled
+        sys.setprofile(None)
+
+        while self.running:
+            try:
+                self.__sample()
+            except Exception:
+                self.logger.debug(u'Stack sampling failed', exc_info=True)
+            time.sleep(self.interval)
+
+
+
+
+
+class ThreadProfiler():
+    """
+    Profile every thread started after profiler (and thread that starts it) with its own cProfile profiler measuring
+    thread cpu time. Stats are aggregated by thread role (thread class name, or thread name for plain threads) and
+    dumped to output directory:
+     - <role>.prof: pstats file (python -m pstats <role>.prof to sort and browse it)
+     - profile.txt: most expensive functions of each role
+     - stacks.collapsed: collapsed stacks (flamegraph.pl or speedscope input) if stack sampling is enabled
+    """
+
+    TOP_FUNCTIONS = 30
+
+    def __init__(self, output_dir, stacks=False, sampling_interval=0.01):
+        """
+        Constructor
+
+        Args:
+            output_dir (string): directory where stats are dumped
+            stacks (bool): sample stacks of all threads to dump collapsed stacks
+            sampling_interval (float): stack sampling interval (seconds)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.output_dir = output_dir
+        self.sampler = StackSampler(self.get_role, sampling_interval) if stacks else None
+        #list of (role, profiler)
+        self.__profilers = []
+        self.__lock = Lock()
+        self.__unsupported = False
+        self.__timer = getattr(time, u'thread_time', None)
+
+    def get_role(self, thread):
+        """
+        Return thread role
+
+        Args:
+            thread (Thread): thread instance
+
+        Returns:
+            string: thread class name or thread name without counter for plain threads
+        """
+        if thread.__class__ is Thread or thread.__class__ is threading._MainThread:
+            return re.sub(r'[-_]?\d+(\s*\(.*\))?$', u'', thread.name) or u'Thread'
+        return thread.__class__.__name__
+
+    def __profile_current_thread(self):
+        """
+        Start profiler on current thread
+        """
+        if self.__unsupported:
+            return
+
+        profiler = cProfile.Profile(self.__timer) if self.__timer else cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            #python >= 3.12 allows only one profiler at once
+            self.__unsupported = True
+            self.logger.warning(u'Per thread profiling is not supported by this python version, only first thread is profiled (use stacks sampling)')
+            return
+
+        with self.__lock:
+            self.__profilers.append((self.get_role(threading.current_thread()), profiler))
+
+    def __bootstrap(self, frame, event, arg):
+        """
+        Profile hook installed by threading on new threads: replace it with thread profiler
+        """
+        sys.setprofile(None)
+        if self.sampler is not None and threading.current_thread() is self.sampler:
+            return
+        self.__profile_current_thread()
+
+    def start(self):
+        """
+        Start profiling current thread and all new threads
+        """
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        if self.sampler:
+            self.sampler.start()
+        threading.setprofile(self.__bootstrap)
+        self.__profile_current_thread()
+        self.logger.info(u'Profiling enabled, stats will be written in "%s"' % self.output_dir)
+
+    def stop(self):
+        """
+        Stop profiling new threads and dump stats
+        """
+        threading.setprofile(None)
+        if self.sampler:
+            self.sampler.stop()
+        self.dump()
+
+    def get_stats(self):
+        """
+        Return current stats aggregated by role. Profilers keep running
+
+        Returns:
+            dict: role => (number of threads, pstats.Stats)
+        """
+        with self.__lock:
+            profilers = list(self.__profilers)
+
+        stats = {}
+        for (role, profiler) in profilers:
+            profiler.snapshot_stats()
+            snapshot = StatsSnapshot(dict(profiler.stats))
+            if role in stats:
+                stats[role][1].add(snapshot)
+                stats[role] = (stats[role][0] + 1, stats[role][1])
+            else:
+                stats[role] = (1, pstats.Stats(snapshot))
+
+        return stats
+
+    def dump(self):
+        """
+        Dump current stats in output directory
+        """
+        try:
+            stats = self.get_stats()
+            summary_path = os.path.join(self.output_dir, u'profile.txt')
+            with open(summary_path, u'w') as fd:
+                fd.write(u'Profile dumped at %s (times are thread cpu times)\n\n' % time.strftime(u'%Y-%m-%d %H:%M:%S'))
+                for (role, (count, role_stats)) in sorted(stats.items(), key=lambda item: item[1][1].total_tt, reverse=True):
+                    role_stats.dump_stats(os.path.join(self.output_dir, u'%s.prof' % role))
+                    fd.write(u'==== %s (%d thread(s), %.3f seconds)\n' % (role, count, role_stats.total_tt))
+                    role_stats.stream = fd
+                    role_stats.sort_stats(u'cumulative').print_stats(self.TOP_FUNCTIONS)
+
+            if self.sampler:
+                with open(os.path.join(self.output_dir, u'stacks.collapsed'), u'w') as fd:
+                    for (stack, weight) in sorted(self.sampler.get_stacks().items()):
+                        fd.write(u'%s %d\n' % (stack, weight))
+
+            self.logger.info(u'Profile stats written in "%s"' % self.output_dir)
+
+        except Exception:
+            self.logger.exception(u'Unable to dump profile stats:')
@@ -2,42 +2,77 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from logging.handlers import RotatingFileHandler
-import io
 import os
 import time
 import socket
-import sys
-import getpass
-import platform
-import subprocess
-from pygtail import Pygtail
-try:
-    import configparser
-except:
-    import ConfigParser as configparser
-import shutil
-import traceback
-from .version import __version__
-from appdirs import user_data_dir
-from threading import Thread
-from collections import deque
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
-from sshtunnel import SSHTunnelForwarder
-import bson
-try:
-    # pylint: disable=E0602
-    input = raw_input
-except Exception:
-    pass
-try:
-    _unicode = unicode
-except NameError:
-    _unicode = str
-from .file import RequestFileCreator
-from .synchronizer import SynchronizerDevEnv, SynchronizerExecEnv
 import re
+from threading import Thread
+from .consts import WATCHER_POLLING, DEFAULT_SCAN_INTERVAL, DEFAULT_SCAN_CPU_BUDGET, DEFAULT_SCAN_WORKERS
+from .consts import DEFAULT_LOG_QUEUE_SIZE, DEFAULT_LOG_OVERFLOW_POLICY, DEFAULT_LOG_DEBUG_SAMPLING
+from .consts import DEFAULT_LOG_MAX_BYTES, DEFAULT_LOG_BACKUP_COUNT, DEFAULT_LOG_STORE_MAX_BYTES
+from .consts import DEFAULT_EXEC_PORT, DEFAULT_FANOUT_QUEUE_SIZE
+
+#heavy dependencies (watchdog, sshtunnel, bson...) are imported lazily on code paths that need them, so importing
+#this module (ie to embed remotedev in an application) stays fast
+
+
+def create_observer(profile):
+    """
+    Create filesystem observer according to profile
+
+    Args:
+        profile (dict): devenv or execenv profile
+
+    Returns:
+        Observer|SnapshotScanner: watchdog observer or polling scanner
+    """
+    if profile.get(u'watcher') == WATCHER_POLLING:
+        from .scanner import SnapshotScanner
+        return SnapshotScanner(
+            interval=profile.get(u'scan_interval', DEFAULT_SCAN_INTERVAL),
+            cpu_budget=profile.get(u'scan_cpu_budget', DEFAULT_SCAN_CPU_BUDGET),
+            workers=profile.get(u'scan_workers', DEFAULT_SCAN_WORKERS)
+        )
+
+    from watchdog.observers import Observer
+    return Observer()
+
+def create_metrics_server(profile, mode):
+    """
+    Create metrics server according to profile
+
+    Args:
+        profile (dict): devenv or execenv profile
+        mode (string): devenv or execenv (used to build default endpoint)
+
+    Returns:
+        MetricsServer: metrics server or None if metrics endpoint is disabled (empty)
+    """
+    from .metrics import MetricsServer, get_default_metrics_endpoint
+    endpoint = profile.get(u'metrics_endpoint')
+    if endpoint is None:
+        endpoint = get_default_metrics_endpoint(mode)
+    if not endpoint:
+        return None
+
+    return MetricsServer(endpoint)
+
+def create_recorder(profile, mode):
+    """
+    Create requests recorder according to profile
+
+    Args:
+        profile (dict): devenv or execenv profile
+        mode (string): devenv or execenv
+
+    Returns:
+        RequestRecorder: recorder or None if capture is disabled (no capture_path in profile)
+    """
+    if not profile.get(u'capture_path'):
+        return None
+
+    from .recorder import RequestRecorder
+    return RequestRecorder(profile[u'capture_path'], mode)
 
 
 class PyRemoteDev(Thread):
@@ -59,6 +94,7 @@ class PyRemoteDev(Thread):
         self.profile = profile
         self.running = True
         self.debug = debug
+        self.synchronizer = None
         
     def stop(self):
         """
@@ -66,28 +102,133 @@ class PyRemoteDev(Thread):
         """
         self.running = False
 
+    def pull(self, path, timeout=60.0):
+        """
+        Pull content of lazy file (file announced by execenv without its content)
+
+        Args:
+            path (string): file path (absolute or relative to local dir)
+            timeout (float): maximum time to wait for content (seconds)
+
+        Returns:
+            int: file size
+
+        Raises:
+            Exception if file can't be pulled
+        """
+        if self.synchronizer is None:
+            raise Exception(u'Devenv is not started')
+
+        return self.synchronizer.pull(path, timeout)
+
+    def __handle_pull(self, params):
+        """
+        Handle pull request received on metrics endpoint ("remotedev pull" command)
+
+        Args:
+            params (dict): request parameters (path and timeout)
+
+        Returns:
+            dict: pulled file path and size
+        """
+        size = self.pull(params[u'path'], float(params.get(u'timeout', 60.0)))
+
+        return {
+            u'path': params[u'path'],
+            u'size': size
+        }
+
+    def __get_remotes(self):
+        """
+        Return remotes to synchronize
+
+        Returns:
+            list: list of remotes (dict with name, remote_host, remote_port, ssh_username, ssh_password, exec_port)
+        """
+        if self.profile.get(u'remote_hosts'):
+            return self.profile[u'remote_hosts']
+
+        return [{
+            u'name': self.profile[u'remote_host'],
+            u'remote_host': self.profile[u'remote_host'],
+            u'remote_port': self.profile[u'remote_port'],
+            u'ssh_username': self.profile[u'ssh_username'],
+            u'ssh_password': self.profile[u'ssh_password'],
+            u'exec_port': self.profile.get(u'exec_port', DEFAULT_EXEC_PORT)
+        }]
+
+    def __create_synchronizer(self, remote, recorder):
+        """
+        Create synchronizer of specified remote
+
+        Args:
+            remote (dict): remote (see __get_remotes)
+            recorder (RequestRecorder): requests recorder
+
+        Returns:
+            SynchronizerDevEnv: synchronizer
+        """
+        from .synchronizer import SynchronizerDevEnv
+
+        return SynchronizerDevEnv(
+            remote[u'remote_host'],
+            remote[u'remote_port'],
+            remote[u'ssh_username'],
+            remote[u'ssh_password'],
+            self.profile[u'local_dir'],
+            self.debug,
+            log_options={
+                u'max_bytes': self.profile.get(u'log_max_bytes', DEFAULT_LOG_MAX_BYTES),
+                u'backup_count': self.profile.get(u'log_backup_count', DEFAULT_LOG_BACKUP_COUNT),
+                u'json_output': self.profile.get(u'log_json', False),
+                u'store': self.profile.get(u'log_store', False),
+                u'store_max_bytes': self.profile.get(u'log_store_max_bytes', DEFAULT_LOG_STORE_MAX_BYTES),
+                u'queue_size': self.profile.get(u'log_queue_size', DEFAULT_LOG_QUEUE_SIZE)
+            },
+            forward_port=remote[u'exec_port'],
+            use_tunnel=self.profile.get(u'ssh_tunnel', True),
+            recorder=recorder,
+            bandwidth_limits=self.profile.get(u'bandwidth_limits', {}),
+            name=remote[u'name']
+        )
+
     def run(self):
         """
         Main process
         """
+        from .file import RequestFileCreator
+        from .synchronizer import SynchronizerFanOut
+
         if not os.path.exists(self.profile[u'local_dir']):
             raise Exception(u'Directory "%s" does not exist. Please update the loaded profile' % self.profile[u'local_dir'])
 
-        #start synchronizer
-        synchronizer = SynchronizerDevEnv(
-            self.profile[u'remote_host'],
-            self.profile[u'remote_port'],
-            self.profile[u'ssh_username'],
-            self.profile[u'ssh_password'],
-            self.profile[u'local_dir'],
-            self.debug
-        )
+        #start metrics server (also used by pull command)
+        metrics_server = create_metrics_server(self.profile, u'devenv')
+        if metrics_server:
+            metrics_server.add_handler(u'/pull', self.__handle_pull)
+            metrics_server.start()
+
+        #start synchronizer (fan-out to several remotes if profile has several remote hosts)
+        recorder = create_recorder(self.profile, u'devenv')
+        remotes = self.__get_remotes()
+        synchronizers = [self.__create_synchronizer(remote, recorder) for remote in remotes]
+        if len(synchronizers) == 1:
+            synchronizer = synchronizers[0]
+        else:
+            synchronizer = SynchronizerFanOut(synchronizers, self.profile.get(u'fanout_queue_size', DEFAULT_FANOUT_QUEUE_SIZE))
         synchronizer.start()
-
-        #create filesystem watchdog
-        observer = Observer()
+        self.synchronizer = synchronizer
+
+        #create filesystem watchdog (remote logs files and their rotated backups are not synchronized)
+        drop_prefixes = [os.path.join(self.profile[u'local_dir'], u'remote_%s' % remote[u'name']) for remote in remotes]
+        request_file_creator = RequestFileCreator(synchronizer.add_request, self.profile[u'local_dir'], drop_prefixes=drop_prefixes)
+        if len(synchronizers) > 1:
+            #remote too late is resynchronized from local files
+            synchronizer.set_resync_callback(request_file_creator.resync)
+        request_file_creator.start()
+        observer = create_observer(self.profile)
         observer.schedule(
-            RequestFileCreator(synchronizer.add_request, self.profile[u'local_dir']),
+            request_file_creator,
             path=self.profile[u'local_dir'],
             recursive=True)
         observer.start()
@@ -104,11 +245,16 @@ class PyRemoteDev(Thread):
 
         finally:
             observer.stop()
+            request_file_creator.stop()
             synchronizer.stop()
+            if metrics_server:
+                metrics_server.stop()
 
         #close properly application
         observer.join()
         synchronizer.join()
+        if recorder:
+            recorder.close()
 
 
 
@@ -137,6 +283,7 @@ class PyRemoteExec(Thread):
         self.debug = debug
         self.remote_logging = remote_logging
         self.__observers = []
+        self.__recorder = None
         if debug:
             self.logger.setLevel(logging.DEBUG)
 
@@ -174,16 +321,28 @@ class PyRemoteExec(Thread):
         Returns:
             SynchronizerExecEnv
         """
+        from .file import RequestFileCreator
+        from .synchronizer import SynchronizerExecEnv
+
         #create synchronizer
+        log_options = {
+            u'queue_size': self.profile.get(u'log_queue_size', DEFAULT_LOG_QUEUE_SIZE),
+            u'overflow_policy': self.profile.get(u'log_overflow_policy', DEFAULT_LOG_OVERFLOW_POLICY),
+            u'levels': self.profile.get(u'log_levels', {}),
+            u'rate_limits': self.profile.get(u'log_rate_limits', {}),
+            u'debug_sampling': self.profile.get(u'log_debug_sampling', DEFAULT_LOG_DEBUG_SAMPLING)
+        }
+        bandwidth_limits = self.profile.get(u'bandwidth_limits', {})
+        precompile = self.profile.get(u'precompile')
         if self.profile[u'log_file_path']:
             self.logger.debug(u'Create synchronizer with log file "%s" handling' % self.profile[u'log_file_path'])
-            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], self.profile[u'log_file_path'], self.debug)
+            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], self.profile[u'log_file_path'], self.debug, log_options, self.__recorder, bandwidth_limits, precompile)
         elif self.remote_logging:
             self.logger.debug(u'Create synchronizer with internal application log (lib mode) handling')
-            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], None, self.debug)
+            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], None, self.debug, log_options, self.__recorder, bandwidth_limits, precompile)
         else:
             self.logger.debug(u'Create synchronizer with no log handling')
-            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], False, self.debug)
+            synchronizer = SynchronizerExecEnv(ip, port, clientsocket, self.profile[u'mappings'], False, self.debug, log_options, self.__recorder, bandwidth_limits, precompile)
         synchronizer.start()
 
         #create filesystem watchdogs on each mappings
@@ -192,16 +351,19 @@ class PyRemoteExec(Thread):
             if not os.path.exists(dest):
                 #create missing directory to be able to watch changes
                 os.makedirs(dest)
-            drop_files = [self.profile[u'log_file_path']]
+            #application log file, its rotated backups and tail offset file are not synchronized
+            drop_files = [self.profile[u'log_file_path']] if self.profile[u'log_file_path'] else []
             self.logger.debug(u'Create filesystem observer for dir "%s"' % dest)
-            observer = Observer()
+            request_file_creator = RequestFileCreator(synchronizer.add_request, dest, mappings=self.profile[u'mappings'], drop_files=drop_files, drop_prefixes=drop_files, lazy_threshold=self.profile.get(u'lazy_pull_threshold'))
+            request_file_creator.start()
+            observer = create_observer(self.profile)
             observer.schedule(
-                RequestFileCreator(synchronizer.add_request, dest, mappings=self.profile[u'mappings'], drop_files=drop_files),
+                request_file_creator,
                 path=dest,
                 recursive=True)
             observer.start()
 
-            self.__observers.append(observer)
+            self.__observers.append((observer, request_file_creator))
 
         return synchronizer
 
@@ -211,8 +373,9 @@ class PyRemoteExec(Thread):
         """
         #stop all of client observers
         while len(self.__observers) > 0:
-            observer = self.__observers.pop()
+            (observer, request_file_creator) = self.__observers.pop()
             observer.stop()
+            request_file_creator.stop()
 
         #and stop client process itself (synchronizer)
         client.stop()
@@ -221,14 +384,20 @@ class PyRemoteExec(Thread):
         """
         Main process
         """
+        #start metrics server
+        metrics_server = create_metrics_server(self.profile, u'execenv')
+        if metrics_server:
+            metrics_server.start()
+
         #main loop
         last_client = None
+        self.__recorder = create_recorder(self.profile, u'execenv')
         try:
             #create communication server
             server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server.settimeout(1.0)
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server.bind(('', 52666))
+            server.bind(('', self.profile.get(u'exec_port', DEFAULT_EXEC_PORT)))
 
             self.logger.debug(u'Listening for connections...')
             while self.running:
@@ -256,4 +425,8 @@ class PyRemoteExec(Thread):
             #stop last connected client
             if last_client:
                 self.__stop_client(last_client)
+            if self.__recorder:
+                self.__recorder.close()
+            if metrics_server:
+                metrics_server.stop()
                 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Lock, Condition
+from collections import deque
+import time
+from .consts import TRAFFIC_TOTAL, TRAFFIC_CONTROL, TRAFFIC_FILE, TRAFFIC_LOG
+from .metrics import REGISTRY
+
+class TokenBucket():
+    """
+    Thread safe token bucket.
+    Tokens are refilled continuously at specified rate up to bucket capacity
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Constructor
+
+        Args:
+            rate (float): number of tokens refilled per second
+            capacity (float): maximum number of tokens (default is one second of tokens, at least 1)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.__last = time.time()
+        self.__lock = Lock()
+
+    def __refill(self, now):
+        """
+        Refill tokens according to elapsed time
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def consume(self, amount=1.0):
+        """
+        Consume tokens if available
+
+        Args:
+            amount (float): number of tokens to consume
+
+        Returns:
+            bool: True if tokens were consumed, False if bucket doesn't contain enough tokens
+        """
+        with self.__lock:
+            self.__refill(time.time())
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def get_delay(self, amount=1.0):
+        """
+        Return time to wait before tokens are available. An amount bigger than bucket capacity is available as soon
+        as bucket is full (see take)
+
+        Args:
+            amount (float): number of tokens
+
+        Returns:
+            float: delay (seconds), 0.0 if tokens are available
+        """
+        with self.__lock:
+            self.__refill(time.time())
+            missing = min(amount, self.capacity) - self.tokens
+            return max(missing, 0.0) / self.rate
+
+    def take(self, amount):
+        """
+        Consume tokens even if bucket doesn't contain enough. Bucket goes into debt which is refilled before next
+        tokens are available
+
+        Args:
+            amount (float): number of tokens to consume
+        """
+        with self.__lock:
+            self.__refill(time.time())
+            self.tokens -= amount
+
+
+
+
+
+class TrafficShaper():
+    """
+    Shape traffic sent by several threads on the same transport (socket).
+    Each traffic class (file content, logs) can be limited by its own token bucket (bytes per second) and all classes
+    together by a total bucket. Control traffic (acknowledges, ping...) is never limited.
+    Messages are sent one at a time: waiting control messages go first, then classes are served fairly according to
+    bytes they already sent, so a big sync doesn't starve logs. Messages are paced by chunks to not burst the link.
+    A message holds transport until it is fully sent: big file bodies are sent as several messages by transport
+    (see Frame), but an archive request (up to 4MB) still delays other classes for its whole transfer
+    """
+
+    CHUNK_SIZE = 16384
+
+    def __init__(self, limits={}):
+        """
+        Constructor
+
+        Args:
+            limits (dict): maximum bytes per second by traffic class (file, log or total). Missing, null or 0 limit
+                means unlimited
+        """
+        self.limits = dict([(name, float(rate)) for (name, rate) in limits.items() if rate and float(rate) > 0.0])
+        self.__buckets = dict([(name, TokenBucket(rate)) for (name, rate) in self.limits.items()])
+        self.__total = self.__buckets.pop(TRAFFIC_TOTAL, None)
+        self.__condition = Condition()
+        self.__busy = False
+        #waiting message tickets by class, and bytes sent by class (fair queuing)
+        self.__queues = {}
+        self.__served = {}
+        self.__virtual_time = 0
+        self.__ticket = 0
+        self.__metrics = {}
+        for name in (TRAFFIC_CONTROL, TRAFFIC_FILE, TRAFFIC_LOG):
+            self.__get_metrics(name)
+        REGISTRY.gauge(u'remotedev_shaper_%s_limit_bytes' % TRAFFIC_TOTAL, u'Bandwidth limit of all traffic classes (bytes per second, 0 if unlimited)').set(self.limits.get(TRAFFIC_TOTAL, 0))
+
+    def __get_metrics(self, traffic_class):
+        """
+        Return metrics of specified traffic class
+
+        Returns:
+            tuple: (sent bytes counter, wait histogram, pending gauge)
+        """
+        metrics = self.__metrics.get(traffic_class)
+        if metrics is None:
+            metrics = (
+                REGISTRY.counter(u'remotedev_shaper_%s_bytes_total' % traffic_class, u'Bytes sent in %s traffic class' % traffic_class),
+                REGISTRY.histogram(u'remotedev_shaper_%s_wait_seconds' % traffic_class, u'Time %s messages waited for their turn and bandwidth' % traffic_class),
+                REGISTRY.gauge(u'remotedev_shaper_%s_pending' % traffic_class, u'Number of %s messages waiting to be sent' % traffic_class)
+            )
+            REGISTRY.gauge(u'remotedev_shaper_%s_limit_bytes' % traffic_class, u'Bandwidth limit of %s traffic class (bytes per second, 0 if unlimited)' % traffic_class).set(self.limits.get(traffic_class, 0))
+            self.__metrics[traffic_class] = metrics
+
+        return metrics
+
+    def __get_next_ticket(self):
+        """
+        Return ticket of next message to send: control messages first, then oldest message of class that sent fewer
+        bytes
+
+        Returns:
+            int: ticket or None if no message is waiting
+        """
+        candidates = [(name != TRAFFIC_CONTROL, self.__served[name], queue[0]) for (name, queue) in self.__queues.items() if queue]
+        return min(candidates)[2] if candidates else None
+
+    def __acquire(self, traffic_class, pending):
+        """
+        Wait for message turn to use transport
+
+        Args:
+            traffic_class (string): message traffic class
+            pending (Gauge): class pending messages gauge
+        """
+        with self.__condition:
+            queue = self.__queues.setdefault(traffic_class, deque())
+            if len(queue) == 0:
+                #class becoming active again gets no credit for time it was idle
+                self.__served[traffic_class] = max(self.__served.get(traffic_class, 0), self.__virtual_time)
+            self.__ticket += 1
+            ticket = self.__ticket
+            queue.append(ticket)
+            pending.set(len(queue))
+
+            while self.__busy or self.__get_next_ticket() != ticket:
+                self.__condition.wait()
+
+            queue.popleft()
+            pending.set(len(queue))
+            self.__busy = True
+            self.__virtual_time = self.__served[traffic_class]
+
+    def __release(self, traffic_class, size):
+        """
+        Release transport after message is sent
+
+        Args:
+            traffic_class (string): message traffic class
+            size (int): message size
+        """
+        with self.__condition:
+            self.__busy = False
+            self.__served[traffic_class] += size
+            self.__condition.notify_all()
+
+    def send(self, traffic_class, size, send):
+        """
+        Send message when its turn comes, at allowed rate
+
+        Args:
+            traffic_class (string): traffic class (file, log or control)
+            size (int): message size
+            send (function): function sending message range (offset, length)
+        """
+        (sent_bytes, wait, pending) = self.__get_metrics(traffic_class)
+        start = time.time()
+        self.__acquire(traffic_class, pending)
+        waited = time.time() - start
+        try:
+            buckets = [self.__buckets.get(traffic_class)]
+            if traffic_class != TRAFFIC_CONTROL:
+                buckets.append(self.__total)
+            buckets = [bucket for bucket in buckets if bucket is not None]
+            if len(buckets) == 0:
+                send(0, size)
+            else:
+                for offset in range(0, size, self.CHUNK_SIZE):
+                    length = min(self.CHUNK_SIZE, size - offset)
+                    delay = max([bucket.get_delay(length) for bucket in buckets])
+                    while delay > 0.0:
+                        time.sleep(delay)
+                        waited += delay
+                        delay = max([bucket.get_delay(length) for bucket in buckets])
+                    for bucket in buckets:
+                        bucket.take(length)
+                    send(offset, length)
+            sent_bytes.inc(size)
+
+        finally:
+            self.__release(traffic_class, size)
+            wait.observe(waited)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+import gzip
+import io
+import logging
+import struct
+import time
+from .version import __version__
+
+RECORD_HEADER = u'h'
+RECORD_SENT = u's'
+RECORD_RECEIVED = u'r'
+
+def open_capture(path, mode):
+    """
+    Open capture file, gzip compressed if path ends with .gz
+
+    Args:
+        path (string): capture file path
+        mode (string): file mode (binary)
+
+    Returns:
+        file: file object
+    """
+    if path.endswith(u'.gz'):
+        return gzip.open(path, mode, compresslevel=1)
+    return io.open(path, mode)
+
+def read_records(path):
+    """
+    Read capture records
+
+    Args:
+        path (string): capture file path
+
+    Returns:
+        generator: records (dict with t (timestamp), d (direction) and r (request dict) or header fields)
+    """
+    import bson
+
+    with open_capture(path, u'rb') as fd:
+        while True:
+            try:
+                data = fd.read(4)
+                if len(data) < 4:
+                    break
+                length = struct.unpack(u'<i', data)[0]
+                data += fd.read(length - 4)
+            except EOFError:
+                #gzip stream not terminated
+                break
+            if len(data) < length:
+                #truncated capture (process killed)
+                break
+            yield bson.loads(data)
+
+def get_replayed_direction(header):
+    """
+    Return direction of requests to replay on execenv side according to capture header
+
+    Args:
+        header (dict): capture header record
+
+    Returns:
+        string: RECORD_SENT for devenv capture, RECORD_RECEIVED for execenv capture
+    """
+    return RECORD_SENT if header.get(u'mode') == u'devenv' else RECORD_RECEIVED
+
+
+
+
+
+class RequestRecorder():
+    """
+    Record all requests sent and received by a synchronizer in a capture file.
+    Capture is a stream of bson documents (one per request, with timestamp and direction) preceded by a header
+    document. It is gzip compressed if file path ends with .gz
+    """
+
+    def __init__(self, path, mode):
+        """
+        Constructor
+
+        Args:
+            path (string): capture file path (file is overwritten)
+            mode (string): devenv or execenv
+        """
+        import bson
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.mode = mode
+        self.__dumps = bson.dumps
+        self.__lock = Lock()
+        self.__fd = open_capture(path, u'wb')
+        self.records = 0
+        self.__write({
+            u'd': RECORD_HEADER,
+            u't': time.time(),
+            u'mode': mode,
+            u'version': __version__
+        })
+        self.logger.info(u'Requests are recorded in "%s"' % path)
+
+    def __write(self, record):
+        """
+        Write record
+        """
+        data = self.__dumps(record)
+        with self.__lock:
+            if self.__fd:
+                self.__fd.write(data)
+                self.records += 1
+
+    def record(self, direction, request):
+        """
+        Record request
+
+        Args:
+            direction (string): RECORD_SENT or RECORD_RECEIVED
+            request (dict): request (dict format)
+        """
+        try:
+            self.__write({
+                u'd': direction,
+                u't': time.time(),
+                u'r': request
+            })
+        except Exception:
+            self.logger.exception(u'Unable to record request:')
+
+    def close(self):
+        """
+        Flush and close capture file
+        """
+        with self.__lock:
+            if self.__fd:
+                self.__fd.close()
+                self.__fd = None
+        self.logger.info(u'%d requests recorded in "%s"' % (self.records - 1, self.path))
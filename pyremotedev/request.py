@@ -9,6 +9,8 @@ REQUEST_FILE = 2
 REQUEST_LOG = 3
 REQUEST_PING = 4
 REQUEST_PONG = 5
+REQUEST_FILE_ACK = 6
+REQUEST_PULL = 7
 
 class Request(object):
     """
@@ -123,6 +125,8 @@ class RequestPong(Request):
         Constructor
         """
         self._type = REQUEST_PONG
+        #answerer clock (used to estimate clock offset between environments)
+        self.time = None
 
     def __str__(self):
         """
@@ -137,7 +141,65 @@ class RequestPong(Request):
         Args:
             request (dict): request under dict format
         """
-        return {}
+        self.time = request.get(u'time')
+
+    def to_dict(self):
+        """
+        Convert object to dict for easier json/bson conversion
+
+        Return:
+            dict: class member onto dict
+        """
+        out = {
+            u'_type': self._type
+        }
+        if self.time is not None:
+            out[u'time'] = self.time
+
+        return out
+
+
+
+
+
+class RequestFileAck(Request):
+    """
+    Acknowledge of applied RequestFile, it reports reception and application times of traced request
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._type = REQUEST_FILE_ACK
+        #request trace (id, received, started, applied)
+        self.trace = None
+
+    def __str__(self):
+        """
+        To string method
+        """
+        return u'RequestFileAck(%s)' % self.trace
+
+    def from_dict(self, request):
+        """
+        Fill request with specified dict
+
+        Args:
+            request (dict): request under dict format
+        """
+        self.trace = request.get(u'trace')
+
+    def to_dict(self):
+        """
+        Convert object to dict for easier json/bson conversion
+
+        Return:
+            dict: class member onto dict
+        """
+        return {
+            u'_type': self._type,
+            u'trace': self.trace
+        }
 
 
 
@@ -157,6 +219,9 @@ class RequestFile(Request):
     TYPE_FILE_STR = u'FILE'
     TYPE_DIR = 1
     TYPE_DIR_STR = u'DIR'
+    #directory tree created at once: content is sent in entries (one or more requests per tree)
+    TYPE_ARCHIVE = 2
+    TYPE_ARCHIVE_STR = u'ARCHIVE'
 
     def __init__(self):
         """
@@ -176,6 +241,18 @@ class RequestFile(Request):
         self.content = u''
         #file content md5 needed to avoid circular copy
         self.md5 = None
+        #latency trace: stage timestamps (event, process, read, sent) and request id
+        self.trace = None
+        #archive entries (dict with path, type, content, md5, and append and partial flags for file content split
+        #over requests)
+        self.entries = []
+        #lazy file: only metadata (md5 and size) is sent, content is pulled on demand
+        self.lazy = False
+        self.size = None
+        #big file content sent by transport straight from local file (FileBody, not serialized)
+        self.body = None
+        #big file content received by transport in temp file (moved in place when request is applied)
+        self.body_path = None
 
     def __str__(self):
         """
@@ -194,10 +271,16 @@ class RequestFile(Request):
         type = None
         if self.type == self.TYPE_DIR:
             type = self.TYPE_DIR_STR
+        elif self.type == self.TYPE_ARCHIVE:
+            type = self.TYPE_ARCHIVE_STR
         else:
             type = self.TYPE_FILE_STR
 
-        return u'RequestFile(action:%s, type:%s, src:%s, dest:%s, content:%d bytes md5:%s)' % (action, type, self.src, self.dest, len(self.content), self.md5)
+        if self.type == self.TYPE_ARCHIVE:
+            return u'RequestFile(action:%s, type:%s, src:%s, entries:%d, content:%d bytes)' % (action, type, self.src, len(self.entries), self.get_archive_size())
+        if self.lazy:
+            return u'RequestFile(action:%s, type:%s, src:%s, lazy:%d bytes md5:%s)' % (action, type, self.src, self.size, self.md5)
+        return u'RequestFile(action:%s, type:%s, src:%s, dest:%s, content:%d bytes md5:%s)' % (action, type, self.src, self.dest, self.get_content_size(), self.md5)
 
     def log_str(self):
         """
@@ -219,11 +302,17 @@ class RequestFile(Request):
         type_ = None
         if self.type == self.TYPE_DIR:
             type_ = self.TYPE_DIR_STR
+        elif self.type == self.TYPE_ARCHIVE:
+            type_ = self.TYPE_ARCHIVE_STR
         else:
             type_ = self.TYPE_FILE_STR
 
-        if self.action in (self.ACTION_UPDATE, self.ACTION_CREATE):
-            return u'%s %s %s (%d bytes md5:%s)' % (action, type_, self.src, len(self.content), self.md5)
+        if self.type == self.TYPE_ARCHIVE:
+            return u'%s %s %s (%d entries, %d bytes)' % (action, type_, self.src, len(self.entries), self.get_archive_size())
+        elif self.lazy:
+            return u'%s %s %s (lazy, %d bytes md5:%s)' % (action, type_, self.src, self.size, self.md5)
+        elif self.action in (self.ACTION_UPDATE, self.ACTION_CREATE):
+            return u'%s %s %s (%d bytes md5:%s)' % (action, type_, self.src, self.get_content_size(), self.md5)
         elif self.action == self.ACTION_DELETE:
             return u'%s %s %s' % (action, type_, self.src)
         else:
@@ -249,6 +338,16 @@ class RequestFile(Request):
                 self.content = request[key]
             if key == u'md5':
                 self.md5 = request[key]
+            if key == u'trace':
+                self.trace = request[key]
+            if key == u'entries':
+                self.entries = request[key]
+            if key == u'lazy':
+                self.lazy = request[key]
+            if key == u'size':
+                self.size = request[key]
+            if key == u'_body_path':
+                self.body_path = request[key]
 
     def to_dict(self):
         """
@@ -268,6 +367,143 @@ class RequestFile(Request):
             out[u'dest'] = self.dest
         if len(self.content) > 0:
             out[u'content'] = self.content
+        if self.trace:
+            out[u'trace'] = self.trace
+        if self.entries:
+            out[u'entries'] = self.entries
+        if self.lazy:
+            out[u'lazy'] = True
+            out[u'size'] = self.size
+        elif self.body is not None:
+            out[u'size'] = self.body.size
+
+        return out
+
+    def get_content_size(self):
+        """
+        Return size of file content (in request or sent from file)
+
+        Returns:
+            int: size in bytes
+        """
+        if self.body is not None:
+            return self.body.size
+        if self.body_path is not None:
+            return self.size or 0
+        return len(self.content)
+
+    def get_archive_size(self):
+        """
+        Return size of archive entries content
+
+        Returns:
+            int: size in bytes
+        """
+        return sum([len(entry.get(u'content', b'')) for entry in self.entries])
+
+    def get_entry_requests(self):
+        """
+        Return archive entries as create requests (used to compare them with single requests)
+
+        Returns:
+            list: list of (entry, RequestFile)
+        """
+        out = []
+        for entry in self.entries:
+            request = RequestFile()
+            request.action = self.ACTION_CREATE
+            request.type = entry[u'type']
+            request.src = entry[u'path']
+            request.md5 = entry.get(u'md5')
+            out.append((entry, request))
+
+        return out
+
+
+
+
+
+
+class RequestPull(Request):
+    """
+    Request content of lazy file (devenv to execenv). Execenv answers with content parts, last one has done flag
+    (with content md5 and size, or error)
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._type = REQUEST_PULL
+        #pull id
+        self.id = None
+        #file path (as sent by execenv)
+        self.path = None
+        #content part and its position
+        self.offset = 0
+        self.content = b''
+        #last part: content md5 and size, or error message
+        self.done = False
+        self.md5 = None
+        self.size = None
+        self.error = None
+
+    def __str__(self):
+        """
+        To string method
+        """
+        return u'RequestPull(id:%s, path:%s, offset:%d, content:%d bytes, done:%s, error:%s)' % (self.id, self.path, self.offset, len(self.content), self.done, self.error)
+
+    def log_str(self):
+        """
+        Return log string
+
+        Returns:
+            string
+        """
+        if self.error:
+            return u'Pull %s failed: %s' % (self.path, self.error)
+        elif self.done:
+            return u'Pull %s done (%d bytes md5:%s)' % (self.path, self.size, self.md5)
+        elif len(self.content) > 0:
+            return u'Pull %s (%d bytes at %d)' % (self.path, len(self.content), self.offset)
+        return u'Pull %s' % self.path
+
+    def from_dict(self, request):
+        """
+        Fill request with specified dict
+
+        Args:
+            request (dict): request under dict format
+        """
+        self.id = request.get(u'id')
+        self.path = request.get(u'path')
+        self.offset = request.get(u'offset', 0)
+        self.content = request.get(u'content', b'')
+        self.done = request.get(u'done', False)
+        self.md5 = request.get(u'md5')
+        self.size = request.get(u'size')
+        self.error = request.get(u'error')
+
+    def to_dict(self):
+        """
+        Convert object to dict for easier json/bson conversion
+
+        Return:
+            dict: class member onto dict
+        """
+        out = {
+            u'_type': self._type,
+            u'id': self.id,
+            u'path': self.path
+        }
+        if len(self.content) > 0:
+            out[u'offset'] = self.offset
+            out[u'content'] = self.content
+        if self.done:
+            out[u'done'] = True
+            out[u'md5'] = self.md5
+            out[u'size'] = self.size
+            out[u'error'] = self.error
 
         return out
 
@@ -290,6 +526,10 @@ class RequestLog(Request):
         self.log_record = None
         #contain log message
         self.log_message = None
+        #contain batch of log records (dict), repeat markers (dict) and log messages (string)
+        self.log_batch = None
+        #contain new log templates used by batch records (template id => template)
+        self.log_templates = None
 
     def __str__(self):
         """
@@ -299,6 +539,8 @@ class RequestLog(Request):
             return u'RequestLog(log_record: %s)' % self.log_record['msg']
         elif self.log_message:
             return u'RequestLog(log_message: %s)' % self.log_message
+        elif self.log_batch:
+            return u'RequestLog(log_batch: %d logs)' % len(self.log_batch)
         else:
             return u'RequestLog(empty)'
 
@@ -309,7 +551,7 @@ class RequestLog(Request):
         Returns:
             bool
         """
-        if self.log_record or self.log_message:
+        if self.log_record or self.log_message or self.log_batch:
             return False
 
         return True
@@ -326,6 +568,10 @@ class RequestLog(Request):
                 self.log_record = request[key]
             elif key == u'log_message':
                 self.log_message = request[key]
+            elif key == u'log_batch':
+                self.log_batch = request[key]
+            elif key == u'log_templates':
+                self.log_templates = request[key]
 
     def to_dict(self):
         """
@@ -339,6 +585,10 @@ class RequestLog(Request):
             u'log_record': self.log_record,
             u'log_message': self.log_message
         }
+        if self.log_batch:
+            out[u'log_batch'] = self.log_batch
+        if self.log_templates:
+            out[u'log_templates'] = self.log_templates
 
         return out
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Thread, Event
+from multiprocessing.pool import ThreadPool
+from array import array
+import logging
+import os
+import stat
+import time
+from watchdog.events import FileCreatedEvent, DirCreatedEvent, FileDeletedEvent, DirDeletedEvent, FileModifiedEvent, FileMovedEvent, DirMovedEvent
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def get_array_typecode(typecode, fallback=u'd'):
+    """
+    Return array typecode if supported by interpreter (64 bits typecodes don't exist on python 2), fallback otherwise
+
+    Args:
+        typecode (string): preferred typecode
+        fallback (string): typecode used if preferred one is not supported (double stores integers up to 2^53)
+
+    Returns:
+        string: typecode
+    """
+    try:
+        array(typecode)
+        return typecode
+    except ValueError:
+        return fallback
+
+INT64_TYPECODE = get_array_typecode('q')
+UINT64_TYPECODE = get_array_typecode('Q')
+
+class Snapshot():
+    """
+    Compact filesystem snapshot.
+    Entries are sorted by relative path and stats are stored in arrays instead of per-file objects
+    """
+
+    def __init__(self, entries):
+        """
+        Constructor
+
+        Args:
+            entries (list): list of tuples (relative path, is_dir, mtime, size, inode)
+        """
+        entries.sort(key=lambda entry: entry[0])
+        self.paths = [entry[0] for entry in entries]
+        self.dirs = array('B', [1 if entry[1] else 0 for entry in entries])
+        self.mtimes = array('d', [entry[2] for entry in entries])
+        self.sizes = array(INT64_TYPECODE, [entry[3] for entry in entries])
+        self.inodes = array(UINT64_TYPECODE, [entry[4] for entry in entries])
+
+    def __len__(self):
+        """
+        Return number of entries
+        """
+        return len(self.paths)
+
+
+
+
+
+class SnapshotScanner(Thread):
+    """
+    Polling filesystem observer.
+    It periodically walks watched trees with scandir, diffs successive snapshots and dispatches the same events as
+    watchdog observers. Useful where inotify is not reliable (NFS, overlayfs) or watches are exhausted.
+    It implements the subset of watchdog Observer api used by remotedev (schedule, start, stop, join)
+    """
+
+    def __init__(self, interval=1.0, cpu_budget=0.25, workers=2):
+        """
+        Constructor
+
+        Args:
+            interval (float): minimum time (seconds) between two scans
+            cpu_budget (float): maximum fraction of one cpu spent scanning (0 < cpu_budget <= 1)
+            workers (int): number of threads used to scan a tree (top level directories are scanned in parallel)
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.interval = interval
+        self.cpu_budget = min(max(cpu_budget, 0.01), 1.0)
+        self.workers = max(workers, 1)
+        self.__watches = []
+        self.__stop_event = Event()
+        self.__pool = None
+
+    def schedule(self, event_handler, path, recursive=True):
+        """
+        Schedule tree watching
+
+        Args:
+            event_handler (FileSystemEventHandler): handler to dispatch events to
+            path (string): directory to watch
+            recursive (bool): watch subdirectories
+        """
+        self.__watches.append({
+            u'handler': event_handler,
+            u'path': path,
+            u'recursive': recursive,
+            u'snapshot': None
+        })
+
+    def stop(self):
+        """
+        Stop scanning
+        """
+        self.__stop_event.set()
+
+    def __is_dir_pruned(self, watch, path):
+        """
+        Return True if directory content doesn't need to be scanned (rejected by handler filter)
+        """
+        path_filter = getattr(watch[u'handler'], u'path_filter', None)
+        if path_filter is None:
+            return False
+        return path_filter.is_dir_dropped(path)
+
+    def __list_dir(self, path):
+        """
+        List directory content
+
+        Returns:
+            list: list of tuples (name, is_dir, mtime, size, inode)
+        """
+        entries = []
+        if scandir:
+            for entry in scandir(path):
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    entries.append((entry.name, stat.S_ISDIR(st.st_mode), st.st_mtime, st.st_size, entry.inode()))
+                except OSError:
+                    #entry deleted during scan
+                    pass
+        else:
+            for name in os.listdir(path):
+                try:
+                    st = os.lstat(os.path.join(path, name))
+                    entries.append((name, stat.S_ISDIR(st.st_mode), st.st_mtime, st.st_size, st.st_ino))
+                except OSError:
+                    pass
+
+        return entries
+
+    def __scan_tree(self, args):
+        """
+        Scan tree
+
+        Args:
+            args (tuple): (watch, relative directory path, recursive)
+
+        Returns:
+            list: list of tuples (relative path, is_dir, mtime, size, inode)
+        """
+        (watch, rel_dir, recursive) = args
+        out = []
+        pending = [rel_dir]
+        while len(pending) > 0:
+            current = pending.pop()
+            full_dir = os.path.join(watch[u'path'], current)
+            try:
+                entries = self.__list_dir(full_dir)
+            except OSError:
+                #directory deleted during scan
+                continue
+            for (name, is_dir, mtime, size, inode) in entries:
+                rel_path = os.path.join(current, name) if current else name
+                out.append((rel_path, is_dir, mtime, size, inode))
+                if is_dir and recursive and not self.__is_dir_pruned(watch, os.path.join(full_dir, name)):
+                    pending.append(rel_path)
+
+        return out
+
+    def __take_snapshot(self, watch):
+        """
+        Take snapshot of watched tree. Top level directories are dispatched to workers
+
+        Returns:
+            Snapshot: tree snapshot
+        """
+        entries = self.__scan_tree((watch, u'', False))
+        if not watch[u'recursive']:
+            return Snapshot(entries)
+
+        subdirs = [(watch, entry[0], True) for entry in entries if entry[1] and not self.__is_dir_pruned(watch, os.path.join(watch[u'path'], entry[0]))]
+        if self.__pool and len(subdirs) > 1:
+            results = self.__pool.map(self.__scan_tree, subdirs)
+        else:
+            results = [self.__scan_tree(subdir) for subdir in subdirs]
+        for result in results:
+            entries.extend(result)
+
+        return Snapshot(entries)
+
+    def __diff(self, old, new):
+        """
+        Compare snapshots
+
+        Returns:
+            tuple: (created indexes in new, deleted indexes in old, modified indexes in new)
+        """
+        created = []
+        deleted = []
+        modified = []
+        old_index = 0
+        new_index = 0
+        while old_index < len(old) or new_index < len(new):
+            if new_index >= len(new) or (old_index < len(old) and old.paths[old_index] < new.paths[new_index]):
+                deleted.append(old_index)
+                old_index += 1
+            elif old_index >= len(old) or new.paths[new_index] < old.paths[old_index]:
+                created.append(new_index)
+                new_index += 1
+            else:
+                if old.dirs[old_index] != new.dirs[new_index]:
+                    deleted.append(old_index)
+                    created.append(new_index)
+                elif not new.dirs[new_index] and (old.mtimes[old_index] != new.mtimes[new_index] or old.sizes[old_index] != new.sizes[new_index]):
+                    modified.append(new_index)
+                old_index += 1
+                new_index += 1
+
+        return (created, deleted, modified)
+
+    def __get_events(self, root, old, new):
+        """
+        Build events from snapshots differences
+
+        Returns:
+            list: list of watchdog events
+        """
+        (created, deleted, modified) = self.__diff(old, new)
+
+        #match deleted and created entries with same inode: moves
+        created_inodes = {}
+        for index in created:
+            if new.inodes[index]:
+                created_inodes[(new.inodes[index], new.dirs[index])] = index
+        moves = []
+        for index in deleted:
+            new_index = created_inodes.pop((old.inodes[index], old.dirs[index]), None)
+            if new_index is not None:
+                moves.append((index, new_index))
+        moved_old = set([move[0] for move in moves])
+        moved_new = set([move[1] for move in moves])
+
+        #directory moves imply their content moves
+        events = []
+        dir_moves = []
+        for (old_index, new_index) in sorted(moves, key=lambda move: len(old.paths[move[0]])):
+            src = old.paths[old_index]
+            dest = new.paths[new_index]
+            implied = False
+            for (dir_src, dir_dest) in dir_moves:
+                if src.startswith(dir_src) and dest.startswith(dir_dest) and src[len(dir_src):] == dest[len(dir_dest):]:
+                    implied = True
+                    break
+            if old.dirs[old_index]:
+                dir_moves.append((os.path.join(src, u''), os.path.join(dest, u'')))
+            if implied:
+                if not new.dirs[new_index] and (old.mtimes[old_index] != new.mtimes[new_index] or old.sizes[old_index] != new.sizes[new_index]):
+                    modified.append(new_index)
+                continue
+            if old.dirs[old_index]:
+                events.append(DirMovedEvent(os.path.join(root, src), os.path.join(root, dest)))
+            else:
+                events.append(FileMovedEvent(os.path.join(root, src), os.path.join(root, dest)))
+                if old.mtimes[old_index] != new.mtimes[new_index] or old.sizes[old_index] != new.sizes[new_index]:
+                    modified.append(new_index)
+
+        #deletions, children first
+        for index in reversed(deleted):
+            if index in moved_old:
+                continue
+            if old.dirs[index]:
+                events.append(DirDeletedEvent(os.path.join(root, old.paths[index])))
+            else:
+                events.append(FileDeletedEvent(os.path.join(root, old.paths[index])))
+
+        #creations, parents first
+        for index in created:
+            if index in moved_new:
+                continue
+            if new.dirs[index]:
+                events.append(DirCreatedEvent(os.path.join(root, new.paths[index])))
+            else:
+                events.append(FileCreatedEvent(os.path.join(root, new.paths[index])))
+
+        for index in modified:
+            events.append(FileModifiedEvent(os.path.join(root, new.paths[index])))
+
+        return events
+
+    def __scan(self, watch):
+        """
+        Scan watched tree and dispatch events
+        """
+        snapshot = self.__take_snapshot(watch)
+        if watch[u'snapshot'] is not None:
+            for event in self.__get_events(watch[u'path'], watch[u'snapshot'], snapshot):
+                try:
+                    watch[u'handler'].dispatch(event)
+                except Exception:
+                    self.logger.exception(u'Exception dispatching event %s:' % event)
+        watch[u'snapshot'] = snapshot
+
+    def run(self):
+        """
+        Main process: scan periodically respecting cpu budget
+        """
+        if self.workers > 1:
+            self.__pool = ThreadPool(self.workers)
+
+        try:
+            while not self.__stop_event.is_set():
+                start = time.time()
+                for watch in self.__watches:
+                    try:
+                        self.__scan(watch)
+                    except Exception:
+                        self.logger.exception(u'Exception scanning "%s":' % watch[u'path'])
+                duration = time.time() - start
+                self.logger.debug(u'Scan took %.3f seconds' % duration)
+
+                #wait before next scan: at least interval, more if scan is too long for cpu budget
+                self.__stop_event.wait(max(self.interval, duration / self.cpu_budget - duration))
+
+        finally:
+            if self.__pool:
+                self.__pool.close()
+                self.__pool.join()
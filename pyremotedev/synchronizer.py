@@ -1,28 +1,492 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from threading import Thread
-from collections import deque
+from threading import Thread, Lock, Condition
+from collections import OrderedDict, deque
+import copy
+import io
+import itertools
 import logging
-from sshtunnel import SSHTunnelForwarder
+import os
+import re
 import socket
-from .consts import TEST_REQUEST
+from .consts import TEST_REQUEST, DEFAULT_EXEC_PORT, TRAFFIC_CONTROL, TRAFFIC_FILE, TRAFFIC_LOG, DEFAULT_FANOUT_QUEUE_SIZE
 import time
-import bson
-bson.patch_socket()
-from .request import REQUEST_FILE, REQUEST_GOODBYE, REQUEST_LOG, REQUEST_PING, REQUEST_UNKNOW, REQUEST_PONG, RequestFile, RequestGoodbye, RequestLog, RequestPing, RequestPong
-from .file import RequestFileExecutor
+from .request import REQUEST_FILE, REQUEST_GOODBYE, REQUEST_LOG, REQUEST_PING, REQUEST_UNKNOW, REQUEST_PONG, REQUEST_FILE_ACK, REQUEST_PULL
+from .request import RequestFile, RequestGoodbye, RequestLog, RequestPing, RequestPong, RequestFileAck, RequestPull
+from .file import RequestFileExecutor, PulledFile, FilePullSender
 from .logs import RequestLogExecutor, RequestLogCreator
+from .metrics import REGISTRY
+from .ratelimit import TrafficShaper
+from .recorder import RECORD_SENT, RECORD_RECEIVED
 
 try:
     _unicode = unicode
 except NameError:
     _unicode = str
 
+
+BYTES_SENT = REGISTRY.counter(u'remotedev_bytes_sent_total', u'Bytes sent to remote')
+BYTES_RECEIVED = REGISTRY.counter(u'remotedev_bytes_received_total', u'Bytes received from remote')
+FILE_REQUESTS_SENT = REGISTRY.counter(u'remotedev_file_requests_sent_total', u'File requests sent to remote')
+FILE_REQUESTS_RECEIVED = REGISTRY.counter(u'remotedev_file_requests_received_total', u'File requests received from remote')
+FILE_REQUESTS_LOOP_DROPPED = REGISTRY.counter(u'remotedev_file_requests_loop_dropped_total', u'File requests dropped because just received from remote')
+SEND_ERRORS = REGISTRY.counter(u'remotedev_send_errors_total', u'Requests not sent because of socket error')
+CONNECTIONS = REGISTRY.counter(u'remotedev_connections_total', u'Connections established with remote (first connection and reconnections)')
+#save to applied latency, by stage
+SYNC_STAGES = OrderedDict([(stage, REGISTRY.histogram(u'remotedev_sync_%s_seconds' % stage, description)) for (stage, description) in [
+    (u'filter', u'Time from filesystem event to request processing (coalescing and filtering)'),
+    (u'read', u'Time to read and hash file content'),
+    (u'wire', u'Time from request sending to its reception by remote'),
+    (u'queue', u'Time request waited in remote executor queue'),
+    (u'apply', u'Time to apply request on remote filesystem'),
+    (u'total', u'Time from filesystem event to request applied on remote')
+]])
+#traffic class of requests (other requests are control traffic)
+TRAFFIC_CLASSES = {
+    REQUEST_FILE: TRAFFIC_FILE,
+    REQUEST_PULL: TRAFFIC_FILE,
+    REQUEST_LOG: TRAFFIC_LOG
+}
+
+
+#status byte sent after file body
+BODY_VALID = b'\x01'
+BODY_INVALID = b'\x00'
+#maximum time without data once frame reception is started
+RECEIVE_STALL_TIMEOUT = 30.0
+#ids of bodies sent in several parts
+BODY_STREAM_IDS = itertools.count(1)
+
+
+class BufferPool():
+    """
+    Pool of reusable receive buffers: frames are received with recv_into in pooled buffers instead of allocating
+    buffers for each of them. Buffers bigger than MAX_POOLED_SIZE (archives) are not kept
+    """
+
+    MIN_SIZE = 65536
+    MAX_POOLED_SIZE = 1048576
+    MAX_BUFFERS = 4
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__buffers = []
+        self.__lock = Lock()
+
+    def acquire(self, size):
+        """
+        Return buffer of at least specified size
+
+        Args:
+            size (int): minimum buffer size
+
+        Returns:
+            bytearray: buffer
+        """
+        with self.__lock:
+            for (index, buffer) in enumerate(self.__buffers):
+                if len(buffer) >= size:
+                    return self.__buffers.pop(index)
+
+        capacity = self.MIN_SIZE
+        while capacity < size:
+            capacity *= 2
+        return bytearray(capacity)
+
+    def release(self, buffer):
+        """
+        Give buffer back to pool
+        """
+        if len(buffer) > self.MAX_POOLED_SIZE:
+            return
+        with self.__lock:
+            if len(self.__buffers) < self.MAX_BUFFERS:
+                self.__buffers.append(buffer)
+                self.__buffers.sort(key=len)
+
+RECEIVE_BUFFERS = BufferPool()
+
+
+class BodyStreams():
+    """
+    Bodies of big files received in several parts on a connection. Sender lets other messages go between parts, so
+    partially received bodies are kept between recvobj calls until their last part
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        #stream id => (document, temp file or None, content parts received in memory)
+        self.__streams = {}
+        self.__lock = Lock()
+
+    def add(self, stream_id, document, fd, parts):
+        """
+        Keep partially received body
+
+        Args:
+            stream_id (int): body stream id
+            document (dict): received document
+            fd (file): temp file receiving body, None if body is received in memory
+            parts (list): body parts received in memory
+        """
+        with self.__lock:
+            self.__streams[stream_id] = (document, fd, parts)
+
+    def pop(self, stream_id):
+        """
+        Return partially received body
+
+        Returns:
+            tuple: (document, fd, parts) or None if stream is unknown
+        """
+        with self.__lock:
+            return self.__streams.pop(stream_id, None)
+
+    def clear(self):
+        """
+        Drop partially received bodies (connection lost)
+        """
+        with self.__lock:
+            streams = list(self.__streams.values())
+            self.__streams.clear()
+        for (_, fd, _) in streams:
+            if fd is not None:
+                fd.close()
+                os.remove(fd.name)
+
+
+def get_recorded_request(data):
+    """
+    Return received request dict to record: content of big file received in temp file is read back so captures
+    keep it
+
+    Args:
+        data (dict): received request
+
+    Returns:
+        dict: request to record
+    """
+    if u'_body_path' not in data:
+        return data
+    out = dict(data)
+    with io.open(out.pop(u'_body_path'), u'rb') as fd:
+        out[u'content'] = fd.read()
+
+    return out
+
+
+class Frame():
+    """
+    Message sent on transport: bson document, followed for big files by raw file content (body, its size is in
+    document _body field) and a status byte telling if body is valid (file unchanged while it was sent).
+    Shaped bodies are sent in parts of BODY_PART_SIZE bytes (one frame per part, with same _stream id), so other
+    messages are not delayed by a whole big file
+    """
+
+    BODY_PART_SIZE = 262144
+
+    def __init__(self, sock, data, body=None, body_offset=0, body_size=None):
+        """
+        Constructor
+
+        Args:
+            sock (socket): connected socket
+            data (bytes): bson document
+            body (FileBody): opened file body
+            body_offset (int): offset of body part sent in frame
+            body_size (int): size of body part sent in frame (whole body if None)
+        """
+        self.sock = sock
+        self.body = body
+        self.body_offset = body_offset
+        self.valid = True
+        if body is not None and body_size is None:
+            body_size = body.size
+        self.__view = memoryview(data)
+        self.__header_size = len(data)
+        self.__body_end = self.__header_size + (body_size or 0)
+        self.size = self.__body_end + (1 if body else 0)
+
+    def send(self, offset, length):
+        """
+        Send frame range
+
+        Args:
+            offset (int): range offset
+            length (int): range length
+        """
+        end = offset + length
+        if offset < self.__header_size:
+            count = min(end, self.__header_size) - offset
+            self.sock.sendall(self.__view[offset:offset + count])
+            offset += count
+        if offset < end and offset < self.__body_end:
+            count = min(end, self.__body_end) - offset
+            self.body.send(self.sock, self.body_offset + offset - self.__header_size, count)
+            offset += count
+        if offset < end:
+            self.valid = self.body.is_valid()
+            self.sock.sendall(BODY_VALID if self.valid else BODY_INVALID)
+
+
+def patch_socket():
+    """
+    Add bson sendobj/recvobj methods to sockets. Bson is imported here to keep module import light.
+    Methods count transferred bytes. They are always installed: bson.patch_socket (called by embedding application
+    or another library) installs methods with same names but without remotedev framing
+    """
+    import bson
+    from bson.network import _bintoint
+
+    def sendframe(self, frame, shaper, traffic_class):
+        if shaper:
+            shaper.send(traffic_class, frame.size, frame.send)
+        else:
+            frame.send(0, frame.size)
+        BYTES_SENT.inc(frame.size)
+
+    def sendobj(self, obj, shaper=None, traffic_class=TRAFFIC_CONTROL, body=None):
+        if body is None:
+            sendframe(self, Frame(self, bson.dumps(obj)), shaper, traffic_class)
+            return
+
+        #shaped body is sent in parts, other messages can be sent between them
+        part_size = Frame.BODY_PART_SIZE if shaper else max(body.size, 1)
+        header = dict(obj)
+        if body.size > part_size:
+            header[u'_stream'] = next(BODY_STREAM_IDS)
+        offset = 0
+        while True:
+            length = min(part_size, body.size - offset)
+            header[u'_body'] = length
+            if u'_stream' in header:
+                header[u'_more'] = offset + length < body.size
+            frame = Frame(self, bson.dumps(header), body, offset, length)
+            sendframe(self, frame, shaper, traffic_class)
+            offset += length
+            if not frame.valid or offset >= body.size:
+                #invalid part ends body
+                return
+            header = {u'_stream': header[u'_stream']}
+
+    def recvinto(self, view, started=True):
+        """
+        Fill view with received bytes. Once frame reception is started, timeouts are retried until
+        RECEIVE_STALL_TIMEOUT without data
+
+        Returns:
+            bool: False if socket was closed by remote
+        """
+        received = 0
+        last = time.time()
+        while received < len(view):
+            try:
+                count = self.recv_into(view[received:])
+            except socket.timeout:
+                if (not started and received == 0) or time.time() - last > RECEIVE_STALL_TIMEOUT:
+                    raise
+                continue
+            if count == 0:
+                return False
+            received += count
+            last = time.time()
+
+        return True
+
+    def recvbody(self, buffer, size, fd):
+        """
+        Receive file body using buffer, written in fd as it arrives (kept in memory if fd is None)
+
+        Returns:
+            tuple: (content or None if written in fd, valid flag) or None if socket was closed by remote
+        """
+        content = None
+        if fd is None:
+            content = bytearray(size)
+            if not self.recvinto(memoryview(content)):
+                return None
+        else:
+            view = memoryview(buffer)
+            remaining = size
+            while remaining > 0:
+                count = min(remaining, len(buffer))
+                if not self.recvinto(view[:count]):
+                    return None
+                fd.write(view[:count])
+                remaining -= count
+        status = bytearray(1)
+        if not self.recvinto(memoryview(status)):
+            return None
+
+        return (bytes(content) if content is not None else None, bytes(status) == BODY_VALID)
+
+    def recvframe(self, open_body, streams):
+        """
+        Receive frame. Body of big file is completed in streams until its last part
+
+        Returns:
+            tuple: (document or None if frame is a body part, True if socket is still connected)
+        """
+        prefix = bytearray(4)
+        if not self.recvinto(memoryview(prefix), False):
+            return (None, False)
+        message_length = _bintoint(bytes(prefix))
+        buffer = RECEIVE_BUFFERS.acquire(message_length)
+        fd = None
+        try:
+            view = memoryview(buffer)
+            view[:4] = prefix
+            if not self.recvinto(view[4:message_length]):
+                return (None, False)
+            #bytes(memoryview) is not memoryview content on python 2
+            obj = bson.loads(view[:message_length].tobytes())
+            body_size = obj.pop(u'_body', None)
+            if body_size is None:
+                BYTES_RECEIVED.inc(message_length)
+                return (obj, True)
+
+            stream_id = obj.pop(u'_stream', None)
+            more = obj.pop(u'_more', False)
+            parts = []
+            if u'_type' in obj:
+                fd = open_body(obj) if open_body else None
+            else:
+                #next part of body (unknown if its first part was dropped)
+                (obj, fd, parts) = streams.pop(stream_id) or (None, None, [])
+            body = self.recvbody(buffer, body_size, fd)
+            if body is None:
+                return (None, False)
+            BYTES_RECEIVED.inc(message_length + body_size + 1)
+            (content, valid) = body
+            if obj is None:
+                return (None, True)
+            if content is not None:
+                parts.append(content)
+            if valid and more:
+                streams.add(stream_id, obj, fd, parts)
+                fd = None
+                return (None, True)
+
+            if not valid:
+                obj[u'_body_invalid'] = True
+            elif fd is None:
+                obj[u'content'] = b''.join(parts)
+            else:
+                fd.close()
+                obj[u'_body_path'] = fd.name
+                fd = None
+            return (obj, True)
+
+        finally:
+            RECEIVE_BUFFERS.release(buffer)
+            if fd is not None:
+                #incomplete or invalid body
+                fd.close()
+                os.remove(fd.name)
+
+    def recvobj(self, open_body=None, streams=None):
+        """
+        Receive bson document. Big file body following it is written in file returned by open_body (called with
+        document, its path is set in _body_path field) or set in content field. Body received in several parts is
+        kept in streams (BodyStreams of connection) between calls, document is returned with its last part. Without
+        streams, body whose parts are interleaved with other documents is dropped
+        """
+        local_streams = streams is None
+        if local_streams:
+            streams = BodyStreams()
+        try:
+            while True:
+                (obj, connected) = recvframe(self, open_body, streams)
+                if obj is not None or not connected:
+                    return obj
+
+        finally:
+            if local_streams:
+                streams.clear()
+
+    socket.socket.recvinto = recvinto
+    socket.socket.recvbody = recvbody
+    socket.socket.recvobj = recvobj
+    socket.socket.sendobj = sendobj
+
+
+
+
+
+class RequestHistory():
+    """
+    History of file requests received from remote, used to avoid sending them back (infinite loop).
+    Requests are indexed by path and forgotten after some time or when history is full (bursts of thousands of
+    requests such as vcs checkout are fully remembered)
+    """
+
+    MAX_PATHS = 8192
+    MAX_REQUESTS_PER_PATH = 4
+    TTL = 10.0
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        #path => list of (received time, request), ordered by last reception
+        self.__requests = OrderedDict()
+        self.__lock = Lock()
+
+    def append(self, request):
+        """
+        Add received request
+
+        Args:
+            request (RequestFile): received request
+        """
+        if request.type == RequestFile.TYPE_ARCHIVE:
+            #archive content is remembered entry by entry (it can be sent back as single requests)
+            requests = [entry_request for (_, entry_request) in request.get_entry_requests()]
+        else:
+            requests = [request]
+
+        now = time.time()
+        with self.__lock:
+            for path_request in requests:
+                path_requests = self.__requests.pop(path_request.src, [])
+                path_requests.append((now, path_request))
+                self.__requests[path_request.src] = path_requests[-self.MAX_REQUESTS_PER_PATH:]
+            while len(self.__requests) > self.MAX_PATHS:
+                self.__requests.popitem(last=False)
+
+    def get(self, path):
+        """
+        Return recently received requests on specified path
+
+        Args:
+            path (string): request src path
+
+        Returns:
+            list: list of RequestFile
+        """
+        limit = time.time() - self.TTL
+        with self.__lock:
+            return [request for (received, request) in self.__requests.get(path, []) if received >= limit]
+
+
+
+
+
 class SynchronizerExecEnv(Thread):
-    def __init__(self, ip, port, clientsocket, mappings, log_file_path, debug):
+    def __init__(self, ip, port, clientsocket, mappings, log_file_path, debug, log_options={}, recorder=None, bandwidth_limits={}, precompile=None):
         """
         Constructor
+
+        Args:
+            log_options (dict): RequestLogCreator options (queue_size, overflow_policy, levels, rate_limits, debug_sampling)
+            recorder (RequestRecorder): record sent and received requests if specified
+            bandwidth_limits (dict): maximum bytes per second sent to devenv by traffic class (see TrafficShaper)
+            precompile (bool|string): compile applied python sources to bytecode (see RequestFileExecutor)
         """
         Thread.__init__(self)
         Thread.daemon = True
@@ -39,9 +503,15 @@ class SynchronizerExecEnv(Thread):
         self.__send_socket_attemps = 0
         self.mappings = mappings
         self.log_file_path = log_file_path
+        self.log_options = log_options
+        self.recorder = recorder
+        self.precompile = precompile
         self.request_file_executor = None
         self.request_log_creator = None
-        self.__history = deque(maxlen=4)
+        self.__history = RequestHistory()
+        self.__body_streams = BodyStreams()
+        self.__send_lock = Lock()
+        self.__shaper = TrafficShaper(bandwidth_limits) if bandwidth_limits else None
 
     def __del__(self):
         """
@@ -56,6 +526,7 @@ class SynchronizerExecEnv(Thread):
         if self.socket:
             self.socket.close()
         self.__socket_connected = False
+        self.__body_streams.clear()
 
     def disconnect(self):
         """
@@ -70,13 +541,12 @@ class SynchronizerExecEnv(Thread):
         Returns:
             bool: True if already sent
         """
-        for history in list(self.__history):
-            if request.action == RequestFile.ACTION_CREATE and request.type == RequestFile.TYPE_FILE and request.action == history.action and request.src == history.src and request.md5 == history.md5:
+        for history in self.__history.get(request.src):
+            if request.action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE) and request.type == RequestFile.TYPE_FILE and history.action in (RequestFile.ACTION_CREATE, RequestFile.ACTION_UPDATE) and request.src == history.src and request.md5 == history.md5:
+                #same content received (update of a file created here because its creation was dropped)
                 return True
             elif request.action == RequestFile.ACTION_CREATE and request.type == RequestFile.TYPE_DIR and request.action == history.action and request.src == history.src:
                 return True
-            elif request.action == RequestFile.ACTION_UPDATE and request.type == RequestFile.TYPE_FILE and request.action == history.action and request.src == history.src and request.md5 == history.md5:
-                return True
             elif request.action == RequestFile.ACTION_DELETE and request.type == RequestFile.TYPE_DIR and request.action == history.action and request.src == history.src:
                 return True
             elif request.action == RequestFile.ACTION_MOVE and request.action == history.action and request.src == history.src and request.dest == history.dest:
@@ -94,12 +564,52 @@ class SynchronizerExecEnv(Thread):
         self.logger.debug(u'Request received, send it to remote: %s' % request)
 
         #avoid infinite loop with RequestFile requests
-        if self.__request_file_already_sent(request):
+        if request.type == RequestFile.TYPE_ARCHIVE:
+            request.entries = [entry for (entry, entry_request) in request.get_entry_requests() if not self.__request_file_already_sent(entry_request)]
+            if len(request.entries) == 0:
+                self.logger.debug(u' ==> Archive dropped to avoid infinite loop: %s' % request)
+                FILE_REQUESTS_LOOP_DROPPED.inc()
+                return
+        elif self.__request_file_already_sent(request):
             self.logger.debug(u' ==> Request dropped to avoid infinite loop: %s' % request)
+            FILE_REQUESTS_LOOP_DROPPED.inc()
             return
 
         self.__send_request_to_remote(request)
 
+    def __open_body(self, req):
+        """
+        Open temp file receiving big file content of received request
+
+        Args:
+            req (dict): received request
+
+        Returns:
+            file: opened temp file or None to receive content in memory
+        """
+        if req.get(u'_type') != REQUEST_FILE or self.request_file_executor is None:
+            return None
+        try:
+            return self.request_file_executor.open_body(req.get(u'src'))
+        except Exception:
+            self.logger.exception(u'Unable to open temp file for "%s", content received in memory:' % req.get(u'src'))
+            return None
+
+    def __send_data(self, data, traffic_class, body=None):
+        """
+        Send bsonified request (sent from several threads), shaped if bandwidth is limited
+
+        Args:
+            data (dict): request (dict format)
+            traffic_class (string): request traffic class
+            body (FileBody): opened file body sent after request
+        """
+        if self.__shaper:
+            self.socket.sendobj(data, self.__shaper, traffic_class, body)
+        else:
+            with self.__send_lock:
+                self.socket.sendobj(data, body=body)
+
     def __send_request_to_remote(self, request):
         """
         Send request to remote
@@ -111,11 +621,25 @@ class SynchronizerExecEnv(Thread):
             bool: False if remote is not connected
         """
         try:
-            #send bsonified request
-            self.socket.sendobj(request.to_dict())
+            #send bsonified request, big file content is sent from file
+            data = request.to_dict()
+            body = getattr(request, u'body', None)
+            if body is not None and not body.open():
+                self.logger.debug(u'File changed before sending, request dropped (new request follows): %s' % request)
+                return True
+            try:
+                self.__send_data(data, TRAFFIC_CLASSES.get(request.get_type(), TRAFFIC_CONTROL), body)
+            finally:
+                if body is not None:
+                    body.close()
+            if self.recorder:
+                self.recorder.record(RECORD_SENT, dict(data, content=body.read()) if body is not None else data)
             self.__send_socket_attemps = 0
+            if request.get_type() == REQUEST_FILE:
+                FILE_REQUESTS_SENT.inc()
 
-            self.logger.info(request.log_str())
+            if request.get_type() not in (REQUEST_FILE_ACK, REQUEST_PULL):
+                self.logger.info(request.log_str())
 
             return True
 
@@ -123,6 +647,7 @@ class SynchronizerExecEnv(Thread):
             logging.exception(u'Send request exception:')
 
             #sending problem watchdog
+            SEND_ERRORS.inc()
             self.__send_socket_attemps += 1
             if self.__send_socket_attemps > 10:
                 self.logger.critical('Too many sending attempts. Surely a unhandled bug, Please relaunch application with debug enabled and add new issue in repository joining debug output. Thank you very much.')
@@ -133,6 +658,38 @@ class SynchronizerExecEnv(Thread):
 
         return False
 
+    def __send_pulled_file(self, request):
+        """
+        Send content of pulled lazy file in background
+
+        Args:
+            request (RequestPull): pull request
+        """
+        mapping = self.request_file_executor.file_path_converter.transform_received_path(request.path)
+        if mapping is None or not os.path.isfile(mapping[u'path']):
+            answer = RequestPull()
+            answer.id = request.id
+            answer.path = request.path
+            answer.done = True
+            answer.error = u'File not found on execenv'
+            self.__send_request_to_remote(answer)
+            return
+
+        self.logger.info(u'Send pulled file "%s"' % mapping[u'path'])
+        sender = FilePullSender(request, mapping[u'path'], self.__send_request_to_remote)
+        sender.start()
+
+    def __send_file_ack(self, trace):
+        """
+        Send acknowledge of applied traced request
+
+        Args:
+            trace (dict): request trace (id, received, started, applied)
+        """
+        ack = RequestFileAck()
+        ack.trace = trace
+        self.__send_request_to_remote(ack)
+
     def stop(self):
         """
         Stop synchronizer
@@ -151,14 +708,15 @@ class SynchronizerExecEnv(Thread):
         Then it send it to request executor instance
         """
         self.logger.debug(u'SynchronizerExecEnv started for %s:%s' % (self.ip, self.port))
+        patch_socket()
         self.__socket_connected = True
 
         #create RequestFileExecutor
-        self.request_file_executor = RequestFileExecutor(self.mappings)
+        self.request_file_executor = RequestFileExecutor(self.mappings, ack_callback=self.__send_file_ack, precompile=self.precompile)
         self.request_file_executor.start()
 
         #create RequestLogCreator
-        self.request_log_creator = RequestLogCreator(self.__send_request_to_remote, self.log_file_path)
+        self.request_log_creator = RequestLogCreator(self.__send_request_to_remote, self.log_file_path, **self.log_options)
         self.request_log_creator.start()
 
         receive_attempts = 0
@@ -166,9 +724,11 @@ class SynchronizerExecEnv(Thread):
             #receive data
             try:
                 #receive de bsonified request
-                req = self.socket.recvobj()
+                req = self.socket.recvobj(self.__open_body, self.__body_streams)
                 if req:
                     self.logger.debug('Received request %s' % req)
+                    if self.recorder:
+                        self.recorder.record(RECORD_RECEIVED, get_recorded_request(req))
 
                     #process request type
                     if req[u'_type'] == REQUEST_UNKNOW:
@@ -179,23 +739,40 @@ class SynchronizerExecEnv(Thread):
                         #received ping request, answer pong
                         self.logger.debug(u'Receive ping request, answer pong')
                         request = RequestPong()
-                        self.socket.sendobj(request.to_dict())
+                        request.time = time.time()
+                        data = request.to_dict()
+                        self.__send_data(data, TRAFFIC_CONTROL)
+                        if self.recorder:
+                            self.recorder.record(RECORD_SENT, data)
 
                     elif req[u'_type'] == REQUEST_LOG:
                         #received log request
                         self.logger.debug(u'Not supposed receiving RequestLog :s. Request droped')
             
+                    elif req[u'_type'] == REQUEST_FILE and req.get(u'_body_invalid'):
+                        #file changed while it was sent, a new request follows
+                        self.logger.debug(u'File request with invalid content dropped: %s' % req.get(u'src'))
+
                     elif req[u'_type'] == REQUEST_FILE:
                         #received file request
                         request = RequestFile()
                         request.from_dict(req)
+                        if request.trace:
+                            request.trace[u'received'] = time.time()
 
                         #append to history
                         self.__history.append(request)
+                        FILE_REQUESTS_RECEIVED.inc()
 
                         self.logger.debug('Process RequestFile action')
                         self.request_file_executor.add_request(request)
 
+                    elif req[u'_type'] == REQUEST_PULL:
+                        #lazy file content requested
+                        request = RequestPull()
+                        request.from_dict(req)
+                        self.__send_pulled_file(request)
+
                     elif req[u'_type'] == REQUEST_GOODBYE:
                         #client disconnect, force server disconnection to allow new connection
                         #here no need to create new RequestGoodbye object
@@ -234,7 +811,10 @@ class SynchronizerDevEnv(Thread):
     It handles connection and reconnection with remote.
     A buffer keeps track of changes when remote is disconnected.
     """
-    def __init__(self, remote_host, remote_port, ssh_username, ssh_password, source_code_dir, debug, forward_port=52666):
+
+    MAX_PENDING_TRACES = 1024
+
+    def __init__(self, remote_host, remote_port, ssh_username, ssh_password, source_code_dir, debug, forward_port=DEFAULT_EXEC_PORT, log_options={}, use_tunnel=True, recorder=None, bandwidth_limits={}, name=None):
         """
         Constructor
 
@@ -246,6 +826,11 @@ class SynchronizerDevEnv(Thread):
             source_code_dir (string): source code directory
             debug (bool): debug instance or not
             forward_port (int): forwarded port (default is 52666)
+            log_options (dict): RequestLogExecutor options (max_bytes, backup_count, json_output, store, store_max_bytes, queue_size)
+            use_tunnel (bool): connect through ssh tunnel (default). If False socket is directly connected to remote_host:forward_port
+            recorder (RequestRecorder): record sent and received requests if specified
+            bandwidth_limits (dict): maximum bytes per second sent to execenv by traffic class (see TrafficShaper)
+            name (string): remote name used in remote log files names (default is remote_host)
         """
         Thread.__init__(self)
         Thread.daemon = True
@@ -258,16 +843,32 @@ class SynchronizerDevEnv(Thread):
         self.__tunnel_opened = False
         self.__socket_connected = False
         self.remote_host = remote_host
+        self.name = name or remote_host
         self.remote_port = remote_port
         self.ssh_username = ssh_username
         self.ssh_password = ssh_password
         self.forward_port = forward_port
+        self.use_tunnel = use_tunnel
+        self.recorder = recorder
         self.tunnel = None
         self.socket = None
         self.__send_socket_attemps = 0
         self.source_code_dir = source_code_dir
         self.debug = debug
-        self.__history = deque(maxlen=4)
+        self.log_options = log_options
+        self.__history = RequestHistory()
+        self.__body_streams = BodyStreams()
+        #clock offset with remote (remote clock - local clock) and traces of sent requests waiting for acknowledge
+        self.__clock_offset = 0.0
+        self.__traces = OrderedDict()
+        self.__traces_lock = Lock()
+        self.__trace_id = 0
+        #lazy files being pulled: pull id => PulledFile
+        self.__pulls = {}
+        self.__pulls_lock = Lock()
+        self.__pull_id = 0
+        self.__send_lock = Lock()
+        self.__shaper = TrafficShaper(bandwidth_limits) if bandwidth_limits else None
 
     def __del__(self):
         """
@@ -282,7 +883,15 @@ class SynchronizerDevEnv(Thread):
         Return:
             bool: True if tunnel opened successfully
         """
+        if not self.use_tunnel:
+            #direct connection, nothing to open
+            self.__tunnel_opened = True
+            return True
+
         try:
+            #sshtunnel (paramiko) is long to import, only devenv needs it
+            from sshtunnel import SSHTunnelForwarder
+
             self.logger.debug('opening tunnel on %s:%s with username=%s pwd=%s forward_port=%d' % (self.remote_host, self.remote_port, self.ssh_username, self.ssh_password, self.forward_port))
             self.tunnel = SSHTunnelForwarder(
                 (self.remote_host, self.remote_port),
@@ -309,19 +918,40 @@ class SynchronizerDevEnv(Thread):
             bool: True if socket connected successfully
         """
         try:
-            if self.tunnel and self.tunnel.is_active:
+            if not self.use_tunnel:
+                address = (self.remote_host, self.forward_port)
+            elif self.tunnel and self.tunnel.is_active:
+                address = (u'127.0.0.1', self.tunnel.local_bind_port)
+            else:
+                address = None
+
+            if address:
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.settimeout(0.5)
-                self.socket.connect((u'127.0.0.1', self.tunnel.local_bind_port))
+                self.socket.connect(address)
 
                 #test if remote service is really running
                 self.logger.debug(u'Testing connection sending PING...')
                 ping = RequestPing()
+                sent = time.time()
                 self.socket.sendobj(ping.to_dict())
                 req = self.socket.recvobj()
+                received = time.time()
+                if self.recorder:
+                    self.recorder.record(RECORD_SENT, ping.to_dict())
+                    if req:
+                        self.recorder.record(RECORD_RECEIVED, req)
                 if req and req[u'_type'] == REQUEST_PONG:
                     self.logger.debug(u'Received PONG, connection is ok')
                     self.__socket_connected = True
+                    CONNECTIONS.inc()
+
+                    #estimate clock offset with remote (remote answered at half round trip)
+                    pong = RequestPong()
+                    pong.from_dict(req)
+                    if pong.time is not None:
+                        self.__clock_offset = pong.time - (sent + received) / 2.0
+                        self.logger.debug(u'Clock offset with remote: %.3f seconds' % self.__clock_offset)
 
             else:
                 #disconnected tunnel ?
@@ -377,6 +1007,7 @@ class SynchronizerDevEnv(Thread):
         if self.socket:
             self.socket.close()
         self.__socket_connected = False
+        self.__body_streams.clear()
 
     def disconnect(self):
         """
@@ -401,7 +1032,7 @@ class SynchronizerDevEnv(Thread):
         Returns:
             bool: True if already sent
         """
-        for history in list(self.__history):
+        for history in self.__history.get(request.src):
             if request.action == history.action and request.src == history.src and request.md5 == history.md5:
                 return True
 
@@ -413,15 +1044,172 @@ class SynchronizerDevEnv(Thread):
 
         Args:
             request (Request): request instance
+
+        Returns:
+            bool: False if request was not sent because remote is not connected
         """
         self.logger.debug(u'Request added %s' % request)
 
         #avoid infinite loop with RequestFile requests
-        if self.__request_file_already_sent(request):
+        if request.type == RequestFile.TYPE_ARCHIVE:
+            request.entries = [entry for (entry, entry_request) in request.get_entry_requests() if not self.__request_file_already_sent(entry_request)]
+            if len(request.entries) == 0:
+                self.logger.debug(u' ==> Archive dropped to avoid infinite loop: %s' % request)
+                FILE_REQUESTS_LOOP_DROPPED.inc()
+                return True
+        elif self.__request_file_already_sent(request):
             self.logger.debug(u' ==> Request dropped to avoid infinite loop: %s' % request)
+            FILE_REQUESTS_LOOP_DROPPED.inc()
+            return True
+
+        return self.__send_request_to_remote(request)
+
+    def __trace_request(self, request):
+        """
+        Keep request trace until remote acknowledges it. Only trace id is sent
+
+        Args:
+            request (RequestFile): request to send
+        """
+        with self.__traces_lock:
+            self.__trace_id += 1
+            trace = request.trace
+            trace[u'sent'] = time.time()
+            self.__traces[self.__trace_id] = trace
+            while len(self.__traces) > self.MAX_PENDING_TRACES:
+                self.__traces.popitem(last=False)
+        request.trace = {u'id': self.__trace_id}
+
+    def __process_file_ack(self, ack):
+        """
+        Compute latency of acknowledged request by stage
+
+        Args:
+            ack (RequestFileAck): received acknowledge
+        """
+        with self.__traces_lock:
+            trace = self.__traces.pop(ack.trace.get(u'id'), None)
+        if trace is None:
             return
 
-        self.__send_request_to_remote(request)
+        #remote times are converted to local clock
+        received = ack.trace[u'received'] - self.__clock_offset
+        applied = ack.trace[u'applied'] - self.__clock_offset
+        stages = {
+            u'filter': trace[u'process'] - trace[u'event'],
+            u'wire': max(received - trace[u'sent'], 0.0),
+            u'queue': ack.trace[u'started'] - ack.trace[u'received'],
+            u'apply': ack.trace[u'applied'] - ack.trace[u'started'],
+            u'total': max(applied - trace[u'event'], 0.0)
+        }
+        if u'read' in trace:
+            stages[u'read'] = trace[u'read'] - trace[u'process']
+        for (stage, duration) in stages.items():
+            SYNC_STAGES[stage].observe(duration)
+        self.logger.debug(u'Request applied in %.1fms (%s)' % (stages[u'total'] * 1000.0, u', '.join([u'%s=%.1fms' % (stage, stages[stage] * 1000.0) for stage in SYNC_STAGES if stage in stages])))
+
+    def pull(self, path, timeout=60.0):
+        """
+        Pull content of lazy file from remote. File is replaced once its content is fully received
+
+        Args:
+            path (string): file path (absolute or relative to source code directory)
+            timeout (float): maximum time to wait for content (seconds)
+
+        Returns:
+            int: file size
+
+        Raises:
+            Exception if file can't be pulled
+        """
+        path = os.path.abspath(os.path.join(self.source_code_dir, path))
+        if not path.startswith(os.path.join(os.path.abspath(self.source_code_dir), u'')):
+            raise Exception(u'File "%s" is not in synchronized directory' % path)
+        if not self.is_connected():
+            raise Exception(u'Remote is not connected')
+
+        pulled = PulledFile(path)
+        request = RequestPull()
+        request.path = self.request_file_executor.file_path_converter.transform_path_to_send(path)[u'path']
+        with self.__pulls_lock:
+            self.__pull_id += 1
+            request.id = self.__pull_id
+            self.__pulls[request.id] = pulled
+
+        try:
+            self.logger.info(u'Pull "%s"' % request.path)
+            if not self.__send_request_to_remote(request):
+                raise Exception(u'Unable to send pull request')
+            if not pulled.wait(timeout):
+                raise Exception(u'Timeout pulling "%s" (%d bytes received)' % (request.path, pulled.size))
+            if pulled.error:
+                raise Exception(pulled.error)
+
+            return pulled.size
+
+        finally:
+            with self.__pulls_lock:
+                self.__pulls.pop(request.id, None)
+
+    def __process_pull(self, request):
+        """
+        Write received content part of pulled file
+
+        Args:
+            request (RequestPull): received content part
+        """
+        with self.__pulls_lock:
+            pulled = self.__pulls.get(request.id)
+        if pulled is None:
+            self.logger.debug(u'Drop content of cancelled pull %s' % request.path)
+            return
+
+        if len(request.content) > 0:
+            pulled.write(request.content)
+        if request.done:
+            if not request.error:
+                #file moved in place must not be sent back
+                history = RequestFile()
+                history.action = RequestFile.ACTION_CREATE
+                history.type = RequestFile.TYPE_FILE
+                history.src = request.path
+                history.md5 = request.md5
+                self.__history.append(history)
+            pulled.finish(request.md5, request.error)
+            self.logger.info(request.log_str())
+
+    def __open_body(self, req):
+        """
+        Open temp file receiving big file content of received request
+
+        Args:
+            req (dict): received request
+
+        Returns:
+            file: opened temp file or None to receive content in memory
+        """
+        if req.get(u'_type') != REQUEST_FILE or self.request_file_executor is None:
+            return None
+        try:
+            return self.request_file_executor.open_body(req.get(u'src'))
+        except Exception:
+            self.logger.exception(u'Unable to open temp file for "%s", content received in memory:' % req.get(u'src'))
+            return None
+
+    def __send_data(self, data, traffic_class, body=None):
+        """
+        Send bsonified request (sent from several threads), shaped if bandwidth is limited
+
+        Args:
+            data (dict): request (dict format)
+            traffic_class (string): request traffic class
+            body (FileBody): opened file body sent after request
+        """
+        if self.__shaper:
+            self.socket.sendobj(data, self.__shaper, traffic_class, body)
+        else:
+            with self.__send_lock:
+                self.socket.sendobj(data, body=body)
 
     def __send_request_to_remote(self, request):
         """
@@ -433,10 +1221,26 @@ class SynchronizerDevEnv(Thread):
         Return:
             bool: False if remote is not connected
         """
+        trace = getattr(request, u'trace', None)
         try:
             #send bsonified request
-            self.socket.sendobj(request.to_dict())
+            if request.get_type() == REQUEST_FILE and request.trace:
+                self.__trace_request(request)
+            data = request.to_dict()
+            body = getattr(request, u'body', None)
+            if body is not None and not body.open():
+                self.logger.debug(u'File changed before sending, request dropped (new request follows): %s' % request)
+                return True
+            try:
+                self.__send_data(data, TRAFFIC_CLASSES.get(request.get_type(), TRAFFIC_CONTROL), body)
+            finally:
+                if body is not None:
+                    body.close()
+            if self.recorder:
+                self.recorder.record(RECORD_SENT, dict(data, content=body.read()) if body is not None else data)
             self.__send_socket_attemps = 0
+            if request.get_type() == REQUEST_FILE:
+                FILE_REQUESTS_SENT.inc()
 
             self.logger.debug(u'Request sent: %s' % request.log_str())
 
@@ -446,6 +1250,7 @@ class SynchronizerDevEnv(Thread):
             logging.exception(u'Send request exception:')
 
             #sending problem watchdog
+            SEND_ERRORS.inc()
             self.__send_socket_attemps += 1
             if self.__send_socket_attemps > 10:
                 self.logger.critical('Too many sending attempts. Surely a unhandled bug, Please relaunch application with debug enabled and add new issue in repository joining debug output. Thank you very much.')
@@ -454,6 +1259,10 @@ class SynchronizerDevEnv(Thread):
             #disconnect all, it will reconnect after next try
             self.disconnect()
 
+            #request can be sent again once reconnected
+            if trace is not None:
+                request.trace = trace
+
         return False
 
     def stop(self):
@@ -467,13 +1276,14 @@ class SynchronizerDevEnv(Thread):
         Main process
         """
         self.logger.debug(u'SynchronizerDevEnv started')
+        patch_socket()
 
         #create RequestFileExecutor
         self.request_file_executor = RequestFileExecutor(self.source_code_dir)
         self.request_file_executor.start()
 
         #create RequestLogExecutor
-        self.request_log_executor = RequestLogExecutor(self.source_code_dir, self.remote_host)
+        self.request_log_executor = RequestLogExecutor(self.source_code_dir, self.name, **self.log_options)
         self.request_log_executor.start()
 
         receive_attempts = 0
@@ -501,9 +1311,11 @@ class SynchronizerDevEnv(Thread):
             #receive data
             try:
                 #receive request
-                req = self.socket.recvobj()
+                req = self.socket.recvobj(self.__open_body, self.__body_streams)
                 if req:
                     self.logger.debug('Received request %s' % req)
+                    if self.recorder:
+                        self.recorder.record(RECORD_RECEIVED, get_recorded_request(req))
 
                     #process request type
                     if req[u'_type'] == REQUEST_UNKNOW:
@@ -518,6 +1330,10 @@ class SynchronizerDevEnv(Thread):
                         self.logger.debug(u'Process RequestLog request')
                         self.request_log_executor.add_request(request)
             
+                    elif req[u'_type'] == REQUEST_FILE and req.get(u'_body_invalid'):
+                        #file changed while it was sent, a new request follows
+                        self.logger.debug(u'File request with invalid content dropped: %s' % req.get(u'src'))
+
                     elif req[u'_type'] == REQUEST_FILE:
                         #received file request
                         request = RequestFile()
@@ -525,10 +1341,23 @@ class SynchronizerDevEnv(Thread):
 
                         #append to history
                         self.__history.append(request)
+                        FILE_REQUESTS_RECEIVED.inc()
 
                         self.logger.debug('Process RequestFile request')
                         self.request_file_executor.add_request(request)
 
+                    elif req[u'_type'] == REQUEST_FILE_ACK:
+                        #received acknowledge of applied request
+                        request = RequestFileAck()
+                        request.from_dict(req)
+                        self.__process_file_ack(request)
+
+                    elif req[u'_type'] == REQUEST_PULL:
+                        #received pulled file content
+                        request = RequestPull()
+                        request.from_dict(req)
+                        self.__process_pull(request)
+
                     elif req[u'_type'] == REQUEST_GOODBYE:
                         #client disconnect, force server disconnection to allow new connection
                         #here no need to create new RequestGoodbye object
@@ -562,5 +1391,248 @@ class SynchronizerDevEnv(Thread):
             self.request_file_executor.stop()
         if self.request_log_executor:
             self.request_log_executor.stop()
+            self.request_log_executor.join()
 
         self.logger.debug(u'SynchronizerDevEnv terminated')
+
+
+
+
+
+class FanOutSender(Thread):
+    """
+    Send requests to one remote of a fan-out: requests are queued while remote is slow or disconnected, so other
+    remotes are not delayed. When queue is full, queued requests are replaced by the paths they change, and these
+    paths are resynchronized from their current state once remote is connected again (see RequestFileCreator.resync)
+    """
+
+    def __init__(self, synchronizer, max_pending=DEFAULT_FANOUT_QUEUE_SIZE):
+        """
+        Constructor
+
+        Args:
+            synchronizer (SynchronizerDevEnv): remote synchronizer
+            max_pending (int): maximum number of requests waiting to be sent
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        #members
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.running = True
+        self.synchronizer = synchronizer
+        self.max_pending = max_pending
+        self.__queue = deque()
+        self.__condition = Condition()
+        #function called with paths to resync and request callback, set by SynchronizerFanOut
+        self.resync_callback = None
+        #(sent path, type) of dropped requests, None if remote is in sync
+        self.__dirty = None
+        metric_name = re.sub(r'[^a-zA-Z0-9_]', u'_', synchronizer.name)
+        self.__pending = REGISTRY.gauge(u'remotedev_fanout_%s_pending' % metric_name, u'Requests waiting to be sent to remote %s' % synchronizer.name)
+        self.__dropped = REGISTRY.counter(u'remotedev_fanout_%s_dropped_total' % metric_name, u'Requests replaced by a resync because remote %s is too late' % synchronizer.name)
+        self.__resyncs = REGISTRY.counter(u'remotedev_fanout_%s_resync_total' % metric_name, u'Resynchronizations of remote %s' % synchronizer.name)
+
+    def stop(self):
+        """
+        Stop sender
+        """
+        self.running = False
+        with self.__condition:
+            self.__condition.notify()
+
+    def __add_dirty(self, request):
+        """
+        Add paths changed by request to resync
+        """
+        if self.__dirty is None:
+            self.__dirty = set()
+        if request.type == RequestFile.TYPE_ARCHIVE:
+            self.__dirty.update([(entry[u'path'], entry[u'type']) for entry in request.entries])
+        else:
+            self.__dirty.update([(path, request.type) for path in (request.src, request.dest) if path])
+        self.__dropped.inc()
+
+    def add_request(self, request):
+        """
+        Queue request
+
+        Args:
+            request (RequestFile): request copy dedicated to this remote
+        """
+        with self.__condition:
+            if self.__dirty is None and len(self.__queue) >= self.max_pending:
+                #keep changed paths only (memory is bounded by number of paths), remote is resynced later
+                self.logger.error(u'Remote %s is too late (%d pending requests), it will be resynchronized' % (self.synchronizer.name, len(self.__queue)))
+                while len(self.__queue) > 0:
+                    self.__add_dirty(self.__queue.popleft())
+            if self.__dirty is not None:
+                self.__add_dirty(request)
+            else:
+                self.__queue.append(request)
+            self.__pending.set(len(self.__queue))
+            self.__condition.notify()
+
+    def __resync(self):
+        """
+        Resync paths of dropped requests once queue is drained and remote connected
+        """
+        with self.__condition:
+            if self.__dirty is None or len(self.__queue) > 0 or self.resync_callback is None:
+                return
+            paths = self.__dirty
+            self.__dirty = None
+        self.logger.info(u'Resynchronize %d paths on remote %s' % (len(paths), self.synchronizer.name))
+        self.__resyncs.inc()
+        self.resync_callback(list(paths), self.__send_resync_request)
+
+    def __send_resync_request(self, request):
+        """
+        Send resync request straight to remote (resync doesn't fill queue), its paths stay dirty if it is not sent
+        """
+        if not self.synchronizer.add_request(request):
+            with self.__condition:
+                self.__add_dirty(request)
+
+    def __get_request(self):
+        """
+        Wait for request to send while remote is connected
+
+        Returns:
+            RequestFile: request or None if no request is available
+        """
+        with self.__condition:
+            if len(self.__queue) == 0:
+                self.__condition.wait(0.25)
+            if len(self.__queue) == 0 or not self.synchronizer.is_connected():
+                return None
+            return self.__queue[0]
+
+    def run(self):
+        """
+        Main process: send queued requests, request is removed from queue once sent (or dropped by synchronizer)
+        """
+        while self.running and self.synchronizer.running:
+            request = self.__get_request()
+            if request is None:
+                if not self.synchronizer.is_connected():
+                    time.sleep(0.25)
+                else:
+                    self.__resync()
+                continue
+
+            if self.synchronizer.add_request(request):
+                with self.__condition:
+                    if len(self.__queue) > 0 and self.__queue[0] is request:
+                        self.__queue.popleft()
+                    self.__pending.set(len(self.__queue))
+
+
+
+
+
+class SynchronizerFanOut():
+    """
+    Synchronize a single development directory with several remotes: one filesystem watcher and one read/hash
+    pipeline feed all remotes. Each remote has its own synchronizer (connection, history, traces) and sender queue,
+    so a slow or offline remote doesn't hold up the others
+    """
+
+    def __init__(self, synchronizers, max_pending=DEFAULT_FANOUT_QUEUE_SIZE):
+        """
+        Constructor
+
+        Args:
+            synchronizers (list): list of SynchronizerDevEnv (one per remote)
+            max_pending (int): maximum number of requests waiting to be sent to each remote
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.synchronizers = synchronizers
+        self.senders = [FanOutSender(synchronizer, max_pending) for synchronizer in synchronizers]
+
+    @property
+    def running(self):
+        """
+        Return True while at least one synchronizer is running
+        """
+        return any([synchronizer.running for synchronizer in self.synchronizers])
+
+    def start(self):
+        """
+        Start synchronizers and senders
+        """
+        for synchronizer in self.synchronizers:
+            synchronizer.start()
+        for sender in self.senders:
+            sender.start()
+
+    def stop(self):
+        """
+        Stop senders and synchronizers
+        """
+        for sender in self.senders:
+            sender.stop()
+        for synchronizer in self.synchronizers:
+            synchronizer.stop()
+
+    def join(self):
+        """
+        Wait for synchronizers end
+        """
+        for synchronizer in self.synchronizers:
+            synchronizer.join()
+
+    def __copy_request(self, request):
+        """
+        Return request copy: synchronizers alter trace and archive entries, and open body of sent requests
+        """
+        out = copy.copy(request)
+        if request.trace is not None:
+            out.trace = dict(request.trace)
+        out.entries = list(request.entries)
+        if request.body is not None:
+            out.body = copy.copy(request.body)
+
+        return out
+
+    def set_resync_callback(self, callback):
+        """
+        Set function resyncing paths of a remote that missed requests
+
+        Args:
+            callback (function): function called with list of (sent path, type) and request callback of remote
+        """
+        for sender in self.senders:
+            sender.resync_callback = callback
+
+    def add_request(self, request):
+        """
+        Queue request for all remotes
+
+        Args:
+            request (RequestFile): request to send
+        """
+        for sender in self.senders:
+            sender.add_request(self.__copy_request(request))
+
+    def pull(self, path, timeout=60.0):
+        """
+        Pull content of lazy file from first connected remote that has it
+
+        Returns:
+            int: file size
+
+        Raises:
+            Exception if file can't be pulled
+        """
+        error = Exception(u'Remote is not connected')
+        for synchronizer in self.synchronizers:
+            if not synchronizer.is_connected():
+                continue
+            try:
+                return synchronizer.pull(path, timeout)
+            except Exception as e:
+                self.logger.debug(u'Unable to pull "%s" from %s: %s' % (path, synchronizer.name, e))
+                error = e
+
+        raise error
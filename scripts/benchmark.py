@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end sync benchmark: run devenv and execenv in the same process against temp directories, devenv being
+directly connected to execenv on loopback (no ssh tunnel), and drive standard workloads:
+ - save: single small file saved several times
+ - checkout: many small files created at once
+ - binary: large binary file
+ - move: directory of files moved
+ - copytree: directory tree copied at once (cp -r, unpacked archive)
+ - logflood: execenv application logs shipped to devenv
+
+Usage: python scripts/benchmark.py [--output=results.json] [--workloads=save,checkout,...] [--port=52766]
+       [--saves=20] [--files=1000] [--binary-mb=20] [--move-files=200] [--tree-files=1000]
+       [--logs=20000] [--bandwidth=0] [--timeout=120]
+--bandwidth limits sync traffic of both sides (bytes per second, 0 for unlimited).
+Results (throughput, latency percentiles, cpu and rss) are written as json to compare runs across versions.
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import logging
+import platform
+import tempfile
+import resource
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), u'..'))
+sys.path.insert(0, ROOT_DIR)
+
+from pyremotedev.pyremotedev import PyRemoteDev, PyRemoteExec
+from pyremotedev.metrics import REGISTRY
+from pyremotedev.version import __version__
+
+WORKLOADS = [u'save', u'checkout', u'binary', u'move', u'copytree', u'logflood']
+REMOTE_HOST = u'127.0.0.1'
+FLOOD_LOGGER = u'benchmark.flood'
+
+
+def percentiles(samples):
+    """
+    Compute samples percentiles
+
+    Args:
+        samples (list): list of values
+
+    Returns:
+        dict: p50, p95, p99, min and max (None values if there is no sample)
+    """
+    if len(samples) == 0:
+        return dict([(key, None) for key in (u'p50', u'p95', u'p99', u'min', u'max')])
+
+    values = sorted(samples)
+    def get(quantile):
+        return values[min(len(values) - 1, int(quantile * len(values)))]
+
+    return {
+        u'p50': get(0.5),
+        u'p95': get(0.95),
+        u'p99': get(0.99),
+        u'min': values[0],
+        u'max': values[-1]
+    }
+
+def get_rss_mb():
+    """
+    Return current resident set size
+
+    Returns:
+        float: rss in MB (peak rss if current one is not available)
+    """
+    try:
+        with open(u'/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except (IOError, OSError):
+        #ru_maxrss is in KB on linux, in bytes on macos
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / (1048576.0 if sys.platform == u'darwin' else 1024.0)
+
+def get_cpu_seconds():
+    """
+    Return cpu time (user + system) used by process
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def wait_for(condition, timeout, interval=0.002):
+    """
+    Wait until condition is True
+
+    Args:
+        condition (function): function returning bool
+        timeout (float): maximum time to wait
+        interval (float): polling interval
+
+    Returns:
+        float: time when condition became True
+
+    Raises:
+        Exception if timeout is reached
+    """
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return time.time()
+        time.sleep(interval)
+
+    raise Exception(u'Timeout waiting for workload completion')
+
+def file_has_content(path, content):
+    """
+    Return True if file exists with specified content
+    """
+    try:
+        with open(path, u'rb') as fd:
+            return fd.read() == content
+    except (IOError, OSError):
+        return False
+
+def count_files(path):
+    """
+    Return number of files under specified path
+    """
+    count = 0
+    for (_, _, files) in os.walk(path):
+        count += len(files)
+    return count
+
+def count_lines(path, marker):
+    """
+    Return number of lines containing marker in specified file
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, u'rb') as fd:
+        return fd.read().count(marker)
+
+def run_save(src, dst, options):
+    """
+    Save same small file several times, waiting for each save to be applied
+    """
+    latencies = []
+    for index in range(options[u'saves']):
+        content = (u'value = %d\n' % index).encode(u'utf-8') * 10
+        start = time.time()
+        with open(os.path.join(src, u'save.py'), u'wb') as fd:
+            fd.write(content)
+        end = wait_for(lambda: file_has_content(os.path.join(dst, u'save.py'), content), options[u'timeout'])
+        latencies.append(end - start)
+        #let file watchers settle to measure independent saves
+        time.sleep(0.1)
+
+    return {
+        u'count': len(latencies),
+        u'duration': sum(latencies),
+        u'latency': percentiles(latencies)
+    }
+
+def run_checkout(src, dst, options):
+    """
+    Create many small files at once (as a vcs checkout does)
+    """
+    count = options[u'files']
+    start = time.time()
+    for index in range(count):
+        path = os.path.join(src, u'checkout', u'module%02d' % (index % 50))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, u'file%04d.py' % index), u'wb') as fd:
+            fd.write((u'#file %d\n' % index).encode(u'utf-8') * 50)
+    end = wait_for(lambda: count_files(os.path.join(dst, u'checkout')) >= count, options[u'timeout'], 0.02)
+    duration = end - start
+
+    return {
+        u'count': count,
+        u'duration': duration,
+        u'files_per_second': count / duration
+    }
+
+def run_binary(src, dst, options):
+    """
+    Write large binary file
+    """
+    content = os.urandom(options[u'binary_mb'] * 1048576)
+    start = time.time()
+    with open(os.path.join(src, u'binary.bin'), u'wb') as fd:
+        fd.write(content)
+    end = wait_for(lambda: file_has_content(os.path.join(dst, u'binary.bin'), content), options[u'timeout'], 0.05)
+    duration = end - start
+
+    return {
+        u'count': 1,
+        u'bytes': len(content),
+        u'duration': duration,
+        u'mb_per_second': options[u'binary_mb'] / duration
+    }
+
+def run_move(src, dst, options):
+    """
+    Move directory containing files
+    """
+    count = options[u'move_files']
+    os.makedirs(os.path.join(src, u'movesrc'))
+    for index in range(count):
+        with open(os.path.join(src, u'movesrc', u'file%04d.py' % index), u'wb') as fd:
+            fd.write((u'#file %d\n' % index).encode(u'utf-8'))
+    wait_for(lambda: count_files(os.path.join(dst, u'movesrc')) >= count, options[u'timeout'], 0.02)
+    time.sleep(0.5)
+
+    start = time.time()
+    os.rename(os.path.join(src, u'movesrc'), os.path.join(src, u'movedst'))
+    end = wait_for(lambda: not os.path.exists(os.path.join(dst, u'movesrc')) and count_files(os.path.join(dst, u'movedst')) >= count, options[u'timeout'], 0.02)
+    duration = end - start
+
+    return {
+        u'count': count,
+        u'duration': duration,
+        u'files_per_second': count / duration
+    }
+
+def run_copytree(src, dst, options):
+    """
+    Copy directory tree prepared outside synchronized directory
+    """
+    count = options[u'tree_files']
+    #tree is prepared outside devenv directory
+    tree = os.path.join(os.path.dirname(os.path.dirname(src)), u'tree')
+    for index in range(count):
+        path = os.path.join(tree, u'package%02d' % (index % 20), u'sub%d' % (index % 3))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, u'file%04d.py' % index), u'wb') as fd:
+            fd.write((u'#file %d\n' % index).encode(u'utf-8') * 50)
+
+    start = time.time()
+    shutil.copytree(tree, os.path.join(src, u'copytree'))
+    end = wait_for(lambda: count_files(os.path.join(dst, u'copytree')) >= count, options[u'timeout'], 0.02)
+    duration = end - start
+
+    return {
+        u'count': count,
+        u'duration': duration,
+        u'files_per_second': count / duration
+    }
+
+def run_logflood(local_dir, options):
+    """
+    Emit application logs on execenv and wait for them in devenv remote log file.
+    Records dropped by execenv log queue (overflow policy) are reported, not waited for
+    """
+    count = options[u'logs']
+    marker = u'flood record'.encode(u'utf-8')
+    logger = logging.getLogger(FLOOD_LOGGER)
+    logger.setLevel(logging.INFO)
+    log_path = os.path.join(local_dir, u'remote_%s.log' % REMOTE_HOST)
+    already = count_lines(log_path, marker)
+    dropped_counter = REGISTRY.counter(u'remotedev_log_records_dropped_total')
+    already_dropped = dropped_counter.value
+
+    start = time.time()
+    for index in range(count):
+        logger.info(u'flood record %d', index)
+    emitted = time.time()
+    end = wait_for(lambda: count_lines(log_path, marker) - already + dropped_counter.value - already_dropped >= count, options[u'timeout'], 0.05)
+    duration = end - start
+    delivered = count_lines(log_path, marker) - already
+
+    return {
+        u'count': count,
+        u'delivered': delivered,
+        u'dropped': dropped_counter.value - already_dropped,
+        u'duration': duration,
+        u'emit_us_per_record': (emitted - start) * 1000000.0 / count,
+        u'records_per_second': delivered / duration
+    }
+
+def run_workload(name, src, dst, local_dir, options):
+    """
+    Run specified workload measuring cpu and rss
+
+    Returns:
+        dict: workload results
+    """
+    cpu = get_cpu_seconds()
+    if name == u'save':
+        result = run_save(src, dst, options)
+    elif name == u'checkout':
+        result = run_checkout(src, dst, options)
+    elif name == u'binary':
+        result = run_binary(src, dst, options)
+    elif name == u'move':
+        result = run_move(src, dst, options)
+    elif name == u'copytree':
+        result = run_copytree(src, dst, options)
+    else:
+        result = run_logflood(local_dir, options)
+    result[u'cpu_seconds'] = get_cpu_seconds() - cpu
+    result[u'rss_mb'] = get_rss_mb()
+
+    return result
+
+def get_sync_stages():
+    """
+    Return save to applied latency by stage measured by devenv
+    """
+    return dict([(name, value) for (name, value) in REGISTRY.collect().items() if name.startswith(u'remotedev_sync_')])
+
+def run(workloads, options):
+    """
+    Start devenv and execenv and run workloads
+
+    Returns:
+        dict: benchmark results
+    """
+    temp_dir = tempfile.mkdtemp()
+    local_dir = os.path.join(temp_dir, u'devenv')
+    src = os.path.join(local_dir, u'app')
+    dst = os.path.join(temp_dir, u'execenv')
+    os.makedirs(src)
+    os.makedirs(dst)
+    bandwidth_limits = {u'total': options[u'bandwidth']} if options[u'bandwidth'] > 0 else {}
+
+    execenv = PyRemoteExec({
+        u'log_file_path': None,
+        u'exec_port': options[u'port'],
+        u'metrics_endpoint': u'',
+        u'bandwidth_limits': bandwidth_limits,
+        u'mappings': {
+            u'app/': {u'dest': dst + u'/', u'link': u''}
+        }
+    }, remote_logging=True)
+    devenv = PyRemoteDev({
+        u'remote_host': REMOTE_HOST,
+        u'remote_port': 22,
+        u'ssh_username': u'',
+        u'ssh_password': u'',
+        u'local_dir': local_dir,
+        u'exec_port': options[u'port'],
+        u'ssh_tunnel': False,
+        u'metrics_endpoint': u'',
+        u'bandwidth_limits': bandwidth_limits
+    })
+
+    results = {
+        u'version': __version__,
+        u'python': platform.python_version(),
+        u'platform': platform.platform(),
+        u'date': time.strftime(u'%Y-%m-%dT%H:%M:%S'),
+        u'options': options,
+        u'workloads': {}
+    }
+    try:
+        execenv.start()
+        time.sleep(0.5)
+        devenv.start()
+        #wait for devenv connection to execenv
+        wait_for(lambda: REGISTRY.counter(u'remotedev_connections_total').value > 0, 10.0, 0.05)
+        time.sleep(0.5)
+
+        for name in workloads:
+            sys.stderr.write(u'Running %s...\n' % name)
+            results[u'workloads'][name] = run_workload(name, src, dst, local_dir, options)
+            time.sleep(0.5)
+
+        results[u'sync_stages'] = get_sync_stages()
+        results[u'metrics'] = REGISTRY.collect()
+
+    finally:
+        devenv.stop()
+        execenv.stop()
+        devenv.join()
+        execenv.join()
+        shutil.rmtree(temp_dir)
+
+    return results
+
+def main():
+    """
+    Main
+    """
+    output = None
+    workloads = list(WORKLOADS)
+    options = {
+        u'port': 52766,
+        u'saves': 20,
+        u'files': 1000,
+        u'binary_mb': 20,
+        u'move_files': 200,
+        u'tree_files': 1000,
+        u'logs': 20000,
+        u'bandwidth': 0,
+        u'timeout': 120.0
+    }
+    opts, _ = getopt.getopt(sys.argv[1:], u'', [u'output=', u'workloads=', u'port=', u'saves=', u'files=', u'binary-mb=', u'move-files=', u'tree-files=', u'logs=', u'bandwidth=', u'timeout='])
+    for opt, arg in opts:
+        if opt == u'--output':
+            output = arg
+        elif opt == u'--workloads':
+            workloads = [workload.strip() for workload in arg.split(u',') if workload.strip()]
+        elif opt == u'--timeout':
+            options[u'timeout'] = float(arg)
+        else:
+            options[opt[2:].replace(u'-', u'_')] = int(arg)
+
+    unknown = set(workloads).difference(WORKLOADS)
+    if unknown:
+        sys.stderr.write(u'Unknown workload(s): %s\n' % u', '.join(sorted(unknown)))
+        sys.exit(2)
+
+    #only report warnings on console, flood logs are only shipped to devenv
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    handler.setFormatter(logging.Formatter(u'%(asctime)s %(name)s %(levelname)s : %(message)s'))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run(workloads, options)
+
+    content = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, u'w') as fd:
+            fd.write(content)
+    else:
+        print(content)
+
+if __name__ == u'__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import time benchmark: guard startup time of pyremotedev module and of remotedev execenv mode.
+It runs python with -X importtime (python >= 3.7) and parses its output.
+
+Usage: python scripts/importtime.py [--import-budget-ms=150] [--execenv-budget-ms=300] [--wait=2.0]
+Exit code is 1 if a budget is exceeded or if a forbidden module is imported.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import getopt
+import tempfile
+import shutil
+import subprocess
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), u'..'))
+
+#modules that must not be imported by checked startup
+FORBIDDEN_ON_IMPORT = [u'sshtunnel', u'paramiko', u'bson', u'watchdog', u'pygtail']
+FORBIDDEN_ON_EXECENV = [u'sshtunnel', u'paramiko']
+
+
+def parse_importtime(output):
+    """
+    Parse -X importtime output
+
+    Args:
+        output (string): python stderr
+
+    Returns:
+        list: list of tuples (module, self time us, cumulative time us)
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith(u'import time:') or u'self [us]' in line:
+            continue
+        parts = line[len(u'import time:'):].split(u'|')
+        if len(parts) != 3:
+            continue
+        try:
+            modules.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+        except ValueError:
+            pass
+
+    return modules
+
+def get_env():
+    """
+    Return environment to run python on local sources
+    """
+    env = dict(os.environ)
+    env[u'PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get(u'PYTHONPATH', u'')
+    return env
+
+def check(name, modules, budget_ms, forbidden):
+    """
+    Check parsed modules against budget and forbidden modules
+
+    Returns:
+        bool: True if check passed
+    """
+    total_ms = sum([module[1] for module in modules]) / 1000.0
+    imported = set([module[0].split(u'.')[0] for module in modules])
+    found = sorted(imported.intersection(forbidden))
+    slowest = sorted(modules, key=lambda module: module[2], reverse=True)[:5]
+
+    print(u'%s: %.1f ms for %d modules (budget %.1f ms)' % (name, total_ms, len(modules), budget_ms))
+    for (module, _, cumulative) in slowest:
+        print(u'    %8.1f ms  %s' % (cumulative / 1000.0, module))
+
+    passed = True
+    if total_ms > budget_ms:
+        print(u'  FAILED: budget exceeded')
+        passed = False
+    if len(found) > 0:
+        print(u'  FAILED: forbidden modules imported: %s' % u', '.join(found))
+        passed = False
+
+    return passed
+
+def measure_import():
+    """
+    Measure "import pyremotedev"
+
+    Returns:
+        list: parsed modules
+    """
+    proc = subprocess.Popen([sys.executable, u'-X', u'importtime', u'-c', u'import pyremotedev'], stderr=subprocess.PIPE, env=get_env())
+    (_, stderr) = proc.communicate()
+    return parse_importtime(stderr.decode(u'utf-8', u'replace'))
+
+def measure_execenv(wait):
+    """
+    Measure "bin/remotedev.py -E" startup: launch it with empty profile and interrupt it after specified time
+
+    Args:
+        wait (float): time to wait before interrupting remotedev
+
+    Returns:
+        list: parsed modules
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        conf = os.path.join(temp_dir, u'execenv.conf')
+        with open(conf, u'w') as fd:
+            json.dump({u'bench': {}}, fd)
+        cmd = [sys.executable, u'-X', u'importtime', os.path.join(ROOT_DIR, u'bin', u'remotedev.py'), u'-E', u'-c', conf, u'-p', u'bench']
+        proc = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, env=get_env())
+        time.sleep(wait)
+        proc.send_signal(signal.SIGINT)
+        (_, stderr) = proc.communicate()
+        return parse_importtime(stderr.decode(u'utf-8', u'replace'))
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+def main():
+    """
+    Main
+    """
+    import_budget_ms = 150.0
+    execenv_budget_ms = 300.0
+    wait = 2.0
+    opts, _ = getopt.getopt(sys.argv[1:], u'', [u'import-budget-ms=', u'execenv-budget-ms=', u'wait='])
+    for opt, arg in opts:
+        if opt == u'--import-budget-ms':
+            import_budget_ms = float(arg)
+        elif opt == u'--execenv-budget-ms':
+            execenv_budget_ms = float(arg)
+        elif opt == u'--wait':
+            wait = float(arg)
+
+    passed = check(u'import pyremotedev', measure_import(), import_budget_ms, FORBIDDEN_ON_IMPORT)
+    passed = check(u'remotedev -E', measure_execenv(wait), execenv_budget_ms, FORBIDDEN_ON_EXECENV) and passed
+
+    sys.exit(0 if passed else 1)
+
+if __name__ == u'__main__':
+    main()
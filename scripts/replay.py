@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay file requests recorded with "remotedev --capture" on execenv side, into a temp (or specified) directory:
+ - synchronizer target: requests are sent through a socket to a SynchronizerExecEnv (bson decoding, executor
+   queue, filesystem and acknowledges)
+ - executor target: requests are directly queued in a RequestFileExecutor (filesystem only)
+Requests are replayed at original speed (--speed=1), faster (--speed=10) or as fast as possible (--speed=0).
+
+Usage: python scripts/replay.py --capture=capture.bin[.gz] [--target=synchronizer|executor] [--speed=1.0]
+       [--dest=dir] [--output=results.json] [--timeout=120]
+Results (duration, throughput, replay and apply latency percentiles) are written as json.
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import logging
+import socket
+import tempfile
+from threading import Thread, Lock, Event
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), u'..'))
+sys.path.insert(0, ROOT_DIR)
+
+from pyremotedev.recorder import read_records, get_replayed_direction, RECORD_HEADER
+from pyremotedev.request import RequestFile, REQUEST_FILE, REQUEST_FILE_ACK
+from pyremotedev.file import RequestFileExecutor
+from pyremotedev.synchronizer import SynchronizerExecEnv, patch_socket
+
+TARGETS = [u'synchronizer', u'executor']
+
+
+def percentiles(samples):
+    """
+    Compute samples percentiles
+
+    Args:
+        samples (list): list of values
+
+    Returns:
+        dict: p50, p95, p99 and max (None values if there is no sample)
+    """
+    if len(samples) == 0:
+        return dict([(key, None) for key in (u'p50', u'p95', u'p99', u'max')])
+
+    values = sorted(samples)
+    def get(quantile):
+        return values[min(len(values) - 1, int(quantile * len(values)))]
+
+    return {
+        u'p50': get(0.5),
+        u'p95': get(0.95),
+        u'p99': get(0.99),
+        u'max': values[-1]
+    }
+
+def load_requests(path):
+    """
+    Load file requests to replay from capture
+
+    Args:
+        path (string): capture file path
+
+    Returns:
+        tuple: (capture header, list of (timestamp, request dict))
+    """
+    header = None
+    direction = None
+    requests = []
+    for record in read_records(path):
+        if record[u'd'] == RECORD_HEADER:
+            header = record
+            direction = get_replayed_direction(header)
+        elif record[u'd'] == direction and record[u'r'].get(u'_type') == REQUEST_FILE:
+            requests.append((record[u't'], record[u'r']))
+
+    if header is None:
+        raise Exception(u'Invalid capture file "%s" (no header)' % path)
+
+    return (header, requests)
+
+
+
+
+
+class Acknowledges():
+    """
+    Collect acknowledges of replayed requests
+    """
+
+    def __init__(self, count):
+        """
+        Constructor
+
+        Args:
+            count (int): number of expected acknowledges
+        """
+        self.count = count
+        self.sent = {}
+        self.acks = {}
+        self.__lock = Lock()
+        self.__done = Event()
+        if count == 0:
+            self.__done.set()
+
+    def add_sent(self, request_id):
+        """
+        Store request sending time
+        """
+        self.sent[request_id] = time.time()
+
+    def add_ack(self, trace):
+        """
+        Store acknowledge (trace with id, received, started, applied)
+        """
+        with self.__lock:
+            self.acks[trace[u'id']] = trace
+            if len(self.acks) >= self.count:
+                self.__done.set()
+
+    def wait(self, timeout):
+        """
+        Wait for all acknowledges
+
+        Returns:
+            bool: True if all requests were acknowledged
+        """
+        return self.__done.wait(timeout)
+
+    def get_latencies(self):
+        """
+        Return latencies of acknowledged requests
+
+        Returns:
+            dict: replay (sent to applied), queue and apply latencies percentiles
+        """
+        acks = list(self.acks.values())
+        return {
+            u'replay': percentiles([ack[u'applied'] - self.sent[ack[u'id']] for ack in acks if ack[u'id'] in self.sent]),
+            u'queue': percentiles([ack[u'started'] - ack[u'received'] for ack in acks]),
+            u'apply': percentiles([ack[u'applied'] - ack[u'started'] for ack in acks])
+        }
+
+
+
+
+
+class AckReader(Thread):
+    """
+    Read acknowledges sent back by synchronizer
+    """
+
+    def __init__(self, sock, acknowledges):
+        """
+        Constructor
+        """
+        Thread.__init__(self)
+        Thread.daemon = True
+
+        self.running = True
+        self.socket = sock
+        self.acknowledges = acknowledges
+
+    def stop(self):
+        """
+        Stop reader
+        """
+        self.running = False
+
+    def run(self):
+        """
+        Main process
+        """
+        while self.running:
+            try:
+                req = self.socket.recvobj()
+            except socket.error:
+                break
+            if req is None:
+                break
+            if req.get(u'_type') == REQUEST_FILE_ACK and req.get(u'trace'):
+                self.acknowledges.add_ack(req[u'trace'])
+
+
+
+
+
+def feed(requests, speed, send):
+    """
+    Feed requests keeping original timing
+
+    Args:
+        requests (list): list of (timestamp, request dict)
+        speed (float): replay speed factor (0 for as fast as possible)
+        send (function): function called with each request id and dict
+    """
+    if len(requests) == 0:
+        return
+
+    first = requests[0][0]
+    start = time.time()
+    for (index, (timestamp, data)) in enumerate(requests):
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+        request = dict(data)
+        request[u'trace'] = {u'id': index}
+        send(index, request)
+
+def replay_synchronizer(requests, dest, speed, acknowledges, timeout):
+    """
+    Replay requests through socket on SynchronizerExecEnv
+
+    Returns:
+        float: feeding duration
+    """
+    patch_socket()
+    (client, server) = socket.socketpair()
+    synchronizer = SynchronizerExecEnv(u'replay', 0, server, dest, False, False)
+    synchronizer.start()
+    reader = AckReader(client, acknowledges)
+    reader.start()
+
+    def send(index, request):
+        acknowledges.add_sent(index)
+        client.sendobj(request)
+
+    try:
+        start = time.time()
+        feed(requests, speed, send)
+        return time.time() - start
+
+    finally:
+        acknowledges.wait(timeout)
+        reader.stop()
+        synchronizer.stop()
+        client.close()
+
+def replay_executor(requests, dest, speed, acknowledges, timeout):
+    """
+    Replay requests directly on RequestFileExecutor
+
+    Returns:
+        float: feeding duration
+    """
+    executor = RequestFileExecutor(dest, ack_callback=acknowledges.add_ack)
+    executor.start()
+
+    def send(index, data):
+        request = RequestFile()
+        request.from_dict(data)
+        request.trace[u'received'] = time.time()
+        acknowledges.add_sent(index)
+        executor.add_request(request)
+
+    try:
+        start = time.time()
+        feed(requests, speed, send)
+        return time.time() - start
+
+    finally:
+        acknowledges.wait(timeout)
+        executor.stop()
+
+def prepare_dest(requests, dest):
+    """
+    Create parent directories of replayed requests paths: capture may start on files existing on execenv
+    (update requests) that don't exist in replay directory
+    """
+    for (_, data) in requests:
+        for path in (data.get(u'src'), data.get(u'dest')):
+            if path:
+                parent = os.path.dirname(os.path.join(dest, path))
+                if not os.path.exists(parent):
+                    os.makedirs(parent)
+
+def replay(capture, target, speed, dest, timeout):
+    """
+    Replay capture
+
+    Args:
+        capture (string): capture file path
+        target (string): synchronizer or executor
+        speed (float): replay speed factor (0 for as fast as possible)
+        dest (string): directory where requests are applied
+        timeout (float): time to wait for acknowledges after feeding
+
+    Returns:
+        dict: replay results
+    """
+    (header, requests) = load_requests(capture)
+    acknowledges = Acknowledges(len(requests))
+    size = sum([len(data.get(u'content') or b'') + sum([len(entry.get(u'content', b'')) for entry in data.get(u'entries', [])]) for (_, data) in requests])
+    prepare_dest(requests, dest)
+
+    start = time.time()
+    if target == u'executor':
+        feed_duration = replay_executor(requests, dest, speed, acknowledges, timeout)
+    else:
+        feed_duration = replay_synchronizer(requests, dest, speed, acknowledges, timeout)
+    duration = time.time() - start
+
+    return {
+        u'capture': {
+            u'path': capture,
+            u'mode': header.get(u'mode'),
+            u'version': header.get(u'version'),
+            u'duration': requests[-1][0] - requests[0][0] if requests else 0.0
+        },
+        u'target': target,
+        u'speed': speed,
+        u'requests': len(requests),
+        u'acknowledged': len(acknowledges.acks),
+        u'bytes': size,
+        u'feed_duration': feed_duration,
+        u'duration': duration,
+        u'requests_per_second': len(acknowledges.acks) / duration if duration > 0 else None,
+        u'mb_per_second': size / 1048576.0 / duration if duration > 0 else None,
+        u'latency': acknowledges.get_latencies()
+    }
+
+def main():
+    """
+    Main
+    """
+    capture = None
+    target = u'synchronizer'
+    speed = 1.0
+    dest = None
+    output = None
+    timeout = 120.0
+    opts, _ = getopt.getopt(sys.argv[1:], u'', [u'capture=', u'target=', u'speed=', u'dest=', u'output=', u'timeout='])
+    for opt, arg in opts:
+        if opt == u'--capture':
+            capture = arg
+        elif opt == u'--target':
+            target = arg
+        elif opt == u'--speed':
+            speed = float(arg)
+        elif opt == u'--dest':
+            dest = arg
+        elif opt == u'--output':
+            output = arg
+        elif opt == u'--timeout':
+            timeout = float(arg)
+
+    if not capture or target not in TARGETS:
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.WARNING, format=u'%(asctime)s %(name)s %(levelname)s : %(message)s')
+    temp_dir = None
+    if dest is None:
+        temp_dir = tempfile.mkdtemp()
+        dest = temp_dir
+    try:
+        results = replay(capture, target, speed, dest, timeout)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+    content = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, u'w') as fd:
+            fd.write(content)
+    else:
+        print(content)
+
+    sys.exit(0 if results[u'acknowledged'] == results[u'requests'] else 1)
+
+if __name__ == u'__main__':
+    main()